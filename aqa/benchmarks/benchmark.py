@@ -1,10 +1,50 @@
 import abc
+import asyncio
+from collections import deque
+from copy import copy, deepcopy
+from itertools import islice
 from loguru import logger
 import json
+import math
+import multiprocessing as mp
+import os
 import os.path as osp
-import pickle as pkl
+import queue
+import random
+import threading
 
-from aqa.utils import DialogLogger, dict_mean, InvalidEncoder, setup_logger
+from aqa.utils import DialogLogger, DictAggregator, EpisodeLog, parse_invalid, setup_logger
+
+# per-process states of the workers used by `Benchmark.test_with_examples`
+_worker = {}
+
+# event loops running the forked calls of the sync tests, one per process so that the
+# async clients of the models outlive the test cases, see `Benchmark._call_forked`
+_loops = {}  # pid -> event loop
+_loops_lock = threading.Lock()
+
+
+def _get_loop():
+    pid = os.getpid()
+    with _loops_lock:
+        if pid not in _loops:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True).start()
+            _loops[pid] = loop
+        return _loops[pid]
+
+
+def _init_worker(benchmark, config):
+    # to avoid circular imports
+    from aqa.models import build_model
+
+    setup_logger(output=benchmark.output_dir)
+    _worker["benchmark"] = benchmark
+    _worker["model"] = build_model(config)
+
+
+def _run_single_test_in_worker(args):
+    return _worker["benchmark"]._run_single_test(_worker["model"], *args)
 
 
 class Benchmark(metaclass=abc.ABCMeta):
@@ -19,13 +59,16 @@ class Benchmark(metaclass=abc.ABCMeta):
         self.max_step = max_step
 
         self.teacher = None
+        # use `self.rng` instead of the global `random`, it is re-created with a per-test seed
+        # in `pre_each_test`
+        self.rng = random.Random()
         self.dialog_logger = DialogLogger(order=["System", "Q", "A", "T"], enabled=verbose)
         self.test_cases = []
         self.output_dir = output_dir
         setup_logger(output=output_dir)
 
-        # `self.save_period > 0`: save every `self.save_period` test cases
-        # `self.save_period == 0`: only save the final result
+        # `self.save_period > 0`: save every test case, checkpoint every `self.save_period`
+        # `self.save_period == 0`: save every test case, only checkpoint the final result
         # `self.save_period < 0`: dont save results at all
         self.save_period = save_period
         assert self.save_period < 0 or self.output_dir is not None
@@ -39,6 +82,7 @@ class Benchmark(metaclass=abc.ABCMeta):
         self.test_case = test_case
         self.teacher.reset()
         self._teacher_qa_list = []
+        self._teacher_scores = None  # see `_score_forced`
 
     def reset_model(self, model, instruction=None, example_qa_lists=None, verbose=True):
         # clear dialog history and give instruction
@@ -47,6 +91,7 @@ class Benchmark(metaclass=abc.ABCMeta):
             instruction = self.default_instruction
 
         model.reset(instruction)
+        self._set_answer_space(model, self._get_answer_space())
         if verbose:
             self.dialog_logger.info(System=instruction)
 
@@ -59,6 +104,15 @@ class Benchmark(metaclass=abc.ABCMeta):
                         self.dialog_logger.info(Q=q)
                         self.dialog_logger.info(A=a)
 
+    def _get_answer_space(self):
+        # integers the replies may be, any if None
+        return None
+
+    def _set_answer_space(self, model, answers=None):
+        # only used by the models with constrained decoding, e.g. `FastChatModel`
+        if hasattr(model, "set_answer_space"):
+            model.set_answer_space(answers)
+
     def _preprocess_examples(self, qa_lists):
         example_qa_lists = []
         for qa_list in qa_lists:
@@ -67,7 +121,10 @@ class Benchmark(metaclass=abc.ABCMeta):
 
         return example_qa_lists
 
-    def pre_each_test(self, model, instruction=None, test_case=None, example_qa_lists=None):
+    def pre_each_test(
+        self, model, instruction=None, test_case=None, example_qa_lists=None, seed=None
+    ):
+        self.rng = random.Random(seed)
         self.reset(test_case)
         # will use `self.default_instruction` if `instruction` is None
         self.reset_model(model, instruction, example_qa_lists)
@@ -87,6 +144,8 @@ class Benchmark(metaclass=abc.ABCMeta):
             answer_list=answer_list,
             teacher_answer_list=teacher_answer_list
         )
+        if teacher_forcing and self._teacher_scores is not None:
+            result["output"]["teacher_scores"] = self._teacher_scores
         result["env"] = dict(
             teacher_forcing=teacher_forcing,
             instruction=self.default_instruction if instruction is None else instruction
@@ -98,17 +157,22 @@ class Benchmark(metaclass=abc.ABCMeta):
 
         return result
 
-    def _pack_results(self, single_results, teacher_forcing_mode):
+    def _pack_results(self, single_results, teacher_forcing_mode, aggregator=None):
         # summarize the metrics from each test run and pack the detailed results
-        metrics = [result["metric"] for result in single_results]
-        metric = dict_mean(metrics)
+        # `aggregator`: `DictAggregator` of the metrics if `single_results` are not all kept
+        if aggregator is None:
+            aggregator = DictAggregator()
+            for result in single_results:
+                aggregator.update(result["metric"])
 
-        metric = {"mean_" + k: v for k, v in metric.items()}
+        metric = {"mean_" + k: v for k, v in aggregator.mean().items()}
 
         full_result = {}
         full_result["metric"] = metric
+        full_result["metric_stats"] = aggregator.stats()
         full_result["env"] = dict(
-            times=len(metrics),
+            benchmark=self.__class__.__name__,
+            times=aggregator.count,
             teacher_forcing_mode=teacher_forcing_mode,
             default_instruction=self.default_instruction
         )
@@ -116,6 +180,20 @@ class Benchmark(metaclass=abc.ABCMeta):
 
         return metric, full_result
 
+    def rescore(self, single_result):
+        # recompute the metric of a saved single result without any model
+        env = single_result["env"]
+        output = single_result["output"]
+        self.reset(self._get_test_case(env))
+
+        answer_list = [parse_invalid(answer) for answer in output["answer_list"]]
+        if env["teacher_forcing"]:
+            self._teacher_scores = output.get("teacher_scores")
+            return self._add_metric_scores(
+                self.calc_metric_tf(answer_list, output["teacher_answer_list"])
+            )
+        return self.calc_metric_no_tf(answer_list)
+
     # TODO: Deprecated
     def _independent_test(self, model, times, teacher_forcing_mode):
         teacher_forcing = teacher_forcing_mode == "l1"
@@ -214,92 +292,367 @@ class Benchmark(metaclass=abc.ABCMeta):
 
         return teacher_qa_lists
 
-    def _if_ckpt_exist(self):
-        return osp.exists(osp.join(self.output_dir, "last_checkpoint"))
+    def _save_checkpoint(self, episode_log, aggregator, index):
+        logger.info(f"Saving #{index} to {episode_log.path}")
+        # the aggregated metrics are checkpointed so that resuming only reads the records
+        # appended after them
+        episode_log.append([], aggregator.snapshot())
+
+    def _iter_example_qa_lists(self, teacher_qa_lists, start, times):
+        # the examples of each test case only depend on the teacher's replies to the
+        # previous test cases, so they can be prepared before running the test
+        # the `i`-th yielded examples are used by the `start + i`-th test case, they are
+        # generated lazily so that only the examples of running tests are in memory
+        yield teacher_qa_lists
+        for test_case in self.test_cases[start: times - 1]:
+            if teacher_qa_lists:
+                self.reset(test_case)
+                self._refresh_teacher_qa()
+                teacher_qa_lists = teacher_qa_lists[1:] + [self._teacher_qa_list]
+            yield teacher_qa_lists
 
-    def _save_ckpt(self, ckpt, filename):
-        logger.info("Saving ckpt to {}".format(osp.join(self.output_dir, filename)))
+    def _run_single_test(
+        self, model, seed, test_case, example_qa_lists, teacher_forcing, weak_tg_chances,
+        parallel_tf=False
+    ):
+        self.pre_each_test(
+            model,
+            instruction=self.default_instruction,
+            test_case=test_case,
+            example_qa_lists=example_qa_lists,
+            seed=seed
+        )
 
-        pkl.dump(ckpt, open(osp.join(self.output_dir, filename), mode="wb"))
-        with open(osp.join(self.output_dir, "last_checkpoint"), mode="w") as f:
-            f.write(filename)
+        return self.naive_test(
+            model, teacher_forcing, weak_tg_chances, self.default_instruction, parallel_tf
+        )
 
-    def _load_ckpt(self):
-        with open(osp.join(self.output_dir, "last_checkpoint"), mode="r") as f:
-            filename = f.readline()
+    async def _arun_single_test(
+        self, model, seed, test_case, example_qa_lists, teacher_forcing, weak_tg_chances,
+        parallel_tf=False
+    ):
+        self.pre_each_test(
+            model,
+            instruction=self.default_instruction,
+            test_case=test_case,
+            example_qa_lists=example_qa_lists,
+            seed=seed
+        )
 
-        logger.info("Loading ckpt from {}".format(osp.join(self.output_dir, filename)))
+        return await self.anaive_test(
+            model, teacher_forcing, weak_tg_chances, self.default_instruction, parallel_tf
+        )
+
+    def _fork(self):
+        # a copy of the benchmark that can run a test concurrently with `self`
+        # states of a test are re-assigned in `reset` except for the teacher
+        benchmark = copy(self)
+        benchmark.teacher = deepcopy(self.teacher)
+
+        return benchmark
+
+    async def _acall_forked(self, model, qa_list):
+        '''
+        Return the replies of `model` to the prompts in `qa_list` as if calling `model` and
+        forcing the reply in `qa_list` step by step, e.g. when teacher forcing.
+
+        The context of every step is known in advance, so each step is called on its own
+        fork of `model` and all the steps are in flight at once, which are batched by HF
+        models with a generation engine. `model` ends up with the same history as the
+        step-by-step calls, it should support `snapshot`, `restore` and `acall`.
+        '''
+        assert getattr(model, "send_history", True), \
+            f"{type(model).__name__} should be built with `SEND_HISTORY=True`."
+        snapshot = model.snapshot()
+
+        async def call(i):
+            fork = copy(model)
+            fork.restore(snapshot)
+            fork.add_history([[(q, str(a)) for q, a in qa_list[:i]]])
+            return await fork.acall(qa_list[i][0])
+
+        replies = await asyncio.gather(*[call(i) for i in range(len(qa_list))])
+
+        for (q, a), reply in zip(qa_list, replies):
+            model.add_history([[(q, reply)]])
+            model.force(str(a))
+
+        return replies
+
+    def _call_forked(self, model, qa_list):
+        # sync version of `_acall_forked`, on the same event loop for all the test cases
+        return asyncio.run_coroutine_threadsafe(
+            self._acall_forked(model, qa_list), _get_loop()
+        ).result()
+
+    def _score_forced(self, model, qa_list):
+        '''
+        Return the replies of `model` to the prompts in `qa_list` like `_call_forked`, but
+        with one forward pass over the whole teacher-forced conversation instead of
+        generating each step, see `FastChatModel.score`.
+
+        The reply of a step is the argmax of `model` at the tokens of the teacher reply, i.e.
+        the greedy reply as long as it agrees with the teacher. The scores of the teacher
+        replies are kept for `_add_metric_scores`.
+        '''
+        qa_list = [(q, str(a)) for q, a in qa_list]
+        return self._add_scored_history(model, qa_list, model.score(qa_list) if qa_list else [])
+
+    async def _ascore_forced(self, model, qa_list):
+        # the forward pass is sync, so it runs in a thread to keep the other tests going
+        qa_list = [(q, str(a)) for q, a in qa_list]
+        scores = await asyncio.to_thread(model.score, qa_list) if qa_list else []
+        return self._add_scored_history(model, qa_list, scores)
+
+    def _add_scored_history(self, model, qa_list, scores):
+        self._teacher_scores = scores
+
+        replies = [score["reply"] for score in scores]
+        for (q, a), reply in zip(qa_list, replies):
+            model.add_history([[(q, reply)]])
+            model.force(a)
+
+        return replies
+
+    def _add_metric_scores(self, metric):
+        # the replies scored by `_score_forced` are the argmax of one forward pass instead of
+        # generated ones, so their metrics and the scores of the teacher replies are prefixed
+        # with "scored_" to be told apart from the metrics of generated replies
+        if self._teacher_scores is None:
+            return metric
+
+        metric = dict(metric)
+        if self._teacher_scores:
+            logprobs = [score["logprob"] for score in self._teacher_scores]
+            tokens = sum(score["tokens"] for score in self._teacher_scores)
+            metric.update(
+                teacher_logprob=sum(logprobs) / len(logprobs),  # per step
+                teacher_token_logprob=sum(logprobs) / max(tokens, 1),
+                teacher_prob=sum(math.exp(logprob) for logprob in logprobs) / len(logprobs),
+                teacher_greedy_acc=(
+                    sum(score["greedy"] for score in self._teacher_scores) / len(logprobs)
+                )
+            )
+
+        return {"scored_" + key: value for key, value in metric.items()}
 
-        ckpt = pkl.load(open(osp.join(self.output_dir, filename), mode="rb"))
-        # TODO: if the evaluation is finished, there will be no need for `teacher_qa_lists`
-        if filename == "results_final.pkl":
-            return ckpt, []
+    def _iter_tests(self, start, times, example_qa_lists):
+        # (seed, test case, examples) of each test to run
+        for i, (test_case, examples) in enumerate(
+            zip(self.test_cases[start: times], example_qa_lists)
+        ):
+            yield start + i + 1, test_case, examples
 
-        return ckpt["single_results"], ckpt["teacher_qa_lists"]
+    def _run_tests(
+        self, model, start, times, example_qa_lists, teacher_forcing, weak_tg_chances,
+        parallel_tf
+    ):
+        for seed, test_case, examples in self._iter_tests(start, times, example_qa_lists):
+            yield self._run_single_test(
+                model, seed, test_case, examples, teacher_forcing, weak_tg_chances, parallel_tf
+            )
+
+    def _run_tests_parallel(
+        self, config, start, times, example_qa_lists, teacher_forcing, weak_tg_chances,
+        parallel_tf, num_workers
+    ):
+        # every worker process builds its own model from `config` and keeps its own copy of
+        # the benchmark. Results are yielded in the order of `self.test_cases`, and at most
+        # `2 * num_workers` tests are submitted but not yielded yet.
+        # "spawn" is required by CUDA models
+        with mp.get_context("spawn").Pool(
+            num_workers, initializer=_init_worker, initargs=(self, config)
+        ) as pool:
+            pending = deque()
+            for seed, test_case, examples in self._iter_tests(start, times, example_qa_lists):
+                args = (seed, test_case, examples, teacher_forcing, weak_tg_chances, parallel_tf)
+                pending.append(pool.apply_async(_run_single_test_in_worker, (args,)))
+                if len(pending) >= 2 * num_workers:
+                    yield pending.popleft().get()
+
+            while pending:
+                yield pending.popleft().get()
+
+    def _run_tests_async(
+        self, model, start, times, example_qa_lists, teacher_forcing, weak_tg_chances,
+        parallel_tf, concurrency
+    ):
+        # `concurrency` workers take tests one by one, each test works on its own copies of
+        # the benchmark and `model`. The event loop runs in a separate thread and results
+        # are yielded in the order of `self.test_cases`, as in `_run_tests_parallel` at most
+        # `2 * concurrency` tests are started but not yielded yet.
+        outputs = queue.Queue()
+        window = {}
+
+        async def worker(tests):
+            # `tests` is shared by the workers, which all run in the thread of the event loop,
+            # a test is only taken with a slot of the window, so the earliest test not yielded
+            # yet is always running
+            while True:
+                await window["slots"].acquire()
+                test = next(tests, None)
+                if test is None:
+                    return
+
+                i, (seed, test_case, examples) = test
+                output = await self._fork()._arun_single_test(
+                    copy(model), seed, test_case, examples,
+                    teacher_forcing, weak_tg_chances, parallel_tf
+                )
+                outputs.put((i, output))
+
+        async def run_tests():
+            window["loop"] = asyncio.get_running_loop()
+            window["slots"] = asyncio.Semaphore(2 * concurrency)
+            tests = enumerate(self._iter_tests(start, times, example_qa_lists))
+            try:
+                await asyncio.gather(*[worker(tests) for _ in range(concurrency)])
+            except Exception as e:
+                outputs.put((None, e))
+
+        thread = threading.Thread(target=asyncio.run, args=(run_tests(),), daemon=True)
+        thread.start()
+
+        finished = {}
+        for i in range(times - start):
+            while i not in finished:
+                j, output = outputs.get()
+                if j is None:
+                    raise output
+                finished[j] = output
+
+            yield finished.pop(i)
+            try:
+                window["loop"].call_soon_threadsafe(window["slots"].release)
+            except RuntimeError:
+                # the loop is closed once all tests are taken
+                pass
+
+        thread.join()
 
     def test_with_examples(
-        self, model, times, num_examples=0, teacher_forcing=False, weak_tg_chances=0, resume=False
+        self, model, times, num_examples=0, teacher_forcing=False, weak_tg_chances=0, resume=False,
+        num_workers=0, concurrency=0, parallel_tf=False, keep_results=True
     ):
+        # `num_workers > 0`: run test cases in `num_workers` processes, `model` should be the
+        #                    config to build the model in each worker
+        # `concurrency > 0`: run up to `concurrency` test cases at once with asyncio,
+        #                    `model` should support `acall`, `aforce` and `arevoke`
+        # otherwise: run test cases one by one with `model`
+        # `parallel_tf`: when teacher forcing, send all steps of a test case at once, see
+        #                `_acall_forked`, or "score" to score the teacher replies of all steps
+        #                in one forward pass instead, see `_score_forced`
+        # `keep_results`: keep the single results in memory and return them, otherwise
+        #                 they are only saved to the episode log, if any
+        assert not (num_workers > 0 and concurrency > 0), "Choose one of processes and asyncio."
         assert times <= len(self.test_cases), self.test_cases
         assert num_examples <= len(self.test_cases), self.test_cases
 
-        if resume and self._if_ckpt_exist():
-            single_results, teacher_qa_lists = self._load_ckpt()
-            logger.info(f"Resume at #{len(single_results)}")
-        else:
-            single_results = []
-            teacher_qa_lists = self._init_teacher_qa_lists(num_examples)
-
-        start = len(single_results)
+        episode_log = None
+        if self.save_period >= 0:
+            episode_log = EpisodeLog(osp.join(self.output_dir, "episodes.jsonl"))
 
-        for i, test_case in enumerate(self.test_cases[start: times]):
-            i += start + 1
+        aggregator = DictAggregator()
+        single_results = []
+        if resume and episode_log is not None and episode_log.exists():
+            start = episode_log.last_index()
+            logger.info(f"Resume at #{start}")
+
+            # results of the previous runs are only kept in the log, all of them are read if
+            # they are kept in memory, otherwise only the ones after the last checkpoint
+            offset, snapshot = 0, None
+            if not keep_results:
+                offset, snapshot = episode_log.load_checkpoint()
+            if snapshot is not None:
+                aggregator.restore(snapshot)
+            for single_result in episode_log.read(offset):
+                aggregator.update(single_result["metric"])
+                if keep_results:
+                    single_results.append(single_result)
+            assert aggregator.count == start, (aggregator.count, start)
+        else:
+            start = 0
+            if episode_log is not None:
+                episode_log.clear()
+
+        # the examples of a test case are the teacher's replies to the previous
+        # `num_examples` test cases, so they are recomputed from `start - num_examples`
+        # where the initial examples are shifted out no matter what they are
+        teacher_qa_lists = self._init_teacher_qa_lists(num_examples)
+        begin = max(0, start - num_examples)
+        example_qa_lists = islice(
+            self._iter_example_qa_lists(teacher_qa_lists, begin, times), start - begin, None
+        )
 
-            self.pre_each_test(
-                model,
-                instruction=self.default_instruction,
-                test_case=test_case,
-                example_qa_lists=teacher_qa_lists
+        if num_workers > 0:
+            outputs = self._run_tests_parallel(
+                model, start, times, example_qa_lists, teacher_forcing, weak_tg_chances,
+                parallel_tf, num_workers
             )
-
-            metric, single_result = self.naive_test(
-                model, teacher_forcing, weak_tg_chances, self.default_instruction
+        elif concurrency > 0:
+            outputs = self._run_tests_async(
+                model, start, times, example_qa_lists, teacher_forcing, weak_tg_chances,
+                parallel_tf, concurrency
+            )
+        else:
+            outputs = self._run_tests(
+                model, start, times, example_qa_lists, teacher_forcing, weak_tg_chances,
+                parallel_tf
             )
-            logger.info(f"Evaluation metric #{i}: {metric}")
 
-            if num_examples:
-                teacher_qa_lists = teacher_qa_lists[1:]
-                if not teacher_forcing:
-                    self._refresh_teacher_qa()
-                    # single_result["history"]["teacher_history"] = deepcopy(self._teacher_qa_list)
-                teacher_qa_lists.append(self._teacher_qa_list)
+        # records are appended to the log as soon as they are yielded, while the aggregated
+        # metrics are checkpointed every `self.save_period` test cases and at the end
+        index = saved = start
+        for index, (metric, single_result) in enumerate(outputs, start + 1):
+            logger.info(f"Evaluation metric #{index}: {metric}")
 
-            single_results.append(single_result)
+            aggregator.update(metric)
+            if keep_results:
+                single_results.append(single_result)
+            if episode_log is None:
+                continue
 
-            if self.save_period > 0 and not i % self.save_period:
-                self._save_ckpt(
-                    {"single_results": single_results, "teacher_qa_lists": teacher_qa_lists},
-                    f"ckpt_{i}.pkl"
-                )
+            episode_log.append([(index, single_result)])
+            if self.save_period > 0 and not index % self.save_period:
+                self._save_checkpoint(episode_log, aggregator, index)
+                saved = index
+
+        if episode_log is not None and index > saved:
+            self._save_checkpoint(episode_log, aggregator, index)
+
+        # tests may run in other processes or on copies of the benchmark, make sure the
+        # environment of the last test case is packed as in a serial run
+        if times > 0:
+            self.reset(self.test_cases[times - 1])
 
         metric, full_result = self._pack_results(
-            single_results, teacher_forcing_mode=teacher_forcing
+            single_results, teacher_forcing_mode=teacher_forcing, aggregator=aggregator
         )
 
-        if self.save_period >= 0:
-            self._save_ckpt(full_result, "results_final.pkl")
-
+        if episode_log is not None:
             logger.info("Saving json to {}".format(osp.join(self.output_dir, "results_final.json")))
-            json.dump(
-                full_result,
-                open(osp.join(self.output_dir, "results_final.json"), mode="w"),
-                cls=InvalidEncoder
-            )
+            with open(osp.join(self.output_dir, "results_final.json"), mode="w") as f:
+                episode_log.dump_results(full_result, f)
+
+        self._save_model_stats(model)
 
         logger.info(f"Final metrics: {metric}")
 
         return metric, full_result
 
+    def _save_model_stats(self, model):
+        # e.g. cache hit rates, kept out of the results so that they are the same however
+        # the tests are run, not available when models are built in worker processes
+        if not hasattr(model, "get_stats"):
+            return
+
+        stats = model.get_stats()
+        logger.info(f"Model stats: {stats}")
+        if self.save_period >= 0:
+            logger.info("Saving json to {}".format(osp.join(self.output_dir, "model_stats.json")))
+            with open(osp.join(self.output_dir, "model_stats.json"), mode="w") as f:
+                json.dump(stats, f, indent=4)
+
     @property
     @abc.abstractmethod
     def default_instruction(self):
@@ -318,6 +671,17 @@ class Benchmark(metaclass=abc.ABCMeta):
         """
         pass
 
+    @classmethod
+    @abc.abstractmethod
+    def from_env(cls, env):
+        # build the benchmark from `full_result["env"]` of saved results
+        pass
+
+    @abc.abstractmethod
+    def _get_test_case(self, env):
+        # rebuild the test case from `env` of a saved single result
+        pass
+
     @abc.abstractmethod
     def calc_metric_tf(self, answer_list, target_list):
         pass
@@ -327,13 +691,89 @@ class Benchmark(metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def _test_no_tf(self, model, weak_tg_chances=0):
+    def _episode_no_tf(self, model, weak_tg_chances=0):
         pass
 
     @abc.abstractmethod
-    def _test_tf(self, model):
+    def _episode_tf(self, model, parallel=False):
         pass
 
     @abc.abstractmethod
-    def naive_test(self, model, teacher_forcing=False, weak_tg_chances=0, instruction=None):
+    def _naive_episode(
+        self, model, teacher_forcing=False, weak_tg_chances=0, instruction=None, parallel_tf=False
+    ):
+        # return the metric and the single result of a test
         pass
+
+    def _drive(self, model, episode):
+        '''
+        Run the generator `episode` of a test with the sync methods of `model` and return
+        what it returns, so that the sync and asyncio tests share one episode loop.
+
+        An episode yields the calls to `model` as `(method, arg)` and is sent their results:
+        - "call": `model(arg)`
+        - "force": `model.force(arg)`
+        - "forked": `self._call_forked(model, arg)`
+        - "scored": `self._score_forced(model, arg)`
+        The other methods of `model` are never async, so the episode calls them itself.
+        '''
+        methods = dict(
+            call=model,
+            force=model.force,
+            forked=lambda qa_list: self._call_forked(model, qa_list),
+            scored=lambda qa_list: self._score_forced(model, qa_list)
+        )
+
+        result = None
+        while True:
+            try:
+                method, arg = episode.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = methods[method](arg)
+
+    async def _adrive(self, model, episode):
+        # asyncio version of `_drive` with `model.acall`, `model.aforce`, `_acall_forked` and
+        # `_ascore_forced`
+        methods = dict(
+            call=model.acall,
+            force=model.aforce,
+            forked=lambda qa_list: self._acall_forked(model, qa_list),
+            scored=lambda qa_list: self._ascore_forced(model, qa_list)
+        )
+
+        result = None
+        while True:
+            try:
+                method, arg = episode.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = await methods[method](arg)
+
+    def _test_no_tf(self, model, weak_tg_chances=0):
+        return self._drive(model, self._episode_no_tf(model, weak_tg_chances))
+
+    def _test_tf(self, model, parallel=False):
+        return self._drive(model, self._episode_tf(model, parallel))
+
+    def naive_test(
+        self, model, teacher_forcing=False, weak_tg_chances=0, instruction=None, parallel_tf=False
+    ):
+        return self._drive(
+            model,
+            self._naive_episode(model, teacher_forcing, weak_tg_chances, instruction, parallel_tf)
+        )
+
+    async def _atest_no_tf(self, model, weak_tg_chances=0):
+        return await self._adrive(model, self._episode_no_tf(model, weak_tg_chances))
+
+    async def _atest_tf(self, model, parallel=False):
+        return await self._adrive(model, self._episode_tf(model, parallel))
+
+    async def anaive_test(
+        self, model, teacher_forcing=False, weak_tg_chances=0, instruction=None, parallel_tf=False
+    ):
+        return await self._adrive(
+            model,
+            self._naive_episode(model, teacher_forcing, weak_tg_chances, instruction, parallel_tf)
+        )
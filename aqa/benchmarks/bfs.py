@@ -1,5 +1,3 @@
-from copy import deepcopy
-
 from aqa.models import BFSModel
 from aqa.utils import Invalid
 
@@ -42,13 +40,10 @@ class BFS(TraverseGraph):
 
         return instruction
 
-    def _get_valid_nodes(self, next_node, visited_nodes):
-        valid_nodes = set(
-            sum(
-                [(self._get_adj_nodes(node) + [node]) for node in visited_nodes + [next_node]],
-                start=[]
-            )
-        )
+    def _get_valid_nodes(self, next_node, state):
+        # visited nodes, `next_node` and their adjacent nodes
+        assert state.is_expanded(next_node), next_node
+        valid_nodes = state.reachable
         assert self._start_node in valid_nodes
 
         return valid_nodes
@@ -73,25 +68,25 @@ class BFS(TraverseGraph):
         return prompt
 
     def _init_queues(self):
-        return self._get_adj_nodes(self._start_node), []
+        # nodes of the current and the next level, which can be visited in any order
+        return set(self._get_adj_nodes(self._start_node)), set()
 
     def _update_queues(self, next_node, old_new_queues, visited_nodes):
-        # doesn't change queues in-place
+        # changes queues in-place, `visited_nodes` is a set
         assert isinstance(old_new_queues, tuple) and len(old_new_queues) == 2, old_new_queues
-        old_queue, new_queue = deepcopy(old_new_queues)
+        old_queue, new_queue = old_new_queues
         assert next_node in old_queue
-        old_queue.pop(old_queue.index(next_node))
-        assert next_node not in old_queue
+        old_queue.remove(next_node)
 
-        new_queue += [
+        new_queue.update(
             node
             for node in self._get_adj_nodes(next_node)
-            if node not in (visited_nodes + new_queue)
-        ]
+            if node not in visited_nodes
+        )
 
         if not old_queue:
             old_queue = new_queue
-            new_queue = []
+            new_queue = set()
 
         return old_queue, new_queue
 
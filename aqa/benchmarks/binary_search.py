@@ -1,4 +1,3 @@
-import random
 import re
 
 from loguru import logger
@@ -30,12 +29,19 @@ class BinarySearch(Benchmark):
 
         if test_case is None:
             logger.info("Generating random number.")
-            self._target = random.randint(self.min, self.max)
+            self._target = self.rng.randint(self.min, self.max)
         else:
             logger.info("Using pre-generated random number.")
             self._target = test_case["target"]
             assert self.min <= self._target and self._target <= self.max, self._target
 
+    @classmethod
+    def from_env(cls, env):
+        return cls(env["min"], env["max"], verbose=False)
+
+    def _get_test_case(self, env):
+        return {"target": env["target"]}
+
     @property
     def default_instruction(self):
         return "You are required to guess the random number which I have just picked between {} and {}. " \
@@ -72,6 +78,9 @@ class BinarySearch(Benchmark):
 
         self._teacher_qa_list.append((prompt, None))
 
+    def _get_answer_space(self):
+        return range(self.min, self.max + 1)
+
     def _extract_answer(self, reply):
         # parse reply from model and return the formatted answer
         # return an `Invalid` if failed to do so
@@ -95,20 +104,28 @@ class BinarySearch(Benchmark):
         except ValueError:
             return FormatInvalid(guess)
 
-    def _check_algo(self, answer, answer_list):
+    def _init_interval(self):
+        # `[left, right)` narrowed by the previous answers
+        return self.min, self.max + 1
+
+    def _update_interval(self, answer, interval):
+        left, right = interval
+        if answer < self._target:
+            left = max(left, answer)
+        elif answer > self._target:
+            right = min(right, answer)
+
+        return left, right
+
+    def _check_algo(self, answer, interval):
         '''
         Check whether `answer` follows the binary-search algorithm
-        Will assume the previous answer in `answer_list` already follow the binary-search algorithm
+        Will assume the answers narrowing `interval` already follow the binary-search algorithm
 
         Return
         - boolean: if selected interface follows binary-search
         '''
-        left = max(
-            [self.min] + [pre_answer for pre_answer in answer_list if pre_answer < self._target]
-        )
-        right = min(
-            [self.max + 1] + [pre_answer for pre_answer in answer_list if pre_answer > self._target]
-        )
+        left, right = interval
         mid = (left + right) // 2
 
         return answer == mid
@@ -144,9 +161,11 @@ class BinarySearch(Benchmark):
         }
 
         cnt = 0
-        for idx, answer in enumerate(answer_list):
-            if self._check_algo(answer, teacher_answer_list[:idx]):
+        interval = self._init_interval()
+        for answer, teacher_answer in zip(answer_list, teacher_answer_list):
+            if self._check_algo(answer, interval):
                 cnt += 1
+            interval = self._update_interval(teacher_answer, interval)
 
         metrics["acc"] = cnt / len(answer_list)
 
@@ -172,16 +191,18 @@ class BinarySearch(Benchmark):
         }
 
         highest_cnt = 0
-        for i, answer in enumerate(answer_list):
-            if not self._check_algo(answer, answer_list[:i]):
+        interval = self._init_interval()
+        for answer in answer_list:
+            if not self._check_algo(answer, interval):
                 break
             highest_cnt += 1
+            interval = self._update_interval(answer, interval)
         metrics["acc"] = highest_cnt / len(answer_list)
 
         return metrics
 
-    def _test_no_tf(self, model, weak_tg_chances=0):
-        # test one time without teacher forcing
+    def _episode_no_tf(self, model, weak_tg_chances=0):
+        # test one time without teacher forcing, see `Benchmark._drive`
         answer = None
         answer_list = []
         prompt = "START"
@@ -190,6 +211,7 @@ class BinarySearch(Benchmark):
         # for weak tg
         weak_tg_cnt = 0
         do_algo_check = weak_tg_chances > 0
+        interval = self._init_interval()
 
         while (
             answer != self._target
@@ -200,7 +222,7 @@ class BinarySearch(Benchmark):
         ):
             self.dialog_logger.info(Q=prompt)
 
-            reply = model(prompt)
+            reply = yield "call", prompt
             self.dialog_logger.info(A=reply)
 
             answer = self._extract_answer(reply)
@@ -212,7 +234,7 @@ class BinarySearch(Benchmark):
                 formatted = getattr(answer, "output", answer)
                 assert isinstance(formatted, int)
                 logger.info(f"Format tolerance enabled, force the model reply to {formatted}.")
-                model.force(str(formatted))
+                yield "force", str(formatted)
 
             if isinstance(answer, Invalid):
                 prompt = "Invalid reply. You can only reply with a integer number between " \
@@ -222,7 +244,7 @@ class BinarySearch(Benchmark):
 
             if do_algo_check:
                 if weak_tg_cnt < weak_tg_chances:
-                    is_following_algo = self._check_algo(answer, answer_list)
+                    is_following_algo = self._check_algo(answer, interval)
                     if not is_following_algo:
                         weak_tg_cnt += 1
                         prompt = self._get_prompt_when_weak_tg()
@@ -234,6 +256,7 @@ class BinarySearch(Benchmark):
 
             prompt = self._get_prompt(answer)
             answer_list.append(answer)
+            interval = self._update_interval(answer, interval)
             retry_cnt = 0
 
         self.dialog_logger.info(Q=prompt)
@@ -246,21 +269,30 @@ class BinarySearch(Benchmark):
 
         return answer_list
 
-    def _test_tf(self, model):
-        # test one time with teacher forcing
+    def _episode_tf(self, model, parallel=False):
+        # test one time with teacher forcing, see `Benchmark._drive`
         answer = None
         answer_list = []
         teacher_answer_list = []
 
         self._refresh_teacher_qa()
 
+        # `parallel`: all steps are called at once since the teacher decides the context
+        if parallel == "score":
+            replies = yield "scored", self._teacher_qa_list[:-1]
+        elif parallel:
+            replies = yield "forked", self._teacher_qa_list[:-1]
+
         # no retry when teacher forcing
-        for prompt, teacher_answer in self._teacher_qa_list[:-1]:
+        for i, (prompt, teacher_answer) in enumerate(self._teacher_qa_list[:-1]):
             self.dialog_logger.info(Q=prompt)
 
-            reply = model(prompt)
+            if parallel:
+                reply = replies[i]
+            else:
+                reply = yield "call", prompt
 
-            model.force(str(teacher_answer))
+                yield "force", str(teacher_answer)
             self.dialog_logger.info(A=reply, T=teacher_answer)
 
             answer = self._extract_answer(reply)
@@ -272,15 +304,19 @@ class BinarySearch(Benchmark):
 
         return answer_list, teacher_answer_list
 
-    def naive_test(self, model, teacher_forcing=False, weak_tg_chances=0, instruction=None):
+    def _naive_episode(
+        self, model, teacher_forcing=False, weak_tg_chances=0, instruction=None, parallel_tf=False
+    ):
         logger.info("Target number: {}".format(self._target))
 
         if teacher_forcing:
-            answer_list, teacher_answer_list = self._test_tf(model)
-            metric = self.calc_metric_tf(answer_list, teacher_answer_list)
+            answer_list, teacher_answer_list = yield from self._episode_tf(model, parallel_tf)
+            metric = self._add_metric_scores(
+                self.calc_metric_tf(answer_list, teacher_answer_list)
+            )
         else:
             teacher_answer_list = []
-            answer_list = self._test_no_tf(model, weak_tg_chances)
+            answer_list = yield from self._episode_no_tf(model, weak_tg_chances)
             metric = self.calc_metric_no_tf(answer_list)
 
         result = self._get_result(
@@ -306,9 +342,9 @@ class BinarySearch(Benchmark):
 
         return result
 
-    def _pack_results(self, single_results, teacher_forcing_mode):
+    def _pack_results(self, single_results, teacher_forcing_mode, aggregator=None):
         metric, full_result = super(BinarySearch, self)._pack_results(
-            single_results, teacher_forcing_mode
+            single_results, teacher_forcing_mode, aggregator
         )
 
         full_result["env"]["min"] = self.min
@@ -34,30 +34,30 @@ class CaveBFS(BFS):
 
         return instruction
 
-    def _get_prompt(self, next_node, visited_nodes):
+    def _get_prompt(self, next_node, state):
         '''
-        Generate prompt used in exploration step
+        Generate prompt used in exploration step, `next_node` is not visited in `state` yet
 
         Return: prompt (string)
         '''
 
-        if len(set(visited_nodes + [next_node])) == len(self._graph.nodes):
+        if state.decoverage(next_node) == 0:
             return "Well Done. You have visited all the caves. " \
-                   "Total number of steps: {}".format(len(visited_nodes[1:] + [next_node]))
+                   "Total number of steps: {}".format(len(state.history[1:] + [next_node]))
 
         adj_nodes = self._get_adj_nodes(next_node)
 
         prompt = "Adjacent caves: {}.".format(", ".join([str(i) for i in adj_nodes]))
 
         if self.provide_state:
-            unvisited_adj_nodes = set(adj_nodes).difference(set(visited_nodes))
+            unvisited_adj_nodes = set(adj_nodes).difference(state.visited)
             if len(unvisited_adj_nodes) == 0:
                 prompt += " You have visited all caves adjacent to this cave."
             else:
                 prompt += " You have not visited cave {}." \
                           .format(", ".join([str(i) for i in unvisited_adj_nodes]))
         if self.mcq:
-            valid_nodes = self._get_valid_nodes(next_node, visited_nodes)
+            valid_nodes = self._get_valid_nodes(next_node, state)
             valid_nodes = [str(node) for node in valid_nodes]
 
             prompt += " Valid caves: {}.".format(", ".join(valid_nodes))
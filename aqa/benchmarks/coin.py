@@ -1,5 +1,3 @@
-import random
-
 from loguru import logger
 
 from .binary_search import BinarySearch
@@ -22,7 +20,7 @@ class Coin(BinarySearch):
 
         if test_case is None:
             logger.info("Generating random number.")
-            self._target = random.randint(self.min, self.max)
+            self._target = self.rng.randint(self.min, self.max)
         else:
             logger.info("Using pre-generated random number.")
             self._target = test_case["target"]
@@ -1,5 +1,3 @@
-from copy import deepcopy
-
 from aqa.models import DFSModel
 from aqa.utils import Invalid
 
@@ -40,7 +38,7 @@ class DFS(TraverseGraph):
 
         return instruction
 
-    def _get_valid_nodes(self, next_node, visited_nodes):
+    def _get_valid_nodes(self, next_node, state):
         return set(self._get_adj_nodes(next_node))
 
     def _get_prompt_when_invalid(self, valid_nodes):
@@ -66,12 +64,12 @@ class DFS(TraverseGraph):
         return [self._start_node]
 
     def _update_stack(self, next_node, stack, visited_nodes):
-        # doesn't change `stack` in-place
+        # changes `stack` in-place
         assert isinstance(stack, list) and len(stack), stack
-        stack = deepcopy(stack)
         # backtrace
         if len(stack) > 1 and next_node == stack[-2]:
-            return stack[:-1]
+            stack.pop()
+            return stack
 
         stack.append(next_node)
         return stack
@@ -92,7 +90,7 @@ class DFS(TraverseGraph):
 
         # check if model selected node following dfs path
         # i.e. select unvisited child node or parent node
-        unvisited_adj_nodes = set(adj_nodes).difference(set(visited_nodes))
+        unvisited_adj_nodes = set(adj_nodes).difference(visited_nodes)
         if len(unvisited_adj_nodes):
             # should visit child node
             return next_node in unvisited_adj_nodes
@@ -1,13 +1,77 @@
-import networkx
+from collections.abc import Set
 import re
 
 from loguru import logger
 
-from aqa.utils import Invalid, FormatInvalid, ValueInvalid
+from aqa.utils import CSRGraph, Invalid, FormatInvalid, ValueInvalid
 
 from .benchmark import Benchmark
 
 
+class _SetView(Set):
+    # read-only view of a set, in the iteration order of the set
+    def __init__(self, set_):
+        self._set = set_
+
+    def __contains__(self, item):
+        return item in self._set
+
+    def __iter__(self):
+        return iter(self._set)
+
+    def __len__(self):
+        return len(self._set)
+
+
+class TraverseState():
+    '''
+    Nodes visited in an episode, updated in O(degree) per step instead of being rebuilt
+    from the node history.
+    '''
+    def __init__(self, graph):
+        self._graph = graph
+        self.history = []  # visited nodes in order, including revisits
+        self.visited = set()
+        self._expanded = set()
+        self._reachable = set()
+        # read-only view of the visited and expanded nodes and their neighbors, i.e. the BFS
+        # valid nodes, which grows with `expand`
+        self.reachable = _SetView(self._reachable)
+
+    def expand(self, node):
+        '''
+        Add `node` and its neighbors to `self.reachable`, which is idempotent.
+
+        Nodes are added in the same order as in `set(sum([adj + [node] for ...], start=[]))`
+        so that the iteration order of the set, e.g. the valid nodes in prompts, is the same.
+        '''
+        if node in self._expanded:
+            return
+        self._expanded.add(node)
+        self._reachable.update(self._graph.neighbors(node))
+        self._reachable.add(node)
+
+    def is_expanded(self, node):
+        return node in self._expanded
+
+    def visit(self, node):
+        self.expand(node)
+        self.history.append(node)
+        self.visited.add(node)
+
+    @property
+    def done(self):
+        return len(self.visited) == len(self._graph)
+
+    def decoverage(self, next_node=None):
+        # `1 - coverage`, as if `next_node` is also visited if given
+        covered = len(self.visited)
+        if next_node is not None and next_node not in self.visited:
+            covered += 1
+
+        return 1 - covered / len(self._graph)
+
+
 # TODO: refine or just remove provide_state
 class TraverseGraph(Benchmark):
     def __init__(
@@ -33,44 +97,52 @@ class TraverseGraph(Benchmark):
 
         if test_case is None:
             logger.info("Generating random graph.")
-            self._graph = networkx.random_tree(self.node_num).to_undirected()
+            self._graph = CSRGraph.random_tree(self.node_num, seed=self.rng)
         else:
             logger.info("Using pre-generated random graph.")
-            self._graph = networkx.Graph()
             assert len(test_case["nodes"]) == self.node_num, test_case["nodes"]
-            self._graph.add_nodes_from(test_case["nodes"])
-            self._graph.add_edges_from(test_case["edges"])
+            self._graph = CSRGraph.from_edges(test_case["nodes"], test_case["edges"])
+
+    @classmethod
+    def from_env(cls, env):
+        return cls(node_num=len(env["nodes"]), verbose=False)
+
+    def _get_test_case(self, env):
+        assert env["start_node"] == 0, env["start_node"]
+        return {"nodes": env["nodes"], "edges": env["edges"]}
 
     def _get_adj_nodes(self, curr_node):
-        return [n for _, n in self._graph.edges(curr_node)]
+        return self._graph.neighbors(curr_node)
 
-    def _get_valid_nodes(self, next_node, visited_nodes):
+    def _get_valid_nodes(self, next_node, state):
+        # read only, `next_node` is expanded in `state`
         raise NotImplementedError
 
-    def _get_prompt(self, next_node, visited_nodes):
+    def _get_prompt(self, next_node, state):
         '''
-        Generate prompt used in exploration step
+        Generate prompt used in exploration step, `next_node` is expanded but not visited in
+        `state` yet
 
         Return: prompt (string)
         '''
 
-        if len(set(visited_nodes + [next_node])) == len(self._graph.nodes):
+        if state.decoverage(next_node) == 0:
             return "Well Done. You have visited all the nodes in the graph. " \
-                   "Total number of steps: {}".format(len(visited_nodes[1:] + [next_node]))
+                   "Total number of steps: {}".format(len(state.history[1:] + [next_node]))
 
         adj_nodes = self._get_adj_nodes(next_node)
 
         prompt = "Adjacent nodes: {}.".format(", ".join([str(i) for i in adj_nodes]))
 
         if self.provide_state:
-            unvisited_adj_nodes = set(adj_nodes).difference(set(visited_nodes))
+            unvisited_adj_nodes = set(adj_nodes).difference(state.visited)
             if len(unvisited_adj_nodes) == 0:
                 prompt += " You have visited all nodes adjacent to this node."
             else:
                 prompt += " You have not visited node {}." \
                           .format(", ".join([str(i) for i in unvisited_adj_nodes]))
         if self.mcq:
-            valid_nodes = self._get_valid_nodes(next_node, visited_nodes)
+            valid_nodes = self._get_valid_nodes(next_node, state)
             valid_nodes = [str(node) for node in valid_nodes]
 
             prompt += " Valid nodes: {}.".format(", ".join(valid_nodes))
@@ -87,28 +159,26 @@ class TraverseGraph(Benchmark):
         super(TraverseGraph, self)._refresh_teacher_qa()
 
         response = ""
-        prompt = self._get_prompt(self._start_node, [])
+        state = TraverseState(self._graph)
+        state.expand(self._start_node)
+        prompt = self._get_prompt(self._start_node, state)
+        state.visit(self._start_node)
         decov_sum = 0.0  # ignore the starting node
 
-        next_node = self._start_node
-        node_history = [self._start_node]
-
         # while exist node not visited
-        while len(set(self._graph.nodes).difference(set(node_history))) != 0:
+        while not state.done:
             response = self.teacher(prompt)
             next_node = int(response)
 
             self._teacher_qa_list.append((prompt, next_node))
-            prompt = self._get_prompt(next_node, node_history)
+            state.expand(next_node)
+            prompt = self._get_prompt(next_node, state)
 
-            decov_sum += self._calc_decoverage(node_history + [next_node])
-            node_history.append(next_node)
+            state.visit(next_node)
+            decov_sum += state.decoverage()
 
         self._teacher_qa_list.append((prompt, None))
 
-        # remove start node in node_history
-        node_history = node_history[1:]
-
         return decov_sum
 
     def _extract_answer(self, reply, valid_nodes):
@@ -137,7 +207,8 @@ class TraverseGraph(Benchmark):
     def _init_stack_or_queue(self):
         raise NotImplementedError
 
-    def _update_stack_or_queue(self, next_node, stack_or_queue, node_history):
+    def _update_stack_or_queue(self, next_node, stack_or_queue, visited_nodes):
+        # may change `stack_or_queue` in-place, `visited_nodes` is a set
         raise NotImplementedError
 
     def _check_algo(self, next_node, stack_or_queue, visited_nodes):
@@ -150,14 +221,13 @@ class TraverseGraph(Benchmark):
         '''
         raise NotImplementedError
 
-    def _calc_decoverage(self, visited_nodes):
-        assert self._start_node in visited_nodes
-        return 1 - len(set(visited_nodes)) / len(self._graph.nodes)
-
     def calc_metric_no_tf(self, node_history):
         assert len(node_history) > 0
 
-        decov_list = [self._calc_decoverage([self._start_node])]
+        state = TraverseState(self._graph)
+        state.visit(self._start_node)
+
+        decov_list = [state.decoverage()]
         highest_cnt = 0
         is_following_algo = True
 
@@ -171,16 +241,15 @@ class TraverseGraph(Benchmark):
 
             # `is_following_algo` will remain `True` until `model` stops following bfs
             if is_following_algo:
-                is_following_algo = self._check_algo(
-                    node, stack_or_queue, [self._start_node] + node_history[:idx]
-                )
+                is_following_algo = self._check_algo(node, stack_or_queue, state.visited)
             if is_following_algo:
                 highest_cnt = idx + 1
                 stack_or_queue = self._update_stack_or_queue(
-                    node, stack_or_queue, [self._start_node] + node_history[:idx]
+                    node, stack_or_queue, state.visited
                 )
 
-            decov = self._calc_decoverage([self._start_node] + node_history[:idx + 1])
+            state.visit(node)
+            decov = state.decoverage()
             assert decov <= decov_list[-1], "`decov_list` should be a non-ascent sequence"
             decov_list.append(decov)
 
@@ -203,7 +272,11 @@ class TraverseGraph(Benchmark):
     def calc_metric_tf(self, node_history, teacher_node_history):
         assert len(node_history) > 0
 
-        decov_list = [self._calc_decoverage([self._start_node])]
+        # teacher forced states
+        state = TraverseState(self._graph)
+        state.visit(self._start_node)
+
+        decov_list = [state.decoverage()]
         cnt = 0
 
         stack_or_queue = self._init_stack_or_queue()
@@ -211,23 +284,20 @@ class TraverseGraph(Benchmark):
         for idx, (node, teacher_node) in enumerate(
             zip(node_history, teacher_node_history)
         ):
-            is_following_algo = self._check_algo(
-                node, stack_or_queue, [self._start_node] + teacher_node_history[:idx]
-            )
+            is_following_algo = self._check_algo(node, stack_or_queue, state.visited)
 
             if is_following_algo:
                 cnt += 1
 
             stack_or_queue = self._update_stack_or_queue(
-                teacher_node, stack_or_queue, [self._start_node] + teacher_node_history[:idx]
+                teacher_node, stack_or_queue, state.visited
             )
 
             if isinstance(node, Invalid):
                 decov = decov_list[-1]
             else:
-                decov = self._calc_decoverage(
-                    [self._start_node] + teacher_node_history[:idx] + [node]
-                )
+                decov = state.decoverage(node)
+            state.visit(teacher_node)
             assert decov <= decov_list[-1], "`decov_list` should be a non-ascent sequence"
             decov_list.append(decov)
 
@@ -247,14 +317,18 @@ class TraverseGraph(Benchmark):
         }
         return metric
 
-    def _test_no_tf(self, model, weak_tg_chances=0):
+    def _episode_no_tf(self, model, weak_tg_chances=0):
         '''
+        Test one time without teacher forcing, see `Benchmark._drive`
+
         Return:
         - accuracy: percentage of node selected following the traversing algorithm (BFS/DFS)
         - decov_list: list of (1 - coverages)
         - trace of node explored by model
         '''
-        prompt = self._get_prompt(self._start_node, [])
+        state = TraverseState(self._graph)
+        state.expand(self._start_node)
+        prompt = self._get_prompt(self._start_node, state)
         node_history = []
 
         retry_cnt = 0
@@ -263,16 +337,18 @@ class TraverseGraph(Benchmark):
         do_algo_check = weak_tg_chances > 0
         stack_or_queue = self._init_stack_or_queue()
 
-        valid_nodes = self._get_valid_nodes(self._start_node, [])
+        valid_nodes = self._get_valid_nodes(self._start_node, state)
+        state.visit(self._start_node)
 
         while (
-            len(set([self._start_node] + node_history)) != len(self._graph.nodes)
+            not state.done
             and (self.max_step is None or len(node_history) < self.max_step)
             and retry_cnt < (self.max_retry + 1)
         ):
             self.dialog_logger.info(Q=prompt)
 
-            reply = model(prompt)
+            self._set_answer_space(model, valid_nodes if self.mcq else None)
+            reply = yield "call", prompt
             self.dialog_logger.info(A=reply)
 
             # start processing response in this iteration
@@ -284,7 +360,7 @@ class TraverseGraph(Benchmark):
                 assert self.format_tolerant
                 formatted = str(getattr(next_node, "output", next_node))
                 logger.info(f"Format tolerance enabled, force the model reply to {formatted}.")
-                model.force(formatted)
+                yield "force", formatted
 
             if isinstance(next_node, Invalid):
                 prompt = self._get_prompt_when_invalid(valid_nodes)
@@ -294,7 +370,7 @@ class TraverseGraph(Benchmark):
             if do_algo_check:
                 if weak_tg_cnt < weak_tg_chances:
                     is_following_algo = self._check_algo(
-                        next_node, stack_or_queue, [self._start_node] + node_history
+                        next_node, stack_or_queue, state.visited
                     )
                     if not is_following_algo:
                         weak_tg_cnt += 1
@@ -307,11 +383,13 @@ class TraverseGraph(Benchmark):
 
                 if do_algo_check:
                     stack_or_queue = self._update_stack_or_queue(
-                        next_node, stack_or_queue, [self._start_node] + node_history
+                        next_node, stack_or_queue, state.visited
                     )
 
-            valid_nodes = self._get_valid_nodes(next_node, [self._start_node] + node_history)
-            prompt = self._get_prompt(next_node, [self._start_node] + node_history)
+            state.expand(next_node)
+            valid_nodes = self._get_valid_nodes(next_node, state)
+            prompt = self._get_prompt(next_node, state)
+            state.visit(next_node)
             node_history.append(next_node)
             retry_cnt = 0
 
@@ -320,49 +398,68 @@ class TraverseGraph(Benchmark):
         if isinstance(next_node, Invalid):
             node_history.append(next_node)  # save the last invalid
             logger.info("Max retry times reached, stop interaction now.")
-        elif len(set([self._start_node] + node_history)) != len(self._graph.nodes):
+        elif not state.done:
             # target not achieved
             logger.info("Max steps reached, stop the interaction now.")
 
         return node_history
 
-    def _test_tf(self, model):
-        valid_nodes = self._get_valid_nodes(self._start_node, [])
+    def _episode_tf(self, model, parallel=False):
+        # test one time with teacher forcing, see `Benchmark._drive`
+        state = TraverseState(self._graph)
+        state.expand(self._start_node)
+        valid_nodes = self._get_valid_nodes(self._start_node, state)
+        state.visit(self._start_node)
         node_history = []
         teacher_node_history = []
 
         optim_decov_sum = self._refresh_teacher_qa()
 
+        # `parallel`: all steps are called at once since the teacher decides the context
+        if parallel == "score":
+            replies = yield "scored", self._teacher_qa_list[:-1]
+        elif parallel:
+            replies = yield "forked", self._teacher_qa_list[:-1]
+
         # no retry when teacher forcing
-        for prompt, teacher_reply in self._teacher_qa_list[:-1]:
+        for i, (prompt, teacher_reply) in enumerate(self._teacher_qa_list[:-1]):
             self.dialog_logger.info(Q=prompt)
 
-            reply = model(prompt)
+            if parallel:
+                reply = replies[i]
+            else:
+                self._set_answer_space(model, valid_nodes if self.mcq else None)
+                reply = yield "call", prompt
 
-            model.force(str(teacher_reply))
+                yield "force", str(teacher_reply)
             self.dialog_logger.info(A=reply, T=teacher_reply)
 
             next_node = self._extract_answer(reply, valid_nodes)
 
             node_history.append(next_node)
             teacher_node_history.append(teacher_reply)
-            valid_nodes = self._get_valid_nodes(
-                teacher_reply, [self._start_node] + teacher_node_history
-            )
+            state.expand(teacher_reply)
+            valid_nodes = self._get_valid_nodes(teacher_reply, state)
+            state.visit(teacher_reply)
 
         self.dialog_logger.info(Q=self._teacher_qa_list[-1][0])
 
         return node_history, teacher_node_history, optim_decov_sum
 
-    def naive_test(self, model, teacher_forcing=False, weak_tg_chances=0, instruction=None):
+    def _naive_episode(
+        self, model, teacher_forcing=False, weak_tg_chances=0, instruction=None, parallel_tf=False
+    ):
         logger.info("Nodes: {}, Edges: {}".format(self._graph.nodes, self._graph.edges))
 
         if teacher_forcing:
-            model_node_history, teacher_node_history, optim_decov_sum = self._test_tf(model)
-            metric = self.calc_metric_tf(model_node_history, teacher_node_history)
+            model_node_history, teacher_node_history, optim_decov_sum = \
+                yield from self._episode_tf(model, parallel_tf)
+            metric = self._add_metric_scores(
+                self.calc_metric_tf(model_node_history, teacher_node_history)
+            )
         else:
             teacher_node_history = []
-            model_node_history = self._test_no_tf(model, weak_tg_chances)
+            model_node_history = yield from self._episode_no_tf(model, weak_tg_chances)
             metric = self.calc_metric_no_tf(model_node_history)
 
         result = self._get_result(
@@ -393,9 +490,9 @@ class TraverseGraph(Benchmark):
 
         return result
 
-    def _pack_results(self, single_results, teacher_forcing_mode):
+    def _pack_results(self, single_results, teacher_forcing_mode, aggregator=None):
         metrics, full_result = super(TraverseGraph, self)._pack_results(
-            single_results, teacher_forcing_mode
+            single_results, teacher_forcing_mode, aggregator
         )
 
         full_result["env"].update(dict(
@@ -10,5 +10,10 @@ BASE_CONFIG = Config(
         TEACHER_FORCING=False,
         WEAK_TG_CHANCES=0,
         RESUME=True,
+        NUM_WORKERS=0,  # run test cases in parallel processes if > 0
+        CONCURRENCY=0,  # run test cases concurrently with asyncio if > 0
+        PARALLEL_TF=False,  # send all teacher-forced steps of a test case at once, or "score"
+                            # them in one forward pass, see `Benchmark.test_with_examples`
+        KEEP_RESULTS=True,  # keep all single results in memory, or only in the episode log
     ),
 )
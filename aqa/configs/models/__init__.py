@@ -1,6 +1,13 @@
+from .cached_model import *  # noqa
+from .coalescing_model import *  # noqa
 from .deepseek import *  # noqa
 from .fastchat_model import *  # noqa
 from .gemini import *  # noqa
+from .hedge import *  # noqa
 from .llama3 import *  # noqa
 from .mistral import *  # noqa
-from .openai import *  # noqa
\ No newline at end of file
+from .openai import *  # noqa
+from .openai_compatible import *  # noqa
+from .rate_limit import *  # noqa
+from .router_model import *  # noqa
+from .synthetic_model import *  # noqa
@@ -0,0 +1,12 @@
+from aqa.configs import Config
+
+# e.g. `MODEL=dict(CACHED_MODEL_CONFIG, MODEL=MISTRAL_7B_INSTRUCT_v02_CONFIG)`
+CACHED_MODEL_CONFIG = Config(
+    NAME="CachedModel",
+    MODEL=None,  # config of the wrapped deterministic model
+    PATH="cache/responses.sqlite",
+    MAX_BYTES=1024 ** 3,  # evict the least recently used responses beyond it
+    NAMESPACE="",  # change it to invalidate the cached responses
+)
+
+__all__ = [k for k in globals().keys() if "_CONFIG" in k]
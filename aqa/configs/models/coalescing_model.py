@@ -0,0 +1,10 @@
+from aqa.configs import Config
+
+# e.g. `MODEL=dict(COALESCING_MODEL_CONFIG, MODEL=MISTRAL_7B_INSTRUCT_v02_CONFIG)`
+COALESCING_MODEL_CONFIG = Config(
+    NAME="CoalescingModel",
+    MODEL=None,  # config of the wrapped deterministic model
+    MAX_NODES=100000,  # bound of the turns kept, the least recently used ones are evicted
+)
+
+__all__ = [k for k in globals().keys() if "_CONFIG" in k]
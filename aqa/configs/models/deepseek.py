@@ -4,7 +4,12 @@ from aqa.configs import Config
 
 DEEPSEEK_CONFIG = Config(
     NAME="Deepseek",
-    MAX_NEW_TOKENS=128
+    MAX_NEW_TOKENS=128,
+    MAX_BATCH_SIZE=0,  # continuous batching of concurrent conversations if > 0
+    REUSE_KV_CACHE=False,  # only prefill the new tokens of each turn
+    PREFIX_CACHE_BYTES=0,  # share prefixes across test cases if > 0, needs `REUSE_KV_CACHE`
+    STOP_AT_ANSWER=None,  # "tolerant" or "strict" as `FORMAT_TOLERANT`, stop at the answer
+    CONSTRAINED=False,  # only generate the integers of the answer space of the benchmark
 )
 
 DEEPSEEK_LLM_7B_CONFIG = deepcopy(DEEPSEEK_CONFIG)
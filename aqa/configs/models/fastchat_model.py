@@ -19,6 +19,11 @@ FASTCHAT_MODEL_CONFIG = Config(
     XFT_CONFIG=None,
     REVISION="main",
     JUDGE_SENT_END=False,
+    MAX_BATCH_SIZE=0,  # continuous batching of concurrent conversations if > 0
+    REUSE_KV_CACHE=False,  # only prefill the new tokens of each turn
+    PREFIX_CACHE_BYTES=0,  # share prefixes across test cases if > 0, needs `REUSE_KV_CACHE`
+    STOP_AT_ANSWER=None,  # "tolerant" or "strict" as `FORMAT_TOLERANT`, stop at the answer
+    CONSTRAINED=False,  # only generate the integers of the answer space of the benchmark
 )
 
 VICUNA_V15_7B_16K_CONFIG = deepcopy(FASTCHAT_MODEL_CONFIG)
@@ -3,7 +3,9 @@ from aqa.configs import Config
 
 GEMINI_CONFIG = Config(
     NAME="Gemini",
-    SLEEP_SEC=0.2
+    SLEEP_SEC=0.2,
+    RATE_LIMIT=None,  # of each API key, e.g. `RATE_LIMIT_CONFIG`, replaces `SLEEP_SEC`
+    HEDGE=None,  # e.g. `HEDGE_CONFIG`
 )
 
 __all__ = [k for k in globals().keys() if "_CONFIG" in k]
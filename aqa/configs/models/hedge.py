@@ -0,0 +1,13 @@
+from aqa.configs import Config
+
+
+# `HEDGE` of the API models with deterministic replies, e.g. `OPENAI_CONFIG`, see `Hedger`
+HEDGE_CONFIG = Config(
+    PERCENTILE=95,  # of the recent latencies to wait before hedging a request
+    WINDOW=256,  # number of the recent latencies
+    MIN_SAMPLES=20,  # no hedging before
+    MIN_DELAY_SEC=0.0,
+    MAX_WORKERS=64,  # threads of the sync requests
+)
+
+__all__ = [k for k in globals().keys() if "_CONFIG" in k]
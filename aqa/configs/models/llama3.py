@@ -4,7 +4,10 @@ from aqa.configs import Config
 
 LLAMA3_CONFIG = Config(
     NAME="Llama3",
-    MAX_NEW_TOKENS=32
+    MAX_NEW_TOKENS=32,
+    MAX_BATCH_SIZE=0,  # continuous batching of concurrent conversations if > 0
+    STOP_AT_ANSWER=None,  # "tolerant" or "strict" as `FORMAT_TOLERANT`, stop at the answer
+    CONSTRAINED=False,  # only generate the integers of the answer space of the benchmark
 )
 
 LLAMA3_8B_INSTRUCT_CONFIG = deepcopy(LLAMA3_CONFIG)
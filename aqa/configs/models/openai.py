@@ -6,7 +6,11 @@ from aqa.configs import Config
 OPENAI_CONFIG = Config(
     NAME="OpenAI",
     API_VERSION="2023-12-01-preview",
-    SLEEP_SEC=0.5
+    SLEEP_SEC=0.5,
+    RATE_LIMIT=None,  # e.g. `RATE_LIMIT_CONFIG`, replaces `SLEEP_SEC`
+    HEDGE=None,  # e.g. `HEDGE_CONFIG`
+    STOP_AT_ANSWER=None,  # "tolerant" or "strict" as `FORMAT_TOLERANT`, stop at the answer
+    SEND_HISTORY=False,  # send the examples as messages, required by `PARALLEL_TF` and wrappers
 )
 
 __all__ = [k for k in globals().keys() if "_CONFIG" in k]
@@ -0,0 +1,21 @@
+from aqa.configs import Config
+
+
+OPENAI_COMPATIBLE_CONFIG = Config(
+    NAME="OpenAICompatible",
+    MODEL_NAME=None,  # model name of the server, e.g. "mistralai/Mistral-7B-Instruct-v0.2"
+    BASE_URL="http://localhost:8000/v1",
+    API_KEY=None,
+    MAX_TOKENS=128,
+    TEMPERATURE=0.0,
+    SEED=None,
+    STREAM=True,
+    TIMEOUT=600.0,
+    MAX_CONNECTIONS=64,  # of the connection pool shared by the process
+    SLEEP_SEC=0.0,
+    RATE_LIMIT=None,  # e.g. `RATE_LIMIT_CONFIG`, replaces `SLEEP_SEC`
+    HEDGE=None,  # e.g. `HEDGE_CONFIG`
+    STOP_AT_ANSWER=None,  # "tolerant" or "strict" as `FORMAT_TOLERANT`, stop at the answer
+)
+
+__all__ = [k for k in globals().keys() if "_CONFIG" in k]
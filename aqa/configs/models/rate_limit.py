@@ -0,0 +1,14 @@
+from aqa.configs import Config
+
+
+# `RATE_LIMIT` of the API models, e.g. `OPENAI_CONFIG`, see `RateLimiter`
+RATE_LIMIT_CONFIG = Config(
+    REQUESTS_PER_MIN=None,  # None for no limit
+    TOKENS_PER_MIN=None,  # estimated before a request and corrected by the usage after it
+    MAX_CONCURRENCY=64,
+    MIN_CONCURRENCY=1,
+    INIT_CONCURRENCY=None,  # `MAX_CONCURRENCY` if None
+    COOLDOWN=1.0,  # seconds between two decreases of the concurrency
+)
+
+__all__ = [k for k in globals().keys() if "_CONFIG" in k]
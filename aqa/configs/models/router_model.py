@@ -0,0 +1,13 @@
+from aqa.configs import Config
+
+
+ROUTER_MODEL_CONFIG = Config(
+    NAME="RouterModel",
+    MODELS=[],  # configs of the backends serving the same model, e.g. `OPENAI_CONFIG`
+    EWMA_ALPHA=0.2,  # weight of the latest latency
+    ERROR_BUDGET=0.2,  # fraction of failed calls in the window to trip an endpoint
+    ERROR_WINDOW=20,  # last calls of an endpoint since it was tripped
+    COOLDOWN_SEC=60.0,  # of a tripped endpoint
+)
+
+__all__ = [k for k in globals().keys() if "_CONFIG" in k]
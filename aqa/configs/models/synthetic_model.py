@@ -0,0 +1,26 @@
+from copy import deepcopy
+
+from aqa.configs import Config
+
+SYNTHETIC_MODEL_CONFIG = Config(
+    NAME="SyntheticModel",
+    TASK="binary_search",  # "binary_search" (and coin), "bfs" or "dfs" (and caves)
+    POLICY="optimal",  # "optimal" or "random"
+    MIN=32,  # range of binary search
+    MAX=32800,
+    ERROR_RATE=0.0,  # chance of a random reply with the optimal policy
+    INVALID_RATE=0.0,  # chance of a reply without any number
+    LATENCY=0.0,  # mean latency of a call in seconds
+    LATENCY_DIST="constant",  # "constant", "uniform", "exponential" or "lognormal"
+    LATENCY_SIGMA=1.0,  # sigma of the lognormal latency
+    FAILURE_RATE=0.0,  # chance of raising `SyntheticError` after the latency, then retried
+    SEED=0,
+)
+
+SYNTHETIC_BFS_CONFIG = deepcopy(SYNTHETIC_MODEL_CONFIG)
+SYNTHETIC_BFS_CONFIG.update(TASK="bfs")
+
+SYNTHETIC_DFS_CONFIG = deepcopy(SYNTHETIC_MODEL_CONFIG)
+SYNTHETIC_DFS_CONFIG.update(TASK="dfs")
+
+__all__ = [k for k in globals().keys() if "_CONFIG" in k]
@@ -1,13 +1,26 @@
+from .answer_stop import StopAtAnswer, cut_at_answer, find_answer_end
 from .bloomz import BLOOMZ
 from .bfs_model import BFSModel
 from .bs_model import BSModel
 from .build import build_model
+from .cached_model import CachedModel
+from .coalescing_model import CoalescingModel
+from .constrained import AnswerSpace, IntegerConstraint, IntegerLogitsProcessor
 from .deepseek import Deepseek
 from .dfs_model import DFSModel
+from .engine import GenerationEngine
 from .gemini import Gemini
+from .hedger import Hedger, get_hedger
+from .key_pool import KeyPool, get_key_pool
 from .fastchat_model import FastChatModel
 from .llama import Llama
 from .llama3 import Llama3
 from .mistral import Mistral
 from .openai import OpenAI
+from .openai_compatible import OpenAICompatible
+from .rate_limiter import RateLimiter, get_rate_limiter
+from .router_model import RouterModel
+from .scoring import find_reply_spans, score_replies
 from .simple_model import SimpleModel
+from .synthetic_model import SyntheticError, SyntheticModel
+from .wrapper import ModelWrapper
@@ -0,0 +1,58 @@
+import re
+
+import torch
+from transformers import StoppingCriteria
+
+# the first integer of a reply, once a non-digit follows it
+_FIRST_INT = re.compile(r"\d+(?=\D)")
+# the longest prefix of a reply that `int` may still accept, e.g. " -1_000 "
+_INT_PREFIX = re.compile(r"\s*[+-]?(?:\d+(?:_\d+)*(?:_|\s*))?")
+
+
+def find_answer_end(text, mode):
+    '''
+    Return the length of the prefix of the reply `text` that decides the answer extracted by
+    the benchmarks, or None if the rest of the reply may still change it. `mode` follows
+    `FORMAT_TOLERANT` of the benchmark:
+    - "tolerant": the first integer is complete, e.g. "12," of "12, because .."
+    - "strict": the reply can't be an integer any more, e.g. "12 b" of "12 because .."
+    The prefix keeps the character that decides the answer, so that it is formatted or
+    invalid just like the whole reply.
+    '''
+    if mode == "tolerant":
+        match = _FIRST_INT.search(text)
+        return None if match is None else match.end() + 1
+    if mode == "strict":
+        match = _INT_PREFIX.match(text)
+        return None if match.end() == len(text) else match.end() + 1
+    raise ValueError(f"Unknown mode {mode} of stopping at the answer.")
+
+
+def cut_at_answer(text, mode):
+    # `text` up to where its answer is decided, if `mode` is not None
+    end = None if mode is None else find_answer_end(text, mode)
+    return text if end is None else text[:end]
+
+
+class StopAtAnswer(StoppingCriteria):
+    '''
+    Stop generating a reply once its answer is decided, see `find_answer_end`.
+
+    `decode(output_ids)` returns the text of the generated token ids, which follow the
+    first `input_len` tokens of each row passed to `model.generate`. The engine calls
+    `is_done(output_ids)` instead.
+    '''
+    def __init__(self, decode, mode, input_len=0):
+        self.decode = decode
+        self.mode = mode
+        self.input_len = input_len
+
+    def is_done(self, output_ids):
+        return find_answer_end(self.decode(output_ids), self.mode) is not None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.tensor(
+            [self.is_done(ids[self.input_len:].tolist()) for ids in input_ids],
+            dtype=torch.bool,
+            device=input_ids.device
+        )
@@ -1,13 +1,28 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (
+    AutoModelForCausalLM, AutoTokenizer, LogitsProcessorList, StoppingCriteriaList
+)
+
+from .answer_stop import StopAtAnswer, cut_at_answer
+from .constrained import AnswerSpace, IntegerConstraint, IntegerLogitsProcessor
 
 
 class BLOOMZ():
-    def __init__(self, name="bigscience/bloomz-560m", qa_prefix=True):
+    def __init__(
+        self, name="bigscience/bloomz-560m", qa_prefix=True, stop_at_answer=None,
+        constrained=False
+    ):
         self.tokenizer = AutoTokenizer.from_pretrained(name)
         self.model = AutoModelForCausalLM.from_pretrained(
             name, torch_dtype="auto", device_map="auto"
         )
         self.qa_prefix = qa_prefix
+        # `stop_at_answer`: "tolerant" or "strict" as `FORMAT_TOLERANT` of the benchmark, stop
+        #                   generating once the answer is decided, see `find_answer_end`
+        self.stop_at_answer = stop_at_answer
+        # `constrained`: only generate the integers of the answer space set by the benchmark,
+        #                see `set_answer_space`
+        self.constraint = IntegerConstraint(self.tokenizer) if constrained else None
+        self.answer_space = AnswerSpace()
         self.reset()
 
     def reset(self, instruction=""):
@@ -25,8 +40,25 @@ class BLOOMZ():
             full_prompt = self.context + f"{prompt}\n\n"
 
         input_ = self.tokenizer.encode(full_prompt, return_tensors="pt").to("cuda")
-        output = self.model.generate(input_, max_new_tokens=max_new_tokens)
+        stopping_criteria = None
+        if self.stop_at_answer is not None:
+            stopping_criteria = StoppingCriteriaList([
+                StopAtAnswer(self.tokenizer.decode, self.stop_at_answer, input_.shape[1])
+            ])
+        logits_processor = None
+        if self.constraint is not None:
+            logits_processor = LogitsProcessorList([
+                IntegerLogitsProcessor(
+                    self.constraint, self.answer_space, [self.tokenizer.eos_token_id],
+                    input_.shape[1]
+                )
+            ])
+        output = self.model.generate(
+            input_, max_new_tokens=max_new_tokens, stopping_criteria=stopping_criteria,
+            logits_processor=logits_processor
+        )
         output = self.tokenizer.decode(output[0, input_.shape[1]:]).rstrip("</s>")
+        output = cut_at_answer(output, self.stop_at_answer)
 
         self.history.append((prompt, output))
         return output
@@ -47,6 +79,10 @@ class BLOOMZ():
 
         return context
 
+    def set_answer_space(self, answers=None):
+        # integers the replies may be, any if None, see `AnswerSpace`
+        self.answer_space = AnswerSpace(answers)
+
     def revoke(self, n=1):
         assert 0 <= n and n <= len(self.history)
         if n == 0:
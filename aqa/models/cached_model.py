@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os.path as osp
+import sqlite3
+import threading
+import time
+
+from aqa.utils import ensure_dir
+
+from .build import MODELS
+from .wrapper import ModelWrapper
+
+
+class ResponseCache():
+    '''
+    Responses in a SQLite database, bounded by the bytes of keys and responses and evicted
+    in the least recently used order. Processes can share the same database.
+    '''
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        if osp.dirname(path):
+            ensure_dir(osp.dirname(path))
+        # autocommit, transactions are started explicitly
+        self._conn = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # a cache may lose its last entries on power loss, but is never corrupted
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                nbytes INTEGER NOT NULL,
+                used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+
+            -- total bytes of the responses, kept by triggers for all the processes
+            CREATE TABLE IF NOT EXISTS size (nbytes INTEGER NOT NULL);
+            INSERT INTO size SELECT 0 WHERE NOT EXISTS (SELECT * FROM size);
+            CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses
+            BEGIN UPDATE size SET nbytes = nbytes + NEW.nbytes; END;
+            CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses
+            BEGIN UPDATE size SET nbytes = nbytes - OLD.nbytes; END;
+        ''')
+        self._lock = threading.Lock()
+
+        self._stats = dict(hits=0, misses=0, inserts=0, evictions=0)
+
+    def get(self, key):
+        # return None on miss
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["hits"] += 1
+            self._conn.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+
+            return row[0]
+
+    def put(self, key, response):
+        nbytes = len(key) + len(response.encode())
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # responses are deterministic, so an existing one is kept
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, response, nbytes, time.time())
+                )
+                self._stats["inserts"] += cursor.rowcount
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, batch_size=64):
+        excess = self._nbytes() - self.max_bytes
+        while excess > 0:
+            # only the least recently used entries needed to fit, read a batch at a time
+            rows = self._conn.execute(
+                "SELECT key, nbytes FROM responses ORDER BY used LIMIT ?", (batch_size,)
+            ).fetchall()
+            keys = []
+            for key, nbytes in rows:
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= nbytes
+
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+            self._stats["evictions"] += len(keys)
+
+    def _nbytes(self):
+        return self._conn.execute("SELECT nbytes FROM size").fetchone()[0]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            stats["nbytes"] = self._nbytes()
+
+        stats["hit_rate"] = stats["hits"] / max(stats["hits"] + stats["misses"], 1)
+
+        return stats
+
+
+@MODELS.register()
+class CachedModel(ModelWrapper):
+    '''
+    Wrap a deterministic model, e.g. generating greedily, with a persistent response cache.
+
+    Responses are keyed by the config of the wrapped model and the whole conversation, i.e.
+    the instruction, the history and the prompt. A cached response is added to the history
+    of the wrapped model without generating, so a re-run only generates after the first
+    question that is asked differently.
+    '''
+    # model config keys that don't change the responses
+    IGNORED_KEYS = [
+        "API_KEY", "END_POINT", "SLEEP_SEC", "RATE_LIMIT", "HEDGE", "REUSE_KV_CACHE",
+        "PREFIX_CACHE_BYTES", "MAX_BATCH_SIZE", "MAX_CONNECTIONS", "TIMEOUT", "STREAM"
+    ]
+
+    def __init__(self, model, path, max_bytes=1024 ** 3, namespace=""):
+        # `namespace`: change it to invalidate the responses when the code of the model changes,
+        #              e.g. a hard-coded generation parameter
+        self.cache = ResponseCache(path, max_bytes)
+        self._model_key = json.dumps(
+            [namespace, {k: v for k, v in model.items() if k not in self.IGNORED_KEYS}],
+            sort_keys=True,
+            default=str
+        )
+
+        super(CachedModel, self).__init__(model)
+
+    def _get_key(self, prompt):
+        conversation = [self.instruction, [qa[:2] for qa in self.model.history], prompt]
+        data = json.dumps([self._model_key, conversation])
+
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def __call__(self, prompt):
+        key = self._get_key(prompt)
+        reply = self.cache.get(key)
+        if reply is not None:
+            self.model.add_history([[(prompt, reply)]])
+            return reply
+
+        reply = self.model(prompt)
+        self.cache.put(key, reply)
+
+        return reply
+
+    async def acall(self, prompt):
+        key = self._get_key(prompt)
+        reply = self.cache.get(key)
+        if reply is not None:
+            self.model.add_history([[(prompt, reply)]])
+            return reply
+
+        reply = await self.model.acall(prompt)
+        self.cache.put(key, reply)
+
+        return reply
+
+    def get_stats(self):
+        stats = super(CachedModel, self).get_stats()
+        stats["response_cache"] = self.cache.get_stats()
+
+        return stats
@@ -0,0 +1,184 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+from .build import MODELS
+from .wrapper import ModelWrapper
+
+
+def _failed(future):
+    # whether the owner of the reply failed, the waiters claim it again
+    return future.done() and not future.cancelled() and future.exception() is not None
+
+
+class _TrieNode():
+    __slots__ = ["parent", "key", "children", "replies"]
+
+    def __init__(self, parent, key):
+        self.parent = parent  # None for the roots
+        self.key = key  # key in `parent.children`, or the instruction of a root
+        self.children = {}  # (Q, A) of the next turn -> `_TrieNode`
+        self.replies = {}  # Q of the next turn -> `Future` of A
+
+
+class DialogTrie():
+    '''
+    Replies of a deterministic model in a trie of conversations, where the conversations
+    sharing an instruction and their first turns share the path from the root.
+
+    A reply is a `concurrent.futures.Future`, so a conversation asking a question that is
+    being answered for another one waits for the same reply instead of asking again.
+
+    The trie keeps at most `max_nodes` nodes, the least recently used ones are evicted
+    with their replies. A node is used more recently than its descendants, so only leaves
+    are evicted. A conversation waiting for an evicted reply still gets it.
+    '''
+    def __init__(self, max_nodes=100000):
+        self.max_nodes = max_nodes
+
+        self._roots = {}  # instruction -> `_TrieNode`
+        self._lru = OrderedDict()  # `_TrieNode` -> None, from the least recently used
+        self._lock = threading.Lock()
+
+        self._stats = dict(hits=0, waits=0, misses=0, nodes=0, evictions=0)
+
+    def claim(self, instruction, history, prompt):
+        '''
+        Return (node, future, owner). The caller should generate the reply and set the
+        result of `future` if `owner`, or call `release` if failed.
+        '''
+        with self._lock:
+            node = self._roots.get(instruction)
+            if node is None:
+                node = self._roots[instruction] = _TrieNode(None, instruction)
+                self._stats["nodes"] += 1
+            path = [node]
+
+            for qa in history:
+                key = tuple(qa[:2])
+                child = node.children.get(key)
+                if child is None:
+                    child = node.children[key] = _TrieNode(node, key)
+                    self._stats["nodes"] += 1
+                node = child
+                path.append(node)
+
+            # from the leaf so that the ancestors are used more recently
+            for used in reversed(path):
+                self._lru[used] = None
+                self._lru.move_to_end(used)
+            self._evict(node)
+
+            future = node.replies.get(prompt)
+            if future is None:
+                future = node.replies[prompt] = Future()
+                self._stats["misses"] += 1
+                return node, future, True
+
+            self._stats["hits" if future.done() else "waits"] += 1
+            return node, future, False
+
+    def _evict(self, keep):
+        # `keep`: node being claimed, the most recently used leaf
+        while self._stats["nodes"] > self.max_nodes:
+            node = next(iter(self._lru))
+            if node is keep:
+                return
+            assert not node.children
+            self._lru.pop(node)
+            if node.parent is None:
+                self._roots.pop(node.key)
+            else:
+                node.parent.children.pop(node.key)
+            self._stats["nodes"] -= 1
+            self._stats["evictions"] += 1
+
+    def release(self, node, prompt, future, exception):
+        # drop a reply that failed, so that the next claim generates it again
+        with self._lock:
+            if node.replies.get(prompt) is future:
+                node.replies.pop(prompt)
+        future.set_exception(exception)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats["calls"] = stats["hits"] + stats["waits"] + stats["misses"]
+        # number of calls per call of the wrapped model
+        stats["coalescing_factor"] = stats["calls"] / max(stats["misses"], 1)
+
+        return stats
+
+
+@MODELS.register()
+class CoalescingModel(ModelWrapper):
+    '''
+    Wrap a deterministic model so that identical conversations, e.g. the episodes of
+    binary search that only branch on the feedback, ask each question only once.
+
+    The replies are kept in an in-process `DialogTrie` shared by all the copies of the
+    model, i.e. the concurrent episodes, and concurrent episodes asking the same question
+    wait for a single call of the wrapped model. If that call fails, the waiting episodes
+    ask again, one of them calls the wrapped model and the others wait for it.
+    '''
+    def __init__(self, model, max_nodes=100000):
+        # `max_nodes`: bound of the nodes of the trie, i.e. the turns of the conversations
+        self.trie = DialogTrie(max_nodes)
+
+        super(CoalescingModel, self).__init__(model)
+
+    def __call__(self, prompt):
+        while True:
+            node, future, owner = self.trie.claim(self.instruction, self.model.history, prompt)
+            if owner:
+                break
+            try:
+                reply = future.result()
+            except BaseException:
+                # claim the reply again if its owner failed, i.e. ask or wait for a new owner
+                if _failed(future):
+                    continue
+                raise
+            self.model.add_history([[(prompt, reply)]])
+            return reply
+
+        try:
+            reply = self.model(prompt)
+        except BaseException as e:
+            self.trie.release(node, prompt, future, e)
+            raise
+        future.set_result(reply)
+
+        return reply
+
+    async def acall(self, prompt):
+        while True:
+            node, future, owner = self.trie.claim(self.instruction, self.model.history, prompt)
+            if owner:
+                break
+            try:
+                # cancelling a waiter should not cancel the shared reply
+                reply = await asyncio.shield(asyncio.wrap_future(future))
+            except BaseException:
+                if _failed(future):
+                    continue
+                raise
+            self.model.add_history([[(prompt, reply)]])
+            return reply
+
+        try:
+            reply = await self.model.acall(prompt)
+        except BaseException as e:
+            self.trie.release(node, prompt, future, e)
+            raise
+        future.set_result(reply)
+
+        return reply
+
+    def get_stats(self):
+        stats = super(CoalescingModel, self).get_stats()
+        stats["coalescing"] = self.trie.get_stats()
+
+        return stats
@@ -0,0 +1,113 @@
+import re
+
+import torch
+from transformers import LogitsProcessor
+
+
+class AnswerSpace():
+    '''
+    Integers a reply may be: any integer of at most `max_digits` digits if `answers` is None,
+    otherwise the non-negative integers of `answers`, e.g. `range(min, max + 1)` of
+    `BinarySearch` or the valid nodes of `TraverseGraph`. A range is never enumerated.
+    '''
+    def __init__(self, answers=None, max_digits=9):
+        self.answers = answers
+        self.max_digits = max_digits
+
+        self._prefixes = None
+        if answers is not None and not isinstance(answers, range):
+            answers = [str(answer) for answer in answers if answer >= 0]
+            self._answers = set(answers)
+            self._prefixes = {answer[:i] for answer in answers for i in range(len(answer) + 1)}
+        elif isinstance(answers, range):
+            assert answers.step == 1
+
+    def is_prefix(self, digits):
+        # whether an answer starts with `digits`, answers have no leading zeros
+        if len(digits) > 1 and digits[0] == "0":
+            return False
+        if self.answers is None:
+            return len(digits) <= self.max_digits
+        if self._prefixes is not None:
+            return digits in self._prefixes
+
+        low, high = max(self.answers.start, 0), self.answers.stop - 1
+        if low > high:
+            return False
+        if digits in ["", "0"]:
+            return digits == "" or low == 0
+        # the answers of each length starting with `digits`
+        for extra in range(len(str(high)) - len(digits) + 1):
+            first = int(digits) * 10 ** extra
+            if first <= high and first + 10 ** extra - 1 >= low:
+                return True
+        return False
+
+    def is_answer(self, digits):
+        if digits == "" or not self.is_prefix(digits):
+            return False
+        if self.answers is None:
+            return True
+        if self._prefixes is not None:
+            return digits in self._answers
+        return int(digits) in self.answers
+
+
+class IntegerConstraint():
+    '''
+    Constrained decoding of integer replies: a reply only has digit tokens, and an eos token
+    can only follow a whole answer of an `AnswerSpace`. A token with leading spaces can only
+    start a reply.
+
+    The digits of the tokens are found once per tokenizer, so a model keeps one constraint.
+    '''
+    def __init__(self, tokenizer):
+        self.first_tokens = []  # (token id, digits) that can start a reply
+        self.next_tokens = []  # the ones that can follow a digit
+        for token_id in range(len(tokenizer)):
+            text = tokenizer.decode([token_id])
+            if re.fullmatch(r"\s*[0-9]+", text) is None:
+                continue
+            self.first_tokens.append((token_id, text.strip()))
+            if text[0].isdigit():
+                self.next_tokens.append((token_id, text))
+        self._digits = dict(self.first_tokens)
+
+    def allowed_tokens(self, output_ids, answer_space, eos_token_ids):
+        # ids of the tokens that can follow the generated `output_ids`
+        if any(token_id not in self._digits for token_id in output_ids):
+            return list(eos_token_ids)
+        digits = "".join(self._digits[token_id] for token_id in output_ids)
+
+        tokens = self.next_tokens if output_ids else self.first_tokens
+        allowed = [
+            token_id for token_id, token_digits in tokens
+            if answer_space.is_prefix(digits + token_digits)
+        ]
+        if answer_space.is_answer(digits) or not allowed:
+            allowed += list(eos_token_ids)
+
+        return allowed
+
+
+class IntegerLogitsProcessor(LogitsProcessor):
+    '''
+    Mask the logits of the tokens that `IntegerConstraint` does not allow, for the tokens
+    generated after the first `input_len` tokens of each row passed to `model.generate`.
+    The engine calls `allowed_tokens(output_ids)` instead.
+    '''
+    def __init__(self, constraint, answer_space, eos_token_ids, input_len=0):
+        self.constraint = constraint
+        self.answer_space = answer_space
+        self.eos_token_ids = eos_token_ids
+        self.input_len = input_len
+
+    def allowed_tokens(self, output_ids):
+        return self.constraint.allowed_tokens(output_ids, self.answer_space, self.eos_token_ids)
+
+    def __call__(self, input_ids, scores):
+        mask = torch.full_like(scores, float("-inf"))
+        for i, ids in enumerate(input_ids):
+            mask[i, self.allowed_tokens(ids[self.input_len:].tolist())] = 0
+
+        return scores + mask
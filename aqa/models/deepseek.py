@@ -1,12 +1,22 @@
+import asyncio
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM, GenerationConfig
+from transformers import LogitsProcessorList, StoppingCriteriaList
 
+from .answer_stop import StopAtAnswer, cut_at_answer
 from .build import MODELS
+from .constrained import AnswerSpace, IntegerConstraint, IntegerLogitsProcessor
+from .engine import GenerationEngine
+from .kv_cache import PrefixCache, TurnCache
+from .scoring import find_reply_spans, score_replies
 
 
 @MODELS.register()
 class Deepseek():
-    def __init__(self, model_id, max_new_tokens=128):
+    def __init__(
+        self, model_id, max_new_tokens=128, max_batch_size=0, reuse_kv_cache=False,
+        prefix_cache_bytes=0, stop_at_answer=None, constrained=False
+    ):
         self.model_id = model_id
         self.tokenizer = AutoTokenizer.from_pretrained(model_id)
         self.model = AutoModelForCausalLM.from_pretrained(
@@ -15,10 +25,38 @@ class Deepseek():
         self.model.generation_config = GenerationConfig.from_pretrained(model_id)
         self.model.generation_config.pad_token_id = self.model.generation_config.eos_token_id
         self.max_new_tokens = max_new_tokens
+        # `stop_at_answer`: "tolerant" or "strict" as `FORMAT_TOLERANT` of the benchmark, stop
+        #                   generating once the answer is decided, see `find_answer_end`
+        self.stop_at_answer = stop_at_answer
+
+        # `max_batch_size > 0`: generate with a continuous-batching engine shared by all
+        #                       the copies of this model, i.e. concurrent conversations
+        self.engine = None
+        if max_batch_size > 0:
+            self.engine = GenerationEngine(self.model, max_batch_size)
+        eos_token_id = self.model.generation_config.eos_token_id
+        self.eos_token_ids = eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]
+
+        # `reuse_kv_cache`: only prefill the new tokens of each turn, the engine does not
+        #                   keep caches across turns
+        self.reuse_kv_cache = reuse_kv_cache and self.engine is None
+
+        # `prefix_cache_bytes > 0`: share the kv caches of the instruction and examples
+        #                           across test cases, kept on the device of the model
+        self.prefix_cache = None
+        if self.reuse_kv_cache and prefix_cache_bytes > 0:
+            self.prefix_cache = PrefixCache(prefix_cache_bytes)
+
+        # `constrained`: only generate the integers of the answer space set by the benchmark,
+        #                see `set_answer_space`
+        self.constraint = IntegerConstraint(self.tokenizer) if constrained else None
+        self.answer_space = AnswerSpace()
+
         self.reset()
 
     def reset(self, instruction=None):
         self.instruction = instruction
+        self.turn_cache = TurnCache()
 
         # `self.history` format:
         # [
@@ -28,40 +66,126 @@ class Deepseek():
         self.history = []
 
     def __call__(self, prompt, max_new_tokens=20):
-        input_ = self.get_encoded(prompt).to("cuda")
+        input_ = self.get_encoded(prompt)
+
+        stop = self._get_stop(input_.shape[1])
+        stopping_criteria = None if stop is None else StoppingCriteriaList([stop])
+        constraint = self._get_constraint(input_.shape[1])
+        logits_processor = None if constraint is None else LogitsProcessorList([constraint])
+        if self.reuse_kv_cache:
+            output = [
+                self.turn_cache.generate(
+                    self.model, input_[0].tolist(), self.prefix_cache, self._get_prefix_ids(),
+                    max_new_tokens=max_new_tokens, stopping_criteria=stopping_criteria,
+                    logits_processor=logits_processor
+                )
+            ]
+        elif self.engine is None:
+            input_ = input_.to("cuda")
+            output = self.model.generate(
+                input_, max_new_tokens=max_new_tokens, do_sample=False,
+                stopping_criteria=stopping_criteria, logits_processor=logits_processor
+            )
+            output = output[:, input_.shape[1]:]
+        else:
+            output = [
+                self.engine.generate(
+                    input_[0].tolist(), max_new_tokens, self.eos_token_ids,
+                    None if stop is None else stop.is_done,
+                    None if constraint is None else constraint.allowed_tokens
+                )
+            ]
+
+        return self._add_output(prompt, output)
+
+    async def acall(self, prompt, max_new_tokens=20):
+        if self.engine is None:
+            return self(prompt, max_new_tokens)
+
+        input_ = self.get_encoded(prompt)
+        stop = self._get_stop()
+        constraint = self._get_constraint()
+        output = await asyncio.wrap_future(
+            self.engine.submit(
+                input_[0].tolist(), max_new_tokens, self.eos_token_ids,
+                None if stop is None else stop.is_done,
+                None if constraint is None else constraint.allowed_tokens
+            )
+        )
+
+        return self._add_output(prompt, [output])
+
+    def _get_stop(self, input_len=0):
+        # the stopping criteria of `stop_at_answer`, if any
+        if self.stop_at_answer is None:
+            return None
+        return StopAtAnswer(
+            lambda ids: self.tokenizer.decode(ids, skip_special_tokens=True),
+            self.stop_at_answer,
+            input_len
+        )
 
-        output = self.model.generate(input_, max_new_tokens=max_new_tokens, do_sample=False)
-        output = output[:, input_.shape[1]:]
+    def _get_constraint(self, input_len=0):
+        # the logits processor of `constrained`, if any
+        if self.constraint is None:
+            return None
+        return IntegerLogitsProcessor(
+            self.constraint, self.answer_space, self.eos_token_ids, input_len
+        )
+
+    def _add_output(self, prompt, output):
         output = self.tokenizer.batch_decode(output, skip_special_tokens=True)[0]
+        # the same reply however early the generation stopped
+        output = cut_at_answer(output, self.stop_at_answer)
 
         self.history.append((prompt, output))
         return output
 
     def get_encoded(self, inp):
+        return self.tokenizer.apply_chat_template(
+            self._get_messages(self.history, inp), return_tensors="pt"
+        )
+
+    def _get_prefix_ids(self):
+        # the instruction and the examples before the first turn, see `TurnCache.generate`
+        if self.prefix_cache is None or self.turn_cache.ids:
+            return None
+        messages = self._get_messages(self.history)
+        return self.tokenizer.apply_chat_template(messages) if messages else []
+
+    def _get_messages(self, history, inp=None):
+        # the chat of `history`, followed by the prompt `inp` if any
         messages = []
 
-        for qa in self.history:
+        for qa in history:
             q, a = qa[0], qa[1]
             if a is None:
                 a = ""
             messages.append({"role": "user", "content": q})
             messages.append({"role": "assistant", "content": a})
 
-        messages.append({"role": "user", "content": inp})
+        if inp is not None:
+            messages.append({"role": "user", "content": inp})
 
         if self.instruction is not None:
             messages.insert(0, {"role": "user", "content": self.instruction})
             messages.insert(1, {"role": "assistant", "content": ""})
 
-        return self.tokenizer.apply_chat_template(messages, return_tensors="pt")
+        return messages
 
     def _tokenize(self, text):
         return self.tokenizer.encode(text, add_special_tokens=False)
 
+    def set_answer_space(self, answers=None):
+        # integers the replies may be, any if None, see `AnswerSpace`
+        self.answer_space = AnswerSpace(answers)
+
     def add_history(self, qa_lists):
         for qa_list in qa_lists:
             self.history += qa_list
 
+    # `revoke` and `force` leave the kv cache as it is, the next call crops it to the
+    # first changed token and only recomputes the turns after it
     def revoke(self, n=1):
         assert 0 <= n and n <= len(self.history)
         if n == 0:
@@ -71,3 +195,45 @@ class Deepseek():
     def force(self, new_reply):
         assert isinstance(new_reply, str)
         self.history[-1] = (self.history[-1][0], new_reply, *self.history[-1][1:])
+
+    def score(self, qa_list):
+        # score the replies of `qa_list` teacher forced after the history in one forward pass,
+        # without adding them to the history, see `score_replies`
+        history = list(self.history)
+        prompts, turns = [], []
+        for q, a in qa_list:
+            prompts.append(
+                self.tokenizer.apply_chat_template(self._get_messages(history, q), tokenize=False)
+            )
+            history.append((q, a))
+            turns.append(
+                self.tokenizer.apply_chat_template(self._get_messages(history), tokenize=False)
+            )
+        text = turns[-1]
+
+        replies = [a for _, a in qa_list]
+        return score_replies(
+            self.model, self.tokenizer, text, find_reply_spans(text, prompts, turns, replies),
+            self.eos_token_ids
+        )
+
+    def get_stats(self):
+        stats = {}
+        if self.prefix_cache is not None:
+            stats["prefix_cache"] = self.prefix_cache.get_stats()
+        return stats
+
+    def snapshot(self):
+        return self.instruction, list(self.history), self.turn_cache.snapshot()
+
+    def restore(self, snapshot):
+        # a snapshot can be restored more than once
+        self.instruction, history, turn_cache = snapshot
+        self.history = list(history)
+        self.turn_cache = turn_cache.snapshot()
+
+    async def arevoke(self, n=1):
+        self.revoke(n)
+
+    async def aforce(self, new_reply):
+        self.force(new_reply)
@@ -0,0 +1,246 @@
+from concurrent.futures import Future
+from loguru import logger
+import queue
+import threading
+
+import torch
+from transformers import DynamicCache
+
+
+def _to_legacy_cache(cache):
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    return cache
+
+
+def _pad_cache(cache, length):
+    # left pad the sequence dimension of `cache` to `length`
+    padded = []
+    for key, value in cache:
+        pad = length - key.shape[2]
+        if pad > 0:
+            key = torch.cat([key.new_zeros(*key.shape[:2], pad, key.shape[3]), key], dim=2)
+            value = torch.cat(
+                [value.new_zeros(*value.shape[:2], pad, value.shape[3]), value], dim=2
+            )
+        padded.append((key, value))
+
+    return tuple(padded)
+
+
+def _pad_mask(attention_mask, length):
+    pad = length - attention_mask.shape[1]
+    if pad <= 0:
+        return attention_mask
+    padding = attention_mask.new_zeros(attention_mask.shape[0], pad)
+    return torch.cat([padding, attention_mask], dim=1)
+
+
+class _Request():
+    def __init__(self, input_ids, max_new_tokens, eos_token_ids, stop=None, constrain=None):
+        self.input_ids = list(input_ids)
+        self.max_new_tokens = max_new_tokens
+        self.eos_token_ids = set(eos_token_ids)
+        self.stop = stop
+        self.constrain = constrain
+        self.output_ids = []
+        self.future = Future()
+
+    @property
+    def finished(self):
+        if len(self.output_ids) >= self.max_new_tokens:
+            return True
+        if self.stop is not None and self.stop(self.output_ids):
+            return True
+        return bool(self.output_ids) and self.output_ids[-1] in self.eos_token_ids
+
+
+class GenerationEngine():
+    '''
+    Greedy generation with continuous batching.
+
+    Requests from concurrent conversations are decoded together in one left-padded batch.
+    A new request joins the running batch right after its prompt is prefilled and leaves
+    it as soon as it finishes, without waiting for the rest of the batch.
+    '''
+    def __init__(self, model, max_batch_size=8, pad_token_id=0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.pad_token_id = pad_token_id
+
+        self._pending = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        # states of the running batch, the `i`-th row belongs to `self._requests[i]`
+        self._requests = []
+        self._cache = None  # legacy format, i.e. ((key, value), ...) of each layer
+        self._attention_mask = None
+        self._next_tokens = None  # generated but not fed to the model yet
+
+    def submit(self, input_ids, max_new_tokens, eos_token_ids=(), stop=None, constrain=None):
+        '''
+        Return a `concurrent.futures.Future` of the generated token ids, which include
+        the eos token if generated. `stop(output_ids)` also finishes the request if True,
+        e.g. `StopAtAnswer.is_done`. `constrain(output_ids)` returns the ids of the tokens
+        that can be generated next, e.g. `IntegerLogitsProcessor.allowed_tokens`.
+        '''
+        request = _Request(input_ids, max_new_tokens, eos_token_ids, stop, constrain)
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+        self._pending.put(request)
+        return request.future
+
+    def generate(self, input_ids, max_new_tokens, eos_token_ids=(), stop=None, constrain=None):
+        return self.submit(input_ids, max_new_tokens, eos_token_ids, stop, constrain).result()
+
+    def _loop(self):
+        # grad mode is thread local
+        with torch.no_grad():
+            while True:
+                try:
+                    self._admit()
+                    if self._requests:
+                        self._decode()
+                except Exception as e:
+                    logger.exception("Generation failed.")
+                    self._fail(self._requests, e)
+                    self._clear()
+
+    def _fail(self, requests, exception):
+        # a request may have finished before the failure
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(exception)
+
+    def _forward(self, requests, input_ids, attention_mask, position_ids, cache):
+        if cache is not None and getattr(self.model, "_supports_cache_class", False):
+            cache = DynamicCache.from_legacy_cache(cache)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True
+        )
+
+        logits = outputs.logits[:, -1]
+        for i, request in enumerate(requests):
+            if request.constrain is not None:
+                mask = torch.full_like(logits[i], float("-inf"))
+                mask[request.constrain(request.output_ids)] = 0
+                logits[i] += mask
+
+        return logits.argmax(-1), _to_legacy_cache(outputs.past_key_values)
+
+    def _admit(self):
+        requests = []
+        # wait for new requests only if nothing is running
+        if not self._requests:
+            requests.append(self._pending.get())
+
+        while len(self._requests) + len(requests) < self.max_batch_size:
+            try:
+                requests.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+
+        if requests:
+            try:
+                self._prefill(requests)
+            except Exception as e:
+                # the new requests may not be in the running batch, which fails in `_loop`
+                self._fail(requests, e)
+                raise
+
+    def _prefill(self, requests):
+        device = self.model.device
+        length = max([len(request.input_ids) for request in requests])
+
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), length), dtype=torch.long)
+        for i, request in enumerate(requests):
+            input_ids[i, length - len(request.input_ids):] = torch.tensor(request.input_ids)
+            attention_mask[i, length - len(request.input_ids):] = 1
+        input_ids = input_ids.to(device)
+        attention_mask = attention_mask.to(device)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        next_tokens, cache = self._forward(
+            requests, input_ids, attention_mask, position_ids, None
+        )
+        for request, token in zip(requests, next_tokens.tolist()):
+            request.output_ids.append(token)
+
+        if self._requests:
+            # merge into the running batch
+            length = max(length, self._attention_mask.shape[1])
+            cache = tuple(
+                (torch.cat([old_key, key], dim=0), torch.cat([old_value, value], dim=0))
+                for (old_key, old_value), (key, value)
+                in zip(_pad_cache(self._cache, length), _pad_cache(cache, length))
+            )
+            attention_mask = torch.cat(
+                [_pad_mask(self._attention_mask, length), _pad_mask(attention_mask, length)]
+            )
+            next_tokens = torch.cat([self._next_tokens, next_tokens])
+
+        self._requests += requests
+        self._cache = cache
+        self._attention_mask = attention_mask
+        self._next_tokens = next_tokens
+        self._release()
+
+    def _decode(self):
+        attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones(len(self._requests), 1)], dim=1
+        )
+        position_ids = attention_mask.sum(-1, keepdim=True) - 1
+
+        self._next_tokens, self._cache = self._forward(
+            self._requests,
+            self._next_tokens[:, None], attention_mask, position_ids, self._cache
+        )
+        self._attention_mask = attention_mask
+
+        for request, token in zip(self._requests, self._next_tokens.tolist()):
+            request.output_ids.append(token)
+        self._release()
+
+    def _release(self):
+        # remove finished requests from the running batch
+        finished = [request.finished for request in self._requests]
+        keep = [i for i, done in enumerate(finished) if not done]
+        if len(keep) == len(self._requests):
+            return
+
+        for request, done in zip(self._requests, finished):
+            if done:
+                request.future.set_result(request.output_ids)
+
+        if not keep:
+            self._clear()
+            return
+
+        index = torch.tensor(keep, device=self._attention_mask.device)
+        attention_mask = self._attention_mask.index_select(0, index)
+        # drop the columns that are padding for all remaining requests
+        start = int((attention_mask.sum(0) > 0).nonzero()[0])
+
+        self._requests = [self._requests[i] for i in keep]
+        self._attention_mask = attention_mask[:, start:]
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        self._cache = tuple(
+            (
+                key.index_select(0, index.to(key.device))[:, :, start:],
+                value.index_select(0, index.to(value.device))[:, :, start:]
+            )
+            for key, value in self._cache
+        )
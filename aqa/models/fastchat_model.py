@@ -1,5 +1,6 @@
 from typing import Optional
 
+import asyncio
 import torch
 
 from fastchat.conversation import get_conv_template
@@ -14,8 +15,14 @@ from fastchat.modules.gptq import GptqConfig
 from fastchat.modules.exllama import ExllamaConfig
 from fastchat.modules.xfastertransformer import XftConfig
 from fastchat.utils import get_context_length
+from transformers import LogitsProcessorList, StoppingCriteriaList
 
+from .answer_stop import StopAtAnswer, cut_at_answer, find_answer_end
 from .build import MODELS
+from .constrained import AnswerSpace, IntegerConstraint, IntegerLogitsProcessor
+from .engine import GenerationEngine
+from .kv_cache import PrefixCache, TurnCache
+from .scoring import find_reply_spans, score_replies
 
 
 @MODELS.register()
@@ -38,6 +45,11 @@ class FastChatModel():
         xft_config: Optional[XftConfig] = None,
         revision: str = "main",
         judge_sent_end: bool = True,
+        max_batch_size: int = 0,
+        reuse_kv_cache: bool = False,
+        prefix_cache_bytes: int = 0,
+        stop_at_answer: Optional[str] = None,
+        constrained: bool = False,
     ):
         self.conv_template = conv_template
         self.model_path = model_path
@@ -46,6 +58,9 @@ class FastChatModel():
         self.temperature = temperature
         self.max_new_tokens = max_new_tokens
         self.judge_sent_end = judge_sent_end
+        # `stop_at_answer`: "tolerant" or "strict" as `FORMAT_TOLERANT` of the benchmark, stop
+        #                   generating once the answer is decided, see `find_answer_end`
+        self.stop_at_answer = stop_at_answer
 
         if num_gpus == "all":
             num_gpus = torch.cuda.device_count()
@@ -81,6 +96,35 @@ class FastChatModel():
         # Set context length
         self.context_len = get_context_length(self.model.config)
 
+        # the engine and the kv cache reuse only do greedy decoding of decoder-only models
+        greedy = self.temperature < 1e-5 and self.repetition_penalty == 1.0 \
+            and not self.model.config.is_encoder_decoder and not self.judge_sent_end
+
+        # `max_batch_size > 0`: generate with a continuous-batching engine shared by all
+        #                       the copies of this model, i.e. concurrent conversations
+        self.engine = None
+        if max_batch_size > 0:
+            assert greedy
+            self.engine = GenerationEngine(self.model, max_batch_size)
+
+        # `reuse_kv_cache`: only prefill the new tokens of each turn, the engine does not
+        #                   keep caches across turns
+        self.reuse_kv_cache = reuse_kv_cache and greedy and self.engine is None
+
+        # `prefix_cache_bytes > 0`: share the kv caches of the instruction and examples
+        #                           across test cases, kept on the device of the model
+        self.prefix_cache = None
+        if self.reuse_kv_cache and prefix_cache_bytes > 0:
+            self.prefix_cache = PrefixCache(prefix_cache_bytes)
+
+        # `constrained`: only generate the integers of the answer space set by the benchmark,
+        #                with the engine or the kv cache reuse, see `set_answer_space`
+        self.constraint = None
+        if constrained:
+            assert self.engine is not None or self.reuse_kv_cache
+            self.constraint = IntegerConstraint(self.tokenizer)
+        self.answer_space = AnswerSpace()
+
     def reset(self, instruction=""):
         if self.conv_template:
             self.conv = get_conv_template(self.conv_template)
@@ -92,6 +136,8 @@ class FastChatModel():
         if instruction != "":
             self.conv.set_system_message(instruction)
 
+        self.turn_cache = TurnCache()
+
         # `self.history` format:
         # [
         #     (Q1, A1), # not forced
@@ -100,12 +146,24 @@ class FastChatModel():
         self.history = []
 
     def __call__(self, inp):
-        self.conv.append_message(self.conv.roles[0], inp)
-        self.conv.append_message(self.conv.roles[1], None)
-        prompt = self.conv.get_prompt()
+        prefix_ids = self._get_prefix_ids()
+        prompt = self._get_prompt(inp)
 
-        if self.is_codet5p:  # codet5p is a code completion model.
-            prompt = inp
+        if self.reuse_kv_cache:
+            input_ids, max_new_tokens, stop_token_ids = self._get_generate_args(prompt)
+            stop = self._get_stop(len(input_ids))
+            constraint = self._get_constraint(stop_token_ids, len(input_ids))
+            output = self.turn_cache.generate(
+                self.model, input_ids, self.prefix_cache, prefix_ids,
+                max_new_tokens=max_new_tokens, eos_token_id=stop_token_ids,
+                stopping_criteria=None if stop is None else StoppingCriteriaList([stop]),
+                logits_processor=None if constraint is None else LogitsProcessorList([constraint])
+            )
+            return self._add_output(inp, self._decode(output))
+
+        if self.engine is not None:
+            output = self.engine.generate(*self._get_engine_args(prompt))
+            return self._add_output(inp, self._decode(output))
 
         gen_params = {
             "model": self.model_path,
@@ -127,20 +185,116 @@ class FastChatModel():
                 judge_sent_end=self.judge_sent_end,
         )
 
-        output = list([i for i in output_stream])[-1]["text"].strip()
+        output = ""
+        for outputs in output_stream:
+            output = outputs["text"]
+            if self.stop_at_answer is not None \
+               and find_answer_end(output, self.stop_at_answer) is not None:
+                output_stream.close()
+                break
+
+        return self._add_output(inp, output)
+
+    async def acall(self, inp):
+        if self.engine is None:
+            return self(inp)
+
+        prompt = self._get_prompt(inp)
+        output = await asyncio.wrap_future(self.engine.submit(*self._get_engine_args(prompt)))
+
+        return self._add_output(inp, self._decode(output))
+
+    def _get_prompt(self, inp):
+        self.conv.append_message(self.conv.roles[0], inp)
+        self.conv.append_message(self.conv.roles[1], None)
+        prompt = self.conv.get_prompt()
+
+        if self.is_codet5p:  # codet5p is a code completion model.
+            prompt = inp
+
+        return prompt
+
+    def _get_prefix_ids(self):
+        # the system message and the examples before the first turn, see `TurnCache.generate`
+        if self.prefix_cache is None or self.turn_cache.ids:
+            return None
+        return self.tokenizer(self.conv.get_prompt()).input_ids
+
+    def _get_generate_args(self, prompt):
+        # same truncation and stop tokens as `generate_stream`
+        input_ids = self.tokenizer(prompt).input_ids
+        input_ids = input_ids[-(self.context_len - self.max_new_tokens - 1):]
+        stop_token_ids = list(self.conv.stop_token_ids or []) + [self.tokenizer.eos_token_id]
+
+        return input_ids, self.max_new_tokens, stop_token_ids
+
+    def _get_stop(self, input_len=0):
+        # the stopping criteria of `stop_at_answer`, if any
+        if self.stop_at_answer is None:
+            return None
+        return StopAtAnswer(self._decode, self.stop_at_answer, input_len)
+
+    def _get_constraint(self, eos_token_ids, input_len=0):
+        # the logits processor of `constrained`, if any
+        if self.constraint is None:
+            return None
+        return IntegerLogitsProcessor(self.constraint, self.answer_space, eos_token_ids, input_len)
+
+    def _get_engine_args(self, prompt):
+        input_ids, max_new_tokens, stop_token_ids = self._get_generate_args(prompt)
+        stop = self._get_stop()
+        constraint = self._get_constraint(stop_token_ids)
+
+        return (
+            input_ids, max_new_tokens, stop_token_ids,
+            None if stop is None else stop.is_done,
+            None if constraint is None else constraint.allowed_tokens
+        )
+
+    def _decode(self, output_ids):
+        output = self.tokenizer.decode(
+            output_ids,
+            skip_special_tokens=True,
+            spaces_between_special_tokens=False,
+            clean_up_tokenization_spaces=True,
+        )
+
+        stop_str = self.conv.stop_str
+        if isinstance(stop_str, str):
+            stop_str = [stop_str]
+        # `generate_stream` stops as soon as a stop string shows up
+        for each_stop in stop_str or []:
+            pos = output.find(each_stop)
+            if pos != -1:
+                output = output[:pos]
+                break
+
+        return output
+
+    def _add_output(self, inp, output):
+        # the same reply however early the generation stopped
+        output = cut_at_answer(output, self.stop_at_answer).strip()
 
         self.conv.update_last_message(output)
         self.history.append((inp, output))
 
         return output
 
+    def set_answer_space(self, answers=None):
+        # integers the replies may be, any if None, see `AnswerSpace`
+        self.answer_space = AnswerSpace(answers)
+
     def add_history(self, qa_lists):
         for qa_list in qa_lists:
             self.history += qa_list
-            for q, a in qa_list:
+            for qa in qa_list:
+                # forced turns keep the replies before, see `force`
+                q, a = qa[:2]
                 self.conv.append_message(self.conv.roles[0], q)
                 self.conv.append_message(self.conv.roles[1], a)
 
+    # `revoke` and `force` leave the kv cache as it is, the next call crops it to the
+    # first changed token and only recomputes the turns after it
     def revoke(self, n=1):
         assert 0 <= n and n <= len(self.history)
         if n == 0:
@@ -152,3 +306,47 @@ class FastChatModel():
         assert isinstance(new_reply, str)
         self.history[-1] = (self.history[-1][0], new_reply, *self.history[-1][1:])
         self.conv.update_last_message(new_reply)
+
+    def score(self, qa_list):
+        # score the replies of `qa_list` teacher forced after the history in one forward pass,
+        # without adding them to the history, see `score_replies`
+        assert not self.is_codet5p
+        conv = self.conv.copy()
+        prompts, turns = [], []
+        for q, a in qa_list:
+            conv.append_message(conv.roles[0], q)
+            conv.append_message(conv.roles[1], None)
+            prompts.append(conv.get_prompt())
+            conv.update_last_message(a)
+            turns.append(conv.get_prompt())
+        text = turns[-1]
+
+        replies = [a for _, a in qa_list]
+        stop_token_ids = list(conv.stop_token_ids or []) + [self.tokenizer.eos_token_id]
+
+        return score_replies(
+            self.model, self.tokenizer, text, find_reply_spans(text, prompts, turns, replies),
+            stop_token_ids
+        )
+
+    def get_stats(self):
+        stats = {}
+        if self.prefix_cache is not None:
+            stats["prefix_cache"] = self.prefix_cache.get_stats()
+        return stats
+
+    def snapshot(self):
+        return self.conv.copy(), list(self.history), self.turn_cache.snapshot()
+
+    def restore(self, snapshot):
+        # a snapshot can be restored more than once
+        conv, history, turn_cache = snapshot
+        self.conv = conv.copy()
+        self.history = list(history)
+        self.turn_cache = turn_cache.snapshot()
+
+    async def arevoke(self, n=1):
+        self.revoke(n)
+
+    async def aforce(self, new_reply):
+        self.force(new_reply)
@@ -1,5 +1,8 @@
-import google.generativeai as genai
+import asyncio
+import google.ai.generativelanguage as glm
+from google.generativeai import protos
 from loguru import logger
+import threading
 import time
 from tenacity import (
     retry,
@@ -8,6 +11,9 @@ from tenacity import (
 )  # for exponential backoff
 
 from .build import MODELS
+from .hedger import get_hedger
+from .key_pool import get_key_pool
+from .rate_limiter import estimate_tokens
 
 
 def _log_when_fail(retry_state):
@@ -18,93 +24,181 @@ def _log_when_fail(retry_state):
     )
 
 
+def _count_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None)
+
+
+def _to_content(role, text):
+    return protos.Content(role=role, parts=[protos.Part(text=text)])
+
+
+def _read_reply(response):
+    # the text of the first candidate, a blocked or empty reply is retried
+    if not response.candidates or not response.candidates[0].content.parts:
+        raise ValueError(f"No reply: {response.prompt_feedback}")
+    return "".join(part.text for part in response.candidates[0].content.parts)
+
+
+class _Client():
+    '''
+    Clients of an API key, the public ones of `google.ai.generativelanguage` instead of the
+    global one of `genai.configure`. An asyncio client only works in the event loop it is
+    built in, so there is one per loop.
+    '''
+    def __init__(self, api_key):
+        self.client_options = {"api_key": api_key}
+        self.client = glm.GenerativeServiceClient(client_options=self.client_options)
+        self._aclients = {}  # event loop -> `glm.GenerativeServiceAsyncClient`
+        self._lock = threading.Lock()
+
+    def generate(self, request):
+        return self.client.generate_content(request)
+
+    async def agenerate(self, request):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # e.g. the loops of `asyncio.run`, their channels can't be reused
+            for closed_loop in [k for k in self._aclients if k.is_closed()]:
+                self._aclients.pop(closed_loop)
+            if loop not in self._aclients:
+                self._aclients[loop] = glm.GenerativeServiceAsyncClient(
+                    client_options=self.client_options
+                )
+            aclient = self._aclients[loop]
+
+        return await aclient.generate_content(request)
+
+
 @MODELS.register()
 class Gemini():
-    def __init__(self, api_key, sleep_sec):
+    def __init__(self, api_key, sleep_sec, rate_limit=None, hedge=None):
+        # `api_key`: an API key or a list of them, see `KeyPool`
+        # `rate_limit`: config of the `RateLimiter` of each API key shared by the models in
+        #               this process, which replaces `sleep_sec`, e.g. `RATE_LIMIT_CONFIG`
+        # `hedge`: config of the `Hedger` shared by the models in this process, a hedge may
+        #          be sent with another key, e.g. `HEDGE_CONFIG`
         self.sleep_sec = sleep_sec
+        self.rate_limit = rate_limit
+        self.hedger = get_hedger(("Gemini", "gemini-pro"), hedge)
 
         if isinstance(api_key, str):
             self.api_keys = [api_key]
         else:
-            self.api_keys = api_key
+            self.api_keys = list(api_key)
 
         # Set up the model
-        generation_config = {
-            "temperature": 0.0,
-            "top_p": 1,
-            "top_k": 1,
-            "max_output_tokens": 128,
-        }
-
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_NONE"
-            },
+        self.generation_config = protos.GenerationConfig(
+            temperature=0.0,
+            top_p=1,
+            top_k=1,
+            max_output_tokens=128,
+        )
+
+        self.max_output_tokens = self.generation_config.max_output_tokens
+
+        self.safety_settings = [
+            protos.SafetySetting(category=category, threshold="BLOCK_NONE")
+            for category in [
+                "HARM_CATEGORY_HARASSMENT",
+                "HARM_CATEGORY_HATE_SPEECH",
+                "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                "HARM_CATEGORY_DANGEROUS_CONTENT",
+            ]
         ]
 
-        self.client = genai.GenerativeModel(
-            model_name="gemini-pro",
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
+        self.key_pool = get_key_pool("Gemini", self.api_keys, _Client, rate_limit)
 
         self.reset()
 
     def reset(self, instruction=None):
         self.instruction = instruction
         self.history = []
+        # contents of the episode kept in sync with `self.history`, built when needed
+        self.contents = None
+
+    def _get_contents(self):
+        if self.contents is None:
+            self.contents = self._build_contents()
+        return self.contents
 
-    def _build_conv(self):
+    def _build_contents(self):
         if self.instruction is None:
-            messages = []
+            contents = []
         else:
-            messages = [
-                {
-                    "role": "user",
-                    "parts": [self.instruction]
-                },
-                {
-                    "role": "model",
-                    "parts": [""]
-                },
-            ]
+            contents = [_to_content("user", self.instruction), _to_content("model", "")]
 
         for qa in self.history:
             q, a = qa[:2]
-            messages.append({"role": "user", "parts": [q]})
-            messages.append({"role": "model", "parts": [a]})
-
-        conv = self.client.start_chat(history=messages)
-        return conv
+            contents += [_to_content("user", q), _to_content("model", a)]
 
-    def __call__(self, prompt):
-        time.sleep(self.sleep_sec)
-        key = self.api_keys.pop(0)
-        genai.configure(api_key=key)
-        self.api_keys.append(key)
-
-        conv = self._build_conv()
+        return contents
 
-        retry(
+    def _retry(self, func):
+        return retry(
             wait=wait_random_exponential(multiplier=1, max=1000),
             stop=stop_after_attempt(15),
             before_sleep=_log_when_fail
-        )(conv.send_message)(prompt)
+        )(func)
+
+    def _get_request(self, prompt):
+        # the contents are only appended to once the reply is added, so every request, e.g.
+        # a hedge or a retry, is built from the same contents
+        return protos.GenerateContentRequest(
+            model="models/gemini-pro",
+            contents=self._get_contents() + [_to_content("user", prompt)],
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings
+        )
+
+    def _send(self, prompt):
+        # return the reply
+        request = self._get_request(prompt)
+        if self.hedger is None:
+            return _read_reply(self._send_with_key(request))
+        return _read_reply(self.hedger.call(lambda: self._send_with_key(request)))
+
+    async def _asend(self, prompt):
+        request = self._get_request(prompt)
+        if self.hedger is None:
+            return _read_reply(await self._asend_with_key(request))
+        return _read_reply(await self.hedger.acall(lambda: self._asend_with_key(request)))
+
+    def _send_with_key(self, request):
+        # every attempt picks a key
+        return self.key_pool.call(
+            lambda client: client.generate(request),
+            self._estimate_tokens(request),
+            _count_tokens
+        )
+
+    async def _asend_with_key(self, request):
+        return await self.key_pool.acall(
+            lambda client: client.agenerate(request),
+            self._estimate_tokens(request),
+            _count_tokens
+        )
+
+    def _estimate_tokens(self, request):
+        texts = [part.text for content in request.contents for part in content.parts]
+        return estimate_tokens(texts, self.max_output_tokens)
+
+    def __call__(self, prompt):
+        if self.rate_limit is None:
+            time.sleep(self.sleep_sec)
 
-        result = conv.last.text
+        result = self._retry(self._send)(prompt)
+        return self._add_result(prompt, result)
+
+    async def acall(self, prompt):
+        if self.rate_limit is None:
+            await asyncio.sleep(self.sleep_sec)
+
+        result = await self._retry(self._asend)(prompt)
+        return self._add_result(prompt, result)
+
+    def _add_result(self, prompt, result):
+        self._get_contents().extend([_to_content("user", prompt), _to_content("model", result)])
         self.history.append((prompt, result))
 
         return result
@@ -112,12 +206,43 @@ class Gemini():
     def add_history(self, qa_lists):
         for qa_list in qa_lists:
             self.history += qa_list
+            if self.contents is not None:
+                for qa in qa_list:
+                    q, a = qa[:2]
+                    self.contents.extend([_to_content("user", q), _to_content("model", a)])
 
     def revoke(self, n=1):
         assert 0 <= n and n <= len(self.history)
         if n == 0:
             return
         self.history = self.history[:-n]
+        if self.contents is not None:
+            del self.contents[-2 * n:]
 
     def force(self, new_reply):
         self.history[-1] = (self.history[-1][0], new_reply, *self.history[-1][1:])
+        if self.contents is not None:
+            # contents are shared with the snapshots, so they are replaced instead of modified
+            self.contents[-1] = _to_content("model", new_reply)
+
+    def get_stats(self):
+        stats = {"key_pool": self.key_pool.get_stats()}
+        if self.hedger is not None:
+            stats["hedger"] = self.hedger.get_stats()
+
+        return stats
+
+    def snapshot(self):
+        contents = None if self.contents is None else list(self.contents)
+        return self.instruction, list(self.history), contents
+
+    def restore(self, snapshot):
+        self.instruction, history, contents = snapshot
+        self.history = list(history)
+        self.contents = None if contents is None else list(contents)
+
+    async def arevoke(self, n=1):
+        self.revoke(n)
+
+    async def aforce(self, new_reply):
+        self.force(new_reply)
@@ -0,0 +1,168 @@
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import math
+import os
+import threading
+import time
+
+# hedgers of this process, shared by all the models calling the same API
+_hedgers = {}  # (pid, key) -> `Hedger`
+_lock = threading.Lock()
+
+
+def get_hedger(key, config):
+    '''
+    Return the hedger of the API identified by `key` in this process, built from `config`,
+    e.g. `HEDGE` of `OPENAI_CONFIG`, or None if `config` is None.
+    '''
+    if config is None:
+        return None
+
+    key = (os.getpid(), key)
+    with _lock:
+        if key not in _hedgers:
+            _hedgers[key] = Hedger(**{k.lower(): v for k, v in config.items()})
+        return _hedgers[key]
+
+
+class Hedger():
+    '''
+    Hedged requests of a deterministic API: if a request takes longer than `percentile` of
+    the last `window` latencies, the same request is sent again and the first reply wins.
+    Nothing is hedged before `min_samples` latencies are observed.
+
+    The loser is not cancelled, its latency only tells the time saved by a winning hedge. So
+    the requests should not change any state, e.g. send a copy of a chat session.
+    '''
+    def __init__(
+        self, percentile=95, window=256, min_samples=20, min_delay_sec=0.0, max_workers=64
+    ):
+        assert 0 < percentile and percentile < 100
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_sec = min_delay_sec
+        # `max_workers`: threads of sync requests, including the hedges
+        self.max_workers = max_workers
+
+        self._latencies = deque(maxlen=window)
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self._stats = dict(calls=0, hedged=0, hedge_wins=0, saved_sec=0.0)
+
+    def get_delay(self):
+        # seconds before hedging a request, or None if not hedging yet
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+
+        index = min(math.ceil(len(latencies) * self.percentile / 100) - 1, len(latencies) - 1)
+        return max(latencies[index], self.min_delay_sec)
+
+    def _record(self, start, future, recorded):
+        # the latency of the first successful request of a call, the loser's would only
+        # show up once the winner's result arrived and skew the window. The exception is
+        # retrieved as no one may wait for the loser
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            if not recorded:
+                recorded.append(future)
+                self._latencies.append(time.monotonic() - start)
+
+    def _record_loser(self, won, primary):
+        # time saved by a winning hedge, i.e. until the first request is done
+        if primary.cancelled():
+            return
+        with self._lock:
+            self._stats["saved_sec"] += max(time.monotonic() - won, 0.0)
+
+    def _pick(self, futures):
+        # the first successful request, or the first error if all failed
+        done = [future for future in futures if future.done()]
+        for future in done:
+            if future.exception() is None:
+                return future
+        return done[0] if len(done) == len(futures) else None
+
+    def call(self, func):
+        # call `func()`, which is called again in a thread if hedged
+        with self._lock:
+            self._stats["calls"] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+        delay = self.get_delay()
+
+        start = time.monotonic()
+        recorded = []
+        primary = self._executor.submit(func)
+        primary.add_done_callback(lambda future: self._record(start, future, recorded))
+        if wait([primary], timeout=delay).done:
+            return primary.result()
+
+        with self._lock:
+            self._stats["hedged"] += 1
+        hedge_start = time.monotonic()
+        hedge = self._executor.submit(func)
+        hedge.add_done_callback(lambda future: self._record(hedge_start, future, recorded))
+
+        futures = [primary, hedge]
+        winner = None
+        while winner is None:
+            wait([future for future in futures if not future.done()], return_when=FIRST_COMPLETED)
+            winner = self._pick(futures)
+        self._settle(winner, primary, hedge)
+
+        return winner.result()
+
+    async def acall(self, afunc):
+        # await `afunc()`, which is awaited again in another task if hedged
+        with self._lock:
+            self._stats["calls"] += 1
+        delay = self.get_delay()
+
+        start = time.monotonic()
+        recorded = []
+        primary = asyncio.ensure_future(afunc())
+        primary.add_done_callback(lambda future: self._record(start, future, recorded))
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self._stats["hedged"] += 1
+        hedge_start = time.monotonic()
+        hedge = asyncio.ensure_future(afunc())
+        hedge.add_done_callback(lambda future: self._record(hedge_start, future, recorded))
+
+        futures = [primary, hedge]
+        winner = None
+        while winner is None:
+            await asyncio.wait(
+                [future for future in futures if not future.done()],
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            winner = self._pick(futures)
+        self._settle(winner, primary, hedge)
+
+        return winner.result()
+
+    def _settle(self, winner, primary, hedge):
+        if winner is hedge and hedge.exception() is None:
+            with self._lock:
+                self._stats["hedge_wins"] += 1
+        if winner is hedge and not primary.done():
+            won = time.monotonic()
+            primary.add_done_callback(lambda future: self._record_loser(won, future))
+
+    def get_stats(self):
+        delay = self.get_delay()
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats["hedge_rate"] = stats["hedged"] / max(stats["calls"], 1)
+        stats["delay_sec"] = delay
+
+        return stats
@@ -0,0 +1,140 @@
+import itertools
+import os
+import threading
+import time
+
+from .rate_limiter import _get_status, get_rate_limiter
+
+# key pools of this process, shared by all the models using the same keys
+_key_pools = {}  # (pid, namespace, api keys) -> `KeyPool`
+_lock = threading.Lock()
+
+
+def get_key_pool(namespace, api_keys, make_client, rate_limit=None, **kwargs):
+    '''
+    Return the key pool of `api_keys` for the API `namespace` in this process, see `KeyPool`.
+    '''
+    key = (os.getpid(), namespace, tuple(api_keys))
+    with _lock:
+        if key not in _key_pools:
+            _key_pools[key] = KeyPool(namespace, api_keys, make_client, rate_limit, **kwargs)
+        return _key_pools[key]
+
+
+class _Key():
+    def __init__(self, api_key, client, rate_limiter):
+        self.api_key = api_key
+        self.client = client
+        self.rate_limiter = rate_limiter
+
+        self.in_flight = 0
+        self.used = 0  # order of the last use
+        self.failures = 0  # in a row
+        self.unhealthy_until = 0.0
+
+        self._stats = dict(requests=0, failures=0)
+
+    def get_stats(self, now):
+        stats = dict(self._stats)
+        stats.update(
+            # keys are secret
+            key="..." + self.api_key[-4:],
+            in_flight=self.in_flight,
+            healthy=self.unhealthy_until <= now
+        )
+        if self.rate_limiter is not None:
+            stats["rate_limiter"] = self.rate_limiter.get_stats()
+
+        return stats
+
+
+class KeyPool():
+    '''
+    Clients of an API, one per API key built by `make_client(api_key)`, each with its own
+    rate limiter built from `rate_limit`, if any.
+
+    A request is sent with the healthy key with the least requests in flight, including
+    the ones waiting for its rate limiter, so that the throughput grows with the keys. A key
+    whose request is throttled (429), rejected (401, 403) or failed on the server (5xx) is
+    unhealthy for `backoff_sec`, doubled for every failure in a row up to `max_backoff_sec`.
+    '''
+    def __init__(
+        self, namespace, api_keys, make_client, rate_limit=None, backoff_sec=1.0,
+        max_backoff_sec=300.0
+    ):
+        assert len(api_keys) > 0
+        self.keys = [
+            _Key(api_key, make_client(api_key), get_rate_limiter((namespace, api_key), rate_limit))
+            for api_key in api_keys
+        ]
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [key for key in self.keys if key.unhealthy_until <= now]
+            if not candidates:
+                candidates = [min(self.keys, key=lambda key: key.unhealthy_until)]
+            # the least recently used one of the least loaded keys
+            key = min(candidates, key=lambda key: (key.in_flight, key.used))
+            key.in_flight += 1
+            key.used = next(self._counter)
+            key._stats["requests"] += 1
+
+            return key
+
+    def _release(self, key, exception=None):
+        with self._lock:
+            key.in_flight -= 1
+            if exception is None:
+                key.failures = 0
+                return
+
+            status = _get_status(exception)
+            if status is None or status < 500 and status not in [401, 403, 429]:
+                return
+
+            key.failures += 1
+            key._stats["failures"] += 1
+            backoff_sec = min(self.backoff_sec * 2 ** (key.failures - 1), self.max_backoff_sec)
+            key.unhealthy_until = time.monotonic() + backoff_sec
+
+    def call(self, func, tokens=0, count_tokens=None):
+        # call `func(client)` with a key, see `RateLimiter.call` for the other arguments
+        key = self._acquire()
+        try:
+            if key.rate_limiter is None:
+                result = func(key.client)
+            else:
+                result = key.rate_limiter.call(lambda: func(key.client), tokens, count_tokens)
+        except BaseException as e:
+            self._release(key, e)
+            raise
+        self._release(key)
+
+        return result
+
+    async def acall(self, afunc, tokens=0, count_tokens=None):
+        key = self._acquire()
+        try:
+            if key.rate_limiter is None:
+                result = await afunc(key.client)
+            else:
+                result = await key.rate_limiter.acall(
+                    lambda: afunc(key.client), tokens, count_tokens
+                )
+        except BaseException as e:
+            self._release(key, e)
+            raise
+        self._release(key)
+
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return [key.get_stats(now) for key in self.keys]
@@ -0,0 +1,218 @@
+from collections import OrderedDict
+from copy import copy
+import threading
+
+import torch
+from transformers import DynamicCache
+
+
+class TurnCache():
+    '''
+    KV cache of the last turn of a conversation.
+
+    The next turn only prefills the tokens after the longest common prefix of the cached
+    tokens and the newly encoded context. When the chat template renders the old turns
+    differently, the cache is cropped to where they diverge, and the whole context is
+    encoded again if they diverge from the start.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ids = []  # token ids whose keys and values are in `self.cache`
+        self.cache = None
+
+    def snapshot(self):
+        '''
+        Copy on write: `DynamicCache` replaces its tensors instead of modifying them when
+        growing or cropping, so the copy only needs its own lists of tensors.
+        '''
+        snapshot = TurnCache()
+        snapshot.ids = list(self.ids)
+        if self.cache is not None:
+            snapshot.cache = copy(self.cache)
+            snapshot.cache.key_cache = list(self.cache.key_cache)
+            snapshot.cache.value_cache = list(self.cache.value_cache)
+
+        return snapshot
+
+    def match(self, input_ids):
+        '''
+        Return the number of reusable tokens, at least one token is left to prefill.
+        '''
+        n = 0
+        for cached_id, input_id in zip(self.ids, input_ids[:-1]):
+            if cached_id != input_id:
+                break
+            n += 1
+
+        return n
+
+    def crop(self, n):
+        self.ids = self.ids[:n]
+        self.cache.crop(n)
+
+    def compact(self):
+        # copy the cropped tensors, which keep the whole storages of the uncropped ones alive
+        if self.cache is not None:
+            self.cache.key_cache = [key.clone() for key in self.cache.key_cache]
+            self.cache.value_cache = [value.clone() for value in self.cache.value_cache]
+
+    @property
+    def nbytes(self):
+        # bytes of the storages kept alive by the cache, not of the views into them
+        if self.cache is None:
+            return 0
+        storages = {}
+        for tensor in self.cache.key_cache + self.cache.value_cache:
+            storage = tensor.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+
+        return sum(storages.values())
+
+    def generate(self, model, input_ids, prefix_cache=None, prefix_ids=None, **kwargs):
+        '''
+        Greedy generation with `model.generate` that reuses and then updates the cache.
+        The first turn of a conversation starts from `prefix_cache`, to which the tokens it
+        shares with `prefix_ids`, e.g. the instruction and the examples, are then saved.
+        The whole first turn is saved if `prefix_ids` is None.
+        Return the generated token ids.
+        '''
+        first_turn = not self.ids
+        if first_turn and prefix_cache is not None:
+            prefix = prefix_cache.lookup(input_ids)
+            if prefix is not None:
+                self.ids, self.cache = prefix.ids, prefix.cache
+
+        n = self.match(input_ids)
+        if n > 0:
+            self.crop(n)
+            cache = self.cache
+        else:
+            cache = DynamicCache()
+
+        output = model.generate(
+            torch.tensor([input_ids], device=model.device),
+            past_key_values=cache,
+            do_sample=False,
+            return_dict_in_generate=True,
+            **kwargs
+        )
+        sequence = output.sequences[0].tolist()
+
+        # the last generated token is never fed to the model
+        self.cache = output.past_key_values
+        self.ids = sequence[:self.cache.get_seq_length()]
+
+        if first_turn and prefix_cache is not None:
+            n = len(input_ids)
+            if prefix_ids is not None:
+                n = 0
+                for prefix_id, input_id in zip(prefix_ids, input_ids):
+                    if prefix_id != input_id:
+                        break
+                    n += 1
+            if n > 0:
+                prefix = self.snapshot()
+                prefix.crop(n)
+                prefix.compact()
+                prefix_cache.insert(prefix)
+
+        return sequence[len(input_ids):]
+
+
+class _PrefixNode():
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children = {}  # token id -> `_PrefixNode`
+        self.keys = set()  # keys of the entries whose token ids pass through the node
+
+
+class PrefixCache():
+    '''
+    LRU cache of the shared prefixes of conversations, e.g. the instruction and examples of
+    test cases, bounded by the bytes of kv caches.
+
+    Shared by all the conversations of a model, a conversation starts from the entry
+    sharing the longest prefix with it, which is found by walking a trie of the token ids
+    of the entries.
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # tuple of token ids -> `TurnCache`
+        self._root = _PrefixNode()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+        self._stats = dict(lookups=0, hits=0, lookup_tokens=0, hit_tokens=0, evictions=0)
+
+    def lookup(self, input_ids):
+        '''
+        Return a snapshot of an entry sharing the longest prefix with `input_ids`, at least
+        one token is left to prefill, or None if no entry shares any token.
+        '''
+        with self._lock:
+            node, n = self._root, 0
+            for input_id in input_ids[:-1]:
+                child = node.children.get(input_id)
+                if child is None:
+                    break
+                node, n = child, n + 1
+
+            self._stats["lookups"] += 1
+            self._stats["lookup_tokens"] += len(input_ids)
+            if n == 0:
+                return None
+
+            best = next(iter(node.keys))
+            self._stats["hits"] += 1
+            self._stats["hit_tokens"] += n
+            self._entries.move_to_end(best)
+
+            return self._entries[best].snapshot()
+
+    def insert(self, turn_cache):
+        nbytes = turn_cache.nbytes
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            key = tuple(turn_cache.ids)
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = turn_cache
+            self._nbytes += nbytes
+            node = self._root
+            for token_id in key:
+                node = node.children.setdefault(token_id, _PrefixNode())
+                node.keys.add(key)
+
+            while self._nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        self._nbytes -= self._entries.pop(key).nbytes
+        node = self._root
+        for token_id in key:
+            child = node.children[token_id]
+            child.keys.discard(key)
+            if not child.keys:
+                # no other entry passes through the rest of the path
+                del node.children[token_id]
+                return
+            node = child
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["nbytes"] = self._nbytes
+
+        stats["hit_rate"] = stats["hits"] / max(stats["lookups"], 1)
+        stats["token_hit_rate"] = stats["hit_tokens"] / max(stats["lookup_tokens"], 1)
+
+        return stats
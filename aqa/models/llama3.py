@@ -1,12 +1,19 @@
+import asyncio
 import torch
-from transformers import pipeline
+from transformers import LogitsProcessorList, StoppingCriteriaList, pipeline
 
+from .answer_stop import StopAtAnswer, cut_at_answer
 from .build import MODELS
+from .constrained import AnswerSpace, IntegerConstraint, IntegerLogitsProcessor
+from .engine import GenerationEngine
 
 
 @MODELS.register()
 class Llama3():
-    def __init__(self, model_id, max_new_tokens=32):
+    def __init__(
+        self, model_id, max_new_tokens=32, max_batch_size=0, stop_at_answer=None,
+        constrained=False
+    ):
         self.model_id = model_id
         self.pipeline = pipeline(
             "text-generation",
@@ -21,6 +28,23 @@ class Llama3():
         ]
         
         self.max_new_tokens = max_new_tokens
+        # `stop_at_answer`: "tolerant" or "strict" as `FORMAT_TOLERANT` of the benchmark, stop
+        #                   generating once the answer is decided, see `find_answer_end`
+        self.stop_at_answer = stop_at_answer
+
+        # `max_batch_size > 0`: generate with a continuous-batching engine shared by all
+        #                       the copies of this model, i.e. concurrent conversations
+        self.engine = None
+        if max_batch_size > 0:
+            self.engine = GenerationEngine(
+                self.pipeline.model, max_batch_size, self.pipeline.tokenizer.pad_token_id
+            )
+
+        # `constrained`: only generate the integers of the answer space set by the benchmark,
+        #                see `set_answer_space`
+        self.constraint = IntegerConstraint(self.pipeline.tokenizer) if constrained else None
+        self.answer_space = AnswerSpace()
+
         self.reset()
 
     def reset(self, instruction=None):
@@ -36,18 +60,75 @@ class Llama3():
     def __call__(self, prompt):
         messages = self.get_messages(prompt)
 
+        if self.engine is not None:
+            output = self.engine.generate(*self._get_engine_args(messages))
+            return self._add_output(prompt, self._decode(output))
+
+        # the pipeline generates after the same ids as `get_input_ids`
+        input_len = len(self.get_input_ids(messages))
+        stop = self._get_stop(input_len)
+        constraint = self._get_constraint(input_len)
         outputs = self.pipeline(
             messages,
             max_new_tokens=self.max_new_tokens,
             eos_token_id=self.terminators,
             do_sample=False,
+            stopping_criteria=None if stop is None else StoppingCriteriaList([stop]),
+            logits_processor=None if constraint is None else LogitsProcessorList([constraint])
         )
 
-        output = outputs[0]["generated_text"][-1]["content"]
-        self.history.append((prompt, output))
+        return self._add_output(prompt, outputs[0]["generated_text"][-1]["content"])
+
+    async def acall(self, prompt):
+        if self.engine is None:
+            return self(prompt)
+
+        messages = self.get_messages(prompt)
+        output = await asyncio.wrap_future(self.engine.submit(*self._get_engine_args(messages)))
+
+        return self._add_output(prompt, self._decode(output))
+
+    def get_input_ids(self, messages):
+        return self.pipeline.tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+
+    def _get_engine_args(self, messages):
+        stop = self._get_stop()
+        constraint = self._get_constraint()
+
+        return (
+            self.get_input_ids(messages), self.max_new_tokens, self.terminators,
+            None if stop is None else stop.is_done,
+            None if constraint is None else constraint.allowed_tokens
+        )
 
+    def _get_stop(self, input_len=0):
+        # the stopping criteria of `stop_at_answer`, if any
+        if self.stop_at_answer is None:
+            return None
+        return StopAtAnswer(self._decode, self.stop_at_answer, input_len)
+
+    def _get_constraint(self, input_len=0):
+        # the logits processor of `constrained`, if any
+        if self.constraint is None:
+            return None
+        return IntegerLogitsProcessor(
+            self.constraint, self.answer_space, self.terminators, input_len
+        )
+
+    def _decode(self, output_ids):
+        return self.pipeline.tokenizer.decode(output_ids, skip_special_tokens=True)
+
+    def _add_output(self, prompt, output):
+        # the same reply however early the generation stopped
+        output = cut_at_answer(output, self.stop_at_answer)
+
+        self.history.append((prompt, output))
         return output
 
+    def set_answer_space(self, answers=None):
+        # integers the replies may be, any if None, see `AnswerSpace`
+        self.answer_space = AnswerSpace(answers)
+
     def get_messages(self, inp):
         messages = []
 
@@ -78,3 +159,16 @@ class Llama3():
     def force(self, new_reply):
         assert isinstance(new_reply, str)
         self.history[-1] = (self.history[-1][0], new_reply, *self.history[-1][1:])
+
+    def snapshot(self):
+        return self.instruction, list(self.history)
+
+    def restore(self, snapshot):
+        self.instruction, history = snapshot
+        self.history = list(history)
+
+    async def arevoke(self, n=1):
+        self.revoke(n)
+
+    async def aforce(self, new_reply):
+        self.force(new_reply)
@@ -1,3 +1,5 @@
+import asyncio
+from copy import deepcopy
 from loguru import logger
 import openai
 import time
@@ -7,7 +9,10 @@ from tenacity import (
     wait_random_exponential,
 )  # for exponential backoff
 
+from .answer_stop import cut_at_answer, find_answer_end
 from .build import MODELS
+from .hedger import get_hedger
+from .rate_limiter import estimate_tokens, get_rate_limiter
 
 
 def _log_when_fail(retry_state):
@@ -18,21 +23,61 @@ def _log_when_fail(retry_state):
     )
 
 
+def _count_tokens(result):
+    _, usage = result
+    return None if usage is None else usage.total_tokens
+
+
+def _read_choices(choices, result=""):
+    # add the text of the choices of a completion, or the deltas of a streamed chunk
+    for choice in choices:
+        message = getattr(choice, "message", None) or getattr(choice, "delta", None)
+        if message is not None and message.content is not None:
+            result += message.content
+    return result
+
+
 @MODELS.register()
 class OpenAI():
-    def __init__(self, model_name, api_key, api_version, end_point, sleep_sec=0.5):
+    def __init__(
+        self, model_name, api_key, api_version, end_point, sleep_sec=0.5, rate_limit=None,
+        hedge=None, stop_at_answer=None, send_history=False
+    ):
+        # `rate_limit`: config of the `RateLimiter` shared by the models of the deployment in
+        #               this process, which replaces `sleep_sec`, e.g. `RATE_LIMIT_CONFIG`
+        # `hedge`: config of the `Hedger` shared likewise, e.g. `HEDGE_CONFIG`
+        # `stop_at_answer`: "tolerant" or "strict" as `FORMAT_TOLERANT` of the benchmark, stream
+        #                   the reply and close the stream once the answer is decided
+        # `send_history`: also send the turns of `add_history`, e.g. the examples, as messages,
+        #                 which the wrappers replaying turns and `PARALLEL_TF` require
         self.model_name = model_name
+        self.send_history = send_history
+        self.stop_at_answer = stop_at_answer
         self.sleep_sec = sleep_sec
+        self.rate_limiter = get_rate_limiter(("OpenAI", end_point, model_name), rate_limit)
+        self.hedger = get_hedger(("OpenAI", end_point, model_name), hedge)
+        # the rate limiter should see the throttled requests that the client would retry
+        max_retries = openai.DEFAULT_MAX_RETRIES if self.rate_limiter is None else 0
         self.client = openai.AzureOpenAI(
             azure_endpoint=end_point,
             api_key=api_key,
-            api_version=api_version
+            api_version=api_version,
+            max_retries=max_retries
+        )
+        self.aclient = openai.AsyncAzureOpenAI(
+            azure_endpoint=end_point,
+            api_key=api_key,
+            api_version=api_version,
+            max_retries=max_retries
         )
-        self.completion_func = retry(
+        retry_decorator = retry(
             wait=wait_random_exponential(min=1, max=5),
             stop=stop_after_attempt(15),
             before_sleep=_log_when_fail
-        )(self.client.chat.completions.create)
+        )
+        # every attempt is rate limited
+        self.completion_func = retry_decorator(self._create)
+        self.acompletion_func = retry_decorator(self._acreate)
 
         self.reset()
 
@@ -44,25 +89,107 @@ class OpenAI():
         self.history = []
 
     def __call__(self, prompt):
-        time.sleep(self.sleep_sec)
-        self.messages.append({
-            "role": "user",
-            "content": [{"type": "text", "text": prompt},],
-        })
+        if self.rate_limiter is None:
+            time.sleep(self.sleep_sec)
+        result, _ = self.completion_func(**self._get_request(prompt))
+
+        return self._add_result(prompt, result)
+
+    async def acall(self, prompt):
+        if self.rate_limiter is None:
+            await asyncio.sleep(self.sleep_sec)
+        result, _ = await self.acompletion_func(**self._get_request(prompt))
+
+        return self._add_result(prompt, result)
+
+    def _create(self, **kwargs):
+        # return the result and the usage, if any
+        if self.hedger is None:
+            return self._create_limited(kwargs)
+        return self.hedger.call(lambda: self._create_limited(kwargs))
+
+    # tenacity only retries coroutine functions defined with `async def`
+    async def _acreate(self, **kwargs):
+        if self.hedger is None:
+            return await self._acreate_limited(kwargs)
+        return await self.hedger.acall(lambda: self._acreate_limited(kwargs))
+
+    def _create_limited(self, kwargs):
+        if self.rate_limiter is None:
+            return self._send(kwargs)
+        return self.rate_limiter.call(
+            lambda: self._send(kwargs),
+            self._estimate_tokens(kwargs),
+            _count_tokens
+        )
 
-        response = self.completion_func(
+    async def _acreate_limited(self, kwargs):
+        if self.rate_limiter is None:
+            return await self._asend(kwargs)
+        return await self.rate_limiter.acall(
+            lambda: self._asend(kwargs),
+            self._estimate_tokens(kwargs),
+            _count_tokens
+        )
+
+    def _send(self, kwargs):
+        if self.stop_at_answer is None:
+            response = self.client.chat.completions.create(**kwargs)
+            return _read_choices(response.choices), response.usage
+
+        result, usage = "", None
+        with self.client.chat.completions.create(stream=True, **kwargs) as stream:
+            for chunk in stream:
+                result = _read_choices(chunk.choices, result)
+                usage = chunk.usage or usage
+                if self._is_answered(result):
+                    break
+        return result, usage
+
+    async def _asend(self, kwargs):
+        if self.stop_at_answer is None:
+            response = await self.aclient.chat.completions.create(**kwargs)
+            return _read_choices(response.choices), response.usage
+
+        result, usage = "", None
+        async with await self.aclient.chat.completions.create(stream=True, **kwargs) as stream:
+            async for chunk in stream:
+                result = _read_choices(chunk.choices, result)
+                usage = chunk.usage or usage
+                if self._is_answered(result):
+                    break
+        return result, usage
+
+    def _is_answered(self, result):
+        # closing the stream stops the generation, the usage of a closed stream is unknown
+        return find_answer_end(result, self.stop_at_answer) is not None
+
+    def _estimate_tokens(self, request):
+        texts = [part["text"] for message in request["messages"] for part in message["content"]]
+        return estimate_tokens(texts, request["max_tokens"])
+
+    def _get_request(self, prompt):
+        # the user message is only appended along with the reply, so a failed call leaves
+        # the conversation as it was
+        return dict(
             model=self.model_name,
-            messages=self.messages,
+            messages=self.messages + [{
+                "role": "user",
+                "content": [{"type": "text", "text": prompt},],
+            }],
             max_tokens=128,
             temperature=0.0,
             seed=42
         )
 
-        result = ""
-        for choice in response.choices:
-            if choice.message.content is not None:
-                result += choice.message.content
+    def _add_result(self, prompt, result):
+        # the same reply however early the stream was closed
+        result = cut_at_answer(result, self.stop_at_answer)
 
+        self.messages.append({
+            "role": "user",
+            "content": [{"type": "text", "text": prompt},],
+        })
         self.messages.append({
             "role": "assistant",
             "content": [{"type": "text", "text": result},],
@@ -82,17 +209,60 @@ class OpenAI():
 
         return context
 
+    # with `send_history`, `messages` always follows `history`, i.e. each turn is a user and
+    # an assistant message, otherwise the turns of `add_history` are only kept in `history`
     def add_history(self, qa_lists):
         for qa_list in qa_lists:
             self.history += qa_list
+            if not self.send_history:
+                continue
+
+            for qa in qa_list:
+                # forced turns keep the replies before, see `force`
+                q, a = qa[:2]
+                self.messages.append({
+                    "role": "user",
+                    "content": [{"type": "text", "text": q},],
+                })
+                self.messages.append({
+                    "role": "assistant",
+                    "content": [{"type": "text", "text": a},],
+                })
 
     def revoke(self, n=1):
         assert 0 <= n and n <= len(self.history)
         if n == 0:
             return
         self.history = self.history[:-n]
-        self.messages = self.messages[:-n]
+        if self.send_history:
+            self.messages = self.messages[:-2 * n]
+        else:
+            self.messages = self.messages[:-n]
 
     def force(self, new_reply):
         self.history[-1] = (self.history[-1][0], new_reply, *self.history[-1][1:])
         self.messages[-1]["content"][0]["text"] = new_reply
+
+    def get_stats(self):
+        stats = {}
+        if self.rate_limiter is not None:
+            stats["rate_limiter"] = self.rate_limiter.get_stats()
+        if self.hedger is not None:
+            stats["hedger"] = self.hedger.get_stats()
+
+        return stats
+
+    def snapshot(self):
+        # `force` modifies the messages in place
+        return deepcopy(self.messages), list(self.history)
+
+    def restore(self, snapshot):
+        messages, history = snapshot
+        self.messages = deepcopy(messages)
+        self.history = list(history)
+
+    async def arevoke(self, n=1):
+        self.revoke(n)
+
+    async def aforce(self, new_reply):
+        self.force(new_reply)
@@ -0,0 +1,325 @@
+import asyncio
+from copy import deepcopy
+import json
+import os
+import threading
+import time
+
+import httpx
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from .answer_stop import cut_at_answer, find_answer_end
+from .build import MODELS
+from .hedger import get_hedger
+from .openai import _log_when_fail
+from .rate_limiter import estimate_tokens, get_rate_limiter
+
+# keep-alive clients shared by all the models of a process, an async client is bound to the
+# event loop it is used in
+_clients = {}  # (pid, base url, api key) -> `httpx.Client`
+_aclients = {}  # event loop -> {(base url, api key): `httpx.AsyncClient`}
+_lock = threading.Lock()
+
+
+def _client_kwargs(base_url, api_key, timeout, max_connections):
+    headers = {} if api_key is None else {"Authorization": f"Bearer {api_key}"}
+    return dict(
+        base_url=base_url,
+        headers=headers,
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+    )
+
+
+def _get_client(base_url, api_key, timeout, max_connections):
+    key = (os.getpid(), base_url, api_key)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = httpx.Client(
+                **_client_kwargs(base_url, api_key, timeout, max_connections)
+            )
+        return _clients[key]
+
+
+def _get_aclient(base_url, api_key, timeout, max_connections):
+    loop = asyncio.get_running_loop()
+    with _lock:
+        # e.g. the loops of `asyncio.run`, their connections can't be reused
+        for closed_loop in [k for k in _aclients if k.is_closed()]:
+            _aclients.pop(closed_loop)
+        clients = _aclients.setdefault(loop, {})
+        if (base_url, api_key) not in clients:
+            clients[base_url, api_key] = httpx.AsyncClient(
+                **_client_kwargs(base_url, api_key, timeout, max_connections)
+            )
+        return clients[base_url, api_key]
+
+
+def _is_transient(exception):
+    # retry on network errors, rate limits and server errors
+    if isinstance(exception, httpx.HTTPStatusError):
+        status_code = exception.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(exception, httpx.TransportError)
+
+
+def _parse_event(line):
+    # the chunk of a server-sent event line, or None if it is not a chunk
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return None
+    return json.loads(data)
+
+
+def _count_tokens(result):
+    _, usage = result
+    if not usage:
+        return None
+    return (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+
+
+@MODELS.register()
+class OpenAICompatible():
+    '''
+    Chat model served behind an OpenAI-compatible HTTP endpoint, e.g. vLLM, llama.cpp server
+    or FastChat's openai_api_server.
+
+    All the models of a process share a keep-alive connection pool, so the concurrent
+    conversations of `Benchmark.test_with_examples` send their requests concurrently.
+    Responses are streamed if `stream`.
+    '''
+    def __init__(
+        self, model_name, base_url, api_key=None, max_tokens=128, temperature=0.0, seed=None,
+        stream=True, timeout=600.0, max_connections=64, sleep_sec=0.0, rate_limit=None,
+        hedge=None, stop_at_answer=None
+    ):
+        # `base_url`: e.g. "http://localhost:8000/v1"
+        # `rate_limit`: config of the `RateLimiter` shared by the models of the server in this
+        #               process, which replaces `sleep_sec`, e.g. `RATE_LIMIT_CONFIG`
+        # `hedge`: config of the `Hedger` shared likewise, e.g. `HEDGE_CONFIG`
+        # `stop_at_answer`: "tolerant" or "strict" as `FORMAT_TOLERANT` of the benchmark, close
+        #                   the stream once the answer is decided, see `find_answer_end`
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.seed = seed
+        self.stream = stream
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.sleep_sec = sleep_sec
+        self.stop_at_answer = stop_at_answer
+        self.rate_limiter = get_rate_limiter(
+            ("OpenAICompatible", self.base_url, model_name), rate_limit
+        )
+        self.hedger = get_hedger(("OpenAICompatible", self.base_url, model_name), hedge)
+
+        retry_decorator = retry(
+            retry=retry_if_exception(_is_transient),
+            wait=wait_random_exponential(min=1, max=5),
+            stop=stop_after_attempt(15),
+            before_sleep=_log_when_fail,
+            reraise=True
+        )
+        self.completion_func = retry_decorator(self._complete)
+        self.acompletion_func = retry_decorator(self._acomplete)
+
+        # shared by the copies of the model
+        self._stats = dict(requests=0, prompt_tokens=0, completion_tokens=0, stopped=0)
+
+        self.reset()
+
+    def reset(self, instruction="You are a chatbot"):
+        self.messages = [{"role": "system", "content": instruction}]
+        self.history = []
+
+    def __call__(self, prompt):
+        if self.rate_limiter is None:
+            time.sleep(self.sleep_sec)
+        result, _ = self.completion_func(self._get_request(prompt))
+
+        return self._add_result(prompt, result)
+
+    async def acall(self, prompt):
+        if self.rate_limiter is None:
+            await asyncio.sleep(self.sleep_sec)
+        result, _ = await self.acompletion_func(self._get_request(prompt))
+
+        return self._add_result(prompt, result)
+
+    def _get_request(self, prompt):
+        # the conversation is only changed once the reply is received, see `_add_result`
+        request = dict(
+            model=self.model_name,
+            messages=self.messages + [{"role": "user", "content": prompt}],
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=self.stream
+        )
+        if self.seed is not None:
+            request["seed"] = self.seed
+
+        return request
+
+    def _complete(self, request):
+        # return the result and the usage, if any
+        if self.hedger is None:
+            return self._complete_limited(request)
+        return self.hedger.call(lambda: self._complete_limited(request))
+
+    async def _acomplete(self, request):
+        if self.hedger is None:
+            return await self._acomplete_limited(request)
+        return await self.hedger.acall(lambda: self._acomplete_limited(request))
+
+    def _complete_limited(self, request):
+        if self.rate_limiter is None:
+            return self._post(request)
+        return self.rate_limiter.call(
+            lambda: self._post(request), self._estimate_tokens(request), _count_tokens
+        )
+
+    async def _acomplete_limited(self, request):
+        if self.rate_limiter is None:
+            return await self._apost(request)
+        return await self.rate_limiter.acall(
+            lambda: self._apost(request), self._estimate_tokens(request), _count_tokens
+        )
+
+    def _estimate_tokens(self, request):
+        texts = [message["content"] for message in request["messages"]]
+        return estimate_tokens(texts, request["max_tokens"])
+
+    def _post(self, request):
+        client = _get_client(self.base_url, self.api_key, self.timeout, self.max_connections)
+        self._stats["requests"] += 1
+
+        if not self.stream:
+            response = client.post("/chat/completions", json=request)
+            response.raise_for_status()
+            return self._read_completion(response.json())
+
+        result, usage = "", None
+        with client.stream("POST", "/chat/completions", json=request) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                result, usage = self._read_chunk(_parse_event(line), result, usage)
+                if self._is_answered(result):
+                    break
+        self._add_usage(usage)
+
+        return result, usage
+
+    async def _apost(self, request):
+        client = _get_aclient(self.base_url, self.api_key, self.timeout, self.max_connections)
+        self._stats["requests"] += 1
+
+        if not self.stream:
+            response = await client.post("/chat/completions", json=request)
+            response.raise_for_status()
+            return self._read_completion(response.json())
+
+        result, usage = "", None
+        async with client.stream("POST", "/chat/completions", json=request) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                result, usage = self._read_chunk(_parse_event(line), result, usage)
+                if self._is_answered(result):
+                    break
+        self._add_usage(usage)
+
+        return result, usage
+
+    def _add_usage(self, usage):
+        if usage:
+            self._stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            self._stats["completion_tokens"] += usage.get("completion_tokens") or 0
+
+    def _read_completion(self, completion):
+        usage = completion.get("usage")
+        self._add_usage(usage)
+
+        result = ""
+        for choice in completion["choices"]:
+            if choice["message"].get("content") is not None:
+                result += choice["message"]["content"]
+
+        return result, usage
+
+    def _read_chunk(self, chunk, result, usage):
+        # the result and the usage with a streamed chunk, if any
+        if chunk is None:
+            return result, usage
+        # only the last chunk has the usage, if any
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices", []):
+            content = (choice.get("delta") or {}).get("content")
+            if content is not None:
+                result += content
+
+        return result, usage
+
+    def _is_answered(self, result):
+        # closing the connection aborts the request on the server, e.g. vLLM, and the usage
+        # of the request is unknown
+        if self.stop_at_answer is None or find_answer_end(result, self.stop_at_answer) is None:
+            return False
+        self._stats["stopped"] += 1
+        return True
+
+    def _add_result(self, prompt, result):
+        # the same reply however early the stream was closed
+        result = cut_at_answer(result, self.stop_at_answer)
+        self.messages.append({"role": "user", "content": prompt})
+        self.messages.append({"role": "assistant", "content": result})
+        self.history.append((prompt, result))
+
+        return result
+
+    def add_history(self, qa_lists):
+        for qa_list in qa_lists:
+            self.history += qa_list
+            for qa in qa_list:
+                # forced turns keep the replies before, see `force`
+                q, a = qa[:2]
+                self.messages.append({"role": "user", "content": q})
+                self.messages.append({"role": "assistant", "content": a})
+
+    def revoke(self, n=1):
+        assert 0 <= n and n <= len(self.history)
+        if n == 0:
+            return
+        self.history = self.history[:-n]
+        self.messages = self.messages[:-2 * n]
+
+    def force(self, new_reply):
+        self.history[-1] = (self.history[-1][0], new_reply, *self.history[-1][1:])
+        self.messages[-1] = {"role": "assistant", "content": new_reply}
+
+    def get_stats(self):
+        stats = {"requests": dict(self._stats)}
+        if self.rate_limiter is not None:
+            stats["rate_limiter"] = self.rate_limiter.get_stats()
+        if self.hedger is not None:
+            stats["hedger"] = self.hedger.get_stats()
+
+        return stats
+
+    def snapshot(self):
+        return deepcopy(self.messages), list(self.history)
+
+    def restore(self, snapshot):
+        messages, history = snapshot
+        self.messages = deepcopy(messages)
+        self.history = list(history)
+
+    async def arevoke(self, n=1):
+        self.revoke(n)
+
+    async def aforce(self, new_reply):
+        self.force(new_reply)
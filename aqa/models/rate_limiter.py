@@ -0,0 +1,285 @@
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
+import math
+import os
+import threading
+import time
+
+# rate limiters of this process, shared by all the models calling the same API
+_rate_limiters = {}  # (pid, key) -> `RateLimiter`
+_lock = threading.Lock()
+
+
+def get_rate_limiter(key, config):
+    '''
+    Return the rate limiter of the API identified by `key` in this process, built from
+    `config`, e.g. `RATE_LIMIT` of `OPENAI_CONFIG`, or None if `config` is None.
+    '''
+    if config is None:
+        return None
+
+    key = (os.getpid(), key)
+    with _lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(**{k.lower(): v for k, v in config.items()})
+        return _rate_limiters[key]
+
+
+def estimate_tokens(texts, max_tokens):
+    # a rough upper bound of the tokens of a request before it is sent
+    return sum(len(text) for text in texts) // 4 + max_tokens
+
+
+def _get_status(exception):
+    # HTTP status of a failed request, e.g. `httpx.HTTPStatusError`, `openai.APIStatusError`
+    # or `google.api_core.exceptions.GoogleAPICallError`, or None
+    response = getattr(exception, "response", None)
+    if getattr(response, "status_code", None) is not None:
+        return int(response.status_code)
+    code = getattr(exception, "code", None)
+    if isinstance(code, int):
+        return int(code)
+    return None
+
+
+def _get_retry_after(exception):
+    # seconds in the Retry-After header of a failed request, or None
+    headers = getattr(getattr(exception, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class _TokenBucket():
+    def __init__(self, per_min):
+        self.capacity = per_min
+        self.rate = per_min / 60
+        self.level = per_min
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_sec(self, amount):
+        # a request larger than the capacity waits for a full bucket and runs into debt
+        amount = min(amount, self.capacity)
+        return max(amount - self.level, 0) / self.rate
+
+
+class _Waiter():
+    # a sync or asyncio caller waiting in line, which can be woken from any thread
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else asyncio.Event()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class RateLimiter():
+    '''
+    Rate limits of an API shared by all the conversations of a process, see
+    `get_rate_limiter`:
+    - token buckets of requests and tokens per minute, if not None
+    - an adaptive concurrency limit (AIMD), which increases by `1 / limit` after each
+      successful request, i.e. by about 1 after `limit` successful requests, and is halved
+      on a request throttled (429) or failed on the server (5xx), at most once per
+      `cooldown` seconds
+    A Retry-After header pauses all the requests for the given seconds.
+
+    Requests that cannot be sent at once wait in line and are sent first in, first out,
+    whether they are sync or from any event loop. Only the first in line waits for the
+    buckets, the others wait until they are first.
+    '''
+    def __init__(
+        self, requests_per_min=None, tokens_per_min=None, max_concurrency=64,
+        min_concurrency=1, init_concurrency=None, cooldown=1.0
+    ):
+        assert 1 <= min_concurrency and min_concurrency <= max_concurrency
+        self.requests = None if requests_per_min is None else _TokenBucket(requests_per_min)
+        self.tokens = None if tokens_per_min is None else _TokenBucket(tokens_per_min)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.cooldown = cooldown
+
+        self.limit = float(init_concurrency or max_concurrency)
+        self.in_flight = 0
+        self._waiters = deque()  # `_Waiter`s in line
+        self._paused_until = 0.0
+        self._decreased = float("-inf")
+        self._lock = threading.Lock()
+
+        self._stats = dict(requests=0, throttled=0, failed=0, decreases=0, wait_sec=0.0)
+
+    def _try_acquire(self, tokens):
+        # return 0 if acquired, otherwise the seconds to wait before trying again, or `inf`
+        # until a request is released
+        now = time.monotonic()
+        for bucket in [self.requests, self.tokens]:
+            if bucket is not None:
+                bucket.refill(now)
+
+        wait_sec = max(self._paused_until - now, 0)
+        if self.in_flight >= int(self.limit):
+            wait_sec = math.inf
+        if self.requests is not None:
+            wait_sec = max(wait_sec, self.requests.wait_sec(1))
+        if self.tokens is not None:
+            wait_sec = max(wait_sec, self.tokens.wait_sec(tokens))
+        if wait_sec > 0:
+            return wait_sec
+
+        self.in_flight += 1
+        self._stats["requests"] += 1
+        if self.requests is not None:
+            self.requests.level -= 1
+        if self.tokens is not None:
+            self.tokens.level -= tokens
+        return 0
+
+    def _enter(self, tokens, loop=None):
+        # acquire at once if no one is waiting and return None, otherwise get in line
+        with self._lock:
+            if not self._waiters and self._try_acquire(tokens) == 0:
+                return None
+
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _poll(self, waiter, tokens):
+        # return 0 if `waiter` acquired, otherwise the seconds to wait before polling again,
+        # or None until it is woken, i.e. it is first in line or a request is released
+        with self._lock:
+            waiter.event.clear()
+            if self._waiters[0] is not waiter:
+                return None
+
+            wait_sec = self._try_acquire(tokens)
+            return None if wait_sec == math.inf else wait_sec
+
+    def _leave(self, waiter, start):
+        # whether it acquired or gave up, e.g. cancelled, the next in line is woken
+        with self._lock:
+            first = self._waiters[0] is waiter
+            self._waiters.remove(waiter)
+            if first and self._waiters:
+                self._waiters[0].wake()
+            self._stats["wait_sec"] += time.monotonic() - start
+
+    def acquire(self, tokens=0):
+        # `tokens`: estimated tokens of the request, see `estimate_tokens`
+        start = time.monotonic()
+        waiter = self._enter(tokens)
+        if waiter is None:
+            return
+
+        try:
+            while True:
+                wait_sec = self._poll(waiter, tokens)
+                if wait_sec == 0:
+                    return
+                waiter.event.wait(wait_sec)
+        finally:
+            self._leave(waiter, start)
+
+    async def aacquire(self, tokens=0):
+        start = time.monotonic()
+        waiter = self._enter(tokens, asyncio.get_running_loop())
+        if waiter is None:
+            return
+
+        try:
+            while True:
+                wait_sec = self._poll(waiter, tokens)
+                if wait_sec == 0:
+                    return
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), wait_sec)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._leave(waiter, start)
+
+    def release(self, tokens=0, used_tokens=None, exception=None):
+        # `tokens`: the estimate passed to `acquire`, corrected by `used_tokens` if known
+        # `exception`: raised by the request, if any
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if self.tokens is not None and used_tokens is not None:
+                self.tokens.level += tokens - used_tokens
+                self.tokens.level = min(self.tokens.level, self.tokens.capacity)
+
+            # the first in line may send once a request is released
+            if self._waiters:
+                self._waiters[0].wake()
+
+            status = None if exception is None else _get_status(exception)
+            if status is None or status < 500 and status != 429:
+                if exception is None:
+                    self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+                return
+
+            self._stats["throttled" if status == 429 else "failed"] += 1
+            retry_after = _get_retry_after(exception)
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._decreased >= self.cooldown:
+                self.limit = max(self.limit / 2, self.min_concurrency)
+                self._decreased = now
+                self._stats["decreases"] += 1
+
+    def call(self, func, tokens=0, count_tokens=None):
+        # call `func()` within the limits, `count_tokens(result)` returns the used tokens
+        self.acquire(tokens)
+        try:
+            result = func()
+        except BaseException as e:
+            self.release(tokens, exception=e)
+            raise
+        self.release(tokens, None if count_tokens is None else count_tokens(result))
+
+        return result
+
+    async def acall(self, afunc, tokens=0, count_tokens=None):
+        await self.aacquire(tokens)
+        try:
+            result = await afunc()
+        except BaseException as e:
+            self.release(tokens, exception=e)
+            raise
+        self.release(tokens, None if count_tokens is None else count_tokens(result))
+
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            now = time.monotonic()
+            stats = dict(self._stats)
+            stats.update(
+                concurrency_limit=int(self.limit),
+                in_flight=self.in_flight,
+                queue_depth=len(self._waiters),
+                paused_sec=max(self._paused_until - now, 0),
+            )
+            for name, bucket in [("requests", self.requests), ("tokens", self.tokens)]:
+                if bucket is not None:
+                    bucket.refill(now)
+                    stats[f"{name}_per_min"] = bucket.capacity
+                    stats[f"{name}_available"] = bucket.level
+
+        return stats
@@ -0,0 +1,198 @@
+from collections import deque
+from copy import copy
+import threading
+import time
+
+from loguru import logger
+
+from aqa.configs import Config
+
+from .build import MODELS, build_model
+from .wrapper import ModelWrapper, check_send_history
+
+
+class _Endpoint():
+    def __init__(self, index, model_config):
+        self.index = index
+        self.name = f"{index}:{model_config['NAME']}"
+        # conversations are copies of it
+        self.model = build_model(Config(MODEL=model_config))
+        check_send_history(self.model)
+
+        self.latency = None  # EWMA of the latency of a call
+        self.outcomes = deque()  # True for errors, since the endpoint was tripped last time
+        self.tripped_until = 0.0
+
+        self._stats = dict(episodes=0, calls=0, errors=0, trips=0, failovers=0)
+
+    def is_tripped(self, now):
+        return now < self.tripped_until
+
+
+@MODELS.register()
+class RouterModel(ModelWrapper):
+    '''
+    Route the episodes to several backends serving the same model, e.g. Azure deployments,
+    vLLM replicas and FastChat workers.
+
+    An episode is sent to the endpoint with the lowest EWMA latency of a call, and stays
+    there so that its caches stay warm. An endpoint is tripped for `cooldown_sec` when more
+    than `error_budget` of its last `error_window` calls failed, and the episodes on it fail
+    over to another endpoint with their history.
+    '''
+    def __init__(
+        self, models, ewma_alpha=0.2, error_budget=0.2, error_window=20, cooldown_sec=60.0
+    ):
+        # `models`: configs of the backends, e.g. [`OPENAI_CONFIG`, `OPENAI_COMPATIBLE_CONFIG`]
+        assert len(models) > 0
+        self.endpoints = [_Endpoint(i, model) for i, model in enumerate(models)]
+        self.ewma_alpha = ewma_alpha
+        self.error_budget = error_budget
+        self.error_window = error_window
+        self.cooldown_sec = cooldown_sec
+
+        self._lock = threading.Lock()
+
+        self.endpoint = None
+        self.answer_space = None
+        self.reset()
+
+    def _choose(self, exclude=None):
+        # the healthy endpoint with the lowest latency, untried endpoints first
+        with self._lock:
+            now = time.monotonic()
+            candidates = [
+                endpoint for endpoint in self.endpoints
+                if endpoint is not exclude and not endpoint.is_tripped(now)
+            ]
+            if not candidates:
+                return None
+            endpoint = min(
+                candidates,
+                key=lambda endpoint: (endpoint.latency or 0.0, endpoint._stats["episodes"])
+            )
+            endpoint._stats["episodes"] += 1
+
+            return endpoint
+
+    def _record(self, endpoint, latency=None):
+        # a call, failed if `latency` is None
+        with self._lock:
+            endpoint._stats["calls"] += 1
+            endpoint.outcomes.append(latency is None)
+            if len(endpoint.outcomes) > self.error_window:
+                endpoint.outcomes.popleft()
+
+            if latency is not None:
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += self.ewma_alpha * (latency - endpoint.latency)
+                return
+
+            endpoint._stats["errors"] += 1
+            # a failed call is retried on another endpoint only if it trips the endpoint, e.g.
+            # the first failure after the cooldown
+            if sum(endpoint.outcomes) > self.error_budget * len(endpoint.outcomes):
+                endpoint.tripped_until = time.monotonic() + self.cooldown_sec
+                endpoint.outcomes.clear()
+                endpoint._stats["trips"] += 1
+                logger.warning(f"Endpoint {endpoint.name} tripped for {self.cooldown_sec}s.")
+
+    def _failover(self):
+        # move the episode to another endpoint if its endpoint is tripped, return whether
+        # the episode is on a healthy endpoint
+        if not self.endpoint.is_tripped(time.monotonic()):
+            return True
+
+        endpoint = self._choose(exclude=self.endpoint)
+        if endpoint is None:
+            return False
+
+        model = copy(endpoint.model)
+        if self.instruction is None:
+            model.reset()
+        else:
+            model.reset(self.instruction)
+        model.add_history([list(self.model.history)])
+        if hasattr(model, "set_answer_space"):
+            model.set_answer_space(self.answer_space)
+
+        with self._lock:
+            self.endpoint._stats["failovers"] += 1
+        self.endpoint, self.model = endpoint, model
+
+        return True
+
+    def reset(self, instruction=None):
+        # a new episode
+        endpoint = self._choose()
+        if endpoint is not None and endpoint is not self.endpoint:
+            self.endpoint, self.model = endpoint, copy(endpoint.model)
+
+        super(RouterModel, self).reset(instruction)
+
+    def set_answer_space(self, answers=None):
+        # kept for the episodes failing over
+        self.answer_space = answers
+        super(RouterModel, self).set_answer_space(answers)
+
+    def __call__(self, prompt):
+        while True:
+            if not self._failover():
+                raise RuntimeError("All the endpoints are tripped.")
+
+            start = time.monotonic()
+            try:
+                reply = self.model(prompt)
+            except Exception:
+                self._record(self.endpoint)
+                if self.endpoint.is_tripped(time.monotonic()):
+                    continue
+                raise
+            self._record(self.endpoint, time.monotonic() - start)
+
+            return reply
+
+    async def acall(self, prompt):
+        while True:
+            if not self._failover():
+                raise RuntimeError("All the endpoints are tripped.")
+
+            start = time.monotonic()
+            try:
+                reply = await self.model.acall(prompt)
+            except Exception:
+                self._record(self.endpoint)
+                if self.endpoint.is_tripped(time.monotonic()):
+                    continue
+                raise
+            self._record(self.endpoint, time.monotonic() - start)
+
+            return reply
+
+    def get_stats(self):
+        stats = []
+        for endpoint in self.endpoints:
+            with self._lock:
+                endpoint_stats = dict(endpoint._stats)
+                endpoint_stats.update(
+                    name=endpoint.name,
+                    latency=endpoint.latency,
+                    tripped=endpoint.is_tripped(time.monotonic())
+                )
+            if hasattr(endpoint.model, "get_stats"):
+                endpoint_stats["model"] = endpoint.model.get_stats()
+            stats.append(endpoint_stats)
+
+        return {"router": stats}
+
+    def snapshot(self):
+        return self.endpoint.index, super(RouterModel, self).snapshot()
+
+    def restore(self, snapshot):
+        index, snapshot = snapshot
+        if self.endpoints[index] is not self.endpoint:
+            self.endpoint = self.endpoints[index]
+            self.model = copy(self.endpoint.model)
+        super(RouterModel, self).restore(snapshot)
@@ -0,0 +1,63 @@
+import torch
+
+
+def find_reply_spans(text, prompts, turns, replies):
+    '''
+    Return the character spans of `replies` in the conversation `text`, where the `i`-th
+    reply is rendered between `prompts[i]`, the conversation rendered up to the `i`-th reply,
+    and `turns[i]`, the conversation rendered until the end of the `i`-th reply. The
+    templates may strip the replies or add tokens around them, e.g. the end of a turn.
+    '''
+    spans = []
+    for prompt, turn, reply in zip(prompts, turns, replies):
+        assert text.startswith(turn) and turn.startswith(prompt), "Turns are not prefixes."
+        # only the rendered turn is searched, so a reply is never matched in a later turn,
+        # e.g. a short number in a later prompt
+        reply = reply.strip()
+        start = text.find(reply, len(prompt), len(turn))
+        assert start != -1, reply
+        spans.append((start, start + len(reply)))
+
+    return spans
+
+
+@torch.no_grad()
+def score_replies(model, tokenizer, text, spans, stop_token_ids=()):
+    '''
+    Score the replies at the character `spans` of the conversation `text` with one forward
+    pass of `model`, i.e. teacher forcing all of them at once. Return for each reply:
+    - "logprob": log-probability of its tokens and of the stop token after them, if any
+    - "tokens": number of the scored tokens
+    - "greedy": whether greedy decoding generates exactly the scored tokens
+    - "reply": the argmax tokens at the scored positions, i.e. the greedy reply as long as
+               it agrees with the reply
+    '''
+    assert tokenizer.is_fast, "Scoring needs the offsets of a fast tokenizer."
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    input_ids = encoding.input_ids
+
+    logits = model(torch.tensor([input_ids], device=model.device)).logits[0]
+    logprobs = torch.log_softmax(logits.float(), dim=-1)
+    argmax_ids = logprobs.argmax(-1).tolist()
+
+    scores = []
+    for start, end in spans:
+        # the tokens overlapping the reply, the first token is never predicted
+        positions = [
+            i for i, (token_start, token_end) in enumerate(encoding.offset_mapping)
+            if 0 < i and token_start < end and start < token_end
+        ]
+        # e.g. the eos token of a turn, so that a longer greedy reply does not match
+        if positions and positions[-1] + 1 < len(input_ids) \
+           and input_ids[positions[-1] + 1] in stop_token_ids:
+            positions.append(positions[-1] + 1)
+        reply = tokenizer.decode([argmax_ids[i - 1] for i in positions], skip_special_tokens=True)
+
+        scores.append(dict(
+            logprob=sum(float(logprobs[i - 1, input_ids[i]]) for i in positions),
+            tokens=len(positions),
+            greedy=all(argmax_ids[i - 1] == input_ids[i] for i in positions),
+            reply=reply.strip()
+        ))
+
+    return scores
@@ -0,0 +1,267 @@
+import asyncio
+from collections import deque
+import hashlib
+import math
+import random
+import re
+import time
+
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from .build import MODELS
+from .openai import _log_when_fail
+
+
+class SyntheticError(RuntimeError):
+    # a transient failure injected by `SyntheticModel`
+    pass
+
+
+def _first_int(text):
+    nums = re.findall(r"\d+", text)
+    return int(nums[0]) if nums else None
+
+
+def _adj_nodes(prompt):
+    # adjacent nodes in the prompt of `TraverseGraph` and caves, or None
+    match = re.match(r"Adjacent (?:nodes|caves): ([\d, ]*)\.", prompt)
+    if match is None:
+        return None
+    return [int(node) for node in re.findall(r"\d+", match.group(1))]
+
+
+@MODELS.register()
+class SyntheticModel():
+    '''
+    Scripted model without any network or GPU to load test the evaluation, e.g. concurrency,
+    retries and checkpoints.
+
+    Replies follow `policy` on `task`, i.e. "binary_search" (also for Coin), "bfs" or "dfs"
+    (also for caves):
+    - "optimal": the teacher's reply, replaced by a random one with `error_rate`
+    - "random": a random number in range or a random adjacent node
+    and are replaced by a reply without any number with `invalid_rate`. The choices only
+    depend on `seed` and the conversation, so the model is deterministic.
+
+    Every call sleeps for a latency drawn from `latency_dist` with mean `latency` seconds,
+    i.e. "constant", "uniform" (from 0 to twice the mean), "exponential" or "lognormal"
+    (with `latency_sigma`), and then raises `SyntheticError` with `failure_rate`. The failed
+    attempts are retried as the transient errors of `OpenAICompatible`, i.e. with tenacity
+    waiting randomly and exponentially for 1 to 5 seconds, up to 15 attempts.
+    '''
+    def __init__(
+        self, task="binary_search", policy="optimal", min=32, max=32800,
+        error_rate=0.0, invalid_rate=0.0, latency=0.0, latency_dist="constant",
+        latency_sigma=1.0, failure_rate=0.0, seed=0
+    ):
+        assert task in ["binary_search", "bfs", "dfs"], task
+        assert policy in ["optimal", "random"], policy
+        assert latency_dist in ["constant", "uniform", "exponential", "lognormal"], latency_dist
+        self.task = task
+        self.policy = policy
+        self.min = min
+        self.max = max
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.seed = seed
+
+        # latencies and failures differ between attempts, unlike the replies
+        self.rng = random.Random(seed)
+
+        retry_decorator = retry(
+            retry=retry_if_exception_type(SyntheticError),
+            wait=wait_random_exponential(min=1, max=5),
+            stop=stop_after_attempt(15),
+            before_sleep=_log_when_fail,
+            reraise=True
+        )
+        self.attempt_func = retry_decorator(self._attempt)
+        self.aattempt_func = retry_decorator(self._aattempt)
+
+        # shared by the copies of the model
+        self._stats = dict(calls=0, failures=0, errors=0, invalids=0, latency=0.0)
+
+        self.reset()
+
+    def reset(self, instruction=None):
+        self.instruction = instruction
+        self.history = []
+
+    def _episode(self):
+        # turns of the current test case, i.e. after the examples in the history
+        start = 0
+        for i, qa in enumerate(self.history):
+            if qa[0].startswith(("Well Done", "Right answer")):
+                start = i + 1
+        return self.history[start:]
+
+    def _optimal_binary_search(self, turns, prompt):
+        left, right = self.min, self.max + 1
+        for q in [qa[0] for qa in turns] + [prompt]:
+            match = re.search(r"(bigger|smaller) than (\d+)", q)
+            if match is None:
+                continue
+            if match.group(1) == "bigger":
+                left = max(left, int(match.group(2)))
+            else:
+                right = min(right, int(match.group(2)))
+
+        return (left + right) // 2
+
+    def _visits(self, turns, prompt):
+        # nodes visited in order and their adjacent nodes
+        prompts = [qa[0] for qa in turns] + [prompt]
+        visits = [0]
+        adj_lists = {0: _adj_nodes(prompts[0]) or []}
+        for i, qa in enumerate(turns):
+            # the reply is accepted if the next prompt is about the new node
+            adj_nodes = _adj_nodes(prompts[i + 1])
+            node = _first_int(qa[1] or "")
+            if adj_nodes is None or node is None:
+                continue
+            visits.append(node)
+            adj_lists[node] = adj_nodes
+
+        return visits, adj_lists
+
+    def _optimal_bfs(self, turns, prompt):
+        visits, adj_lists = self._visits(turns, prompt)
+        visited = set()
+        queue = deque()
+        for node in visits:
+            visited.add(node)
+            queue.extend(adj for adj in adj_lists[node] if adj not in visited)
+        while queue and queue[0] in visited:
+            queue.popleft()
+
+        return queue[0] if queue else None
+
+    def _optimal_dfs(self, turns, prompt):
+        visits, adj_lists = self._visits(turns, prompt)
+        stack = [visits[0]]
+        for node in visits[1:]:
+            if len(stack) > 1 and node == stack[-2]:
+                stack.pop()
+            else:
+                stack.append(node)
+
+        visited = set(visits)
+        for adj in adj_lists[stack[-1]]:
+            if adj not in visited:
+                return adj
+
+        return stack[-2] if len(stack) > 1 else None
+
+    def _random_reply(self, turns, prompt, rng):
+        if self.task == "binary_search":
+            return rng.randint(self.min, self.max)
+
+        adj_nodes = None
+        for q in [prompt] + [qa[0] for qa in reversed(turns)]:
+            adj_nodes = _adj_nodes(q)
+            if adj_nodes is not None:
+                break
+
+        return rng.choice(adj_nodes) if adj_nodes else 0
+
+    def _reply(self, prompt):
+        turns = self._episode()
+        key = repr((self.seed, self.instruction, [qa[:2] for qa in self.history], prompt))
+        rng = random.Random(hashlib.md5(key.encode()).hexdigest())
+
+        if rng.random() < self.invalid_rate:
+            self._stats["invalids"] += 1
+            return "I am not sure."
+
+        reply = None
+        if self.policy == "optimal":
+            if rng.random() < self.error_rate:
+                self._stats["errors"] += 1
+            else:
+                reply = getattr(self, f"_optimal_{self.task}")(turns, prompt)
+        if reply is None:
+            reply = self._random_reply(turns, prompt, rng)
+
+        return str(reply)
+
+    def _sample_latency(self):
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_dist == "uniform":
+            return self.rng.uniform(0, 2 * self.latency)
+        if self.latency_dist == "exponential":
+            return self.rng.expovariate(1 / self.latency)
+        if self.latency_dist == "lognormal":
+            # the mean of a lognormal distribution is exp(mu + sigma ** 2 / 2)
+            mu = math.log(self.latency) - self.latency_sigma ** 2 / 2
+            return self.rng.lognormvariate(mu, self.latency_sigma)
+        return self.latency
+
+    def _check_failure(self, latency):
+        self._stats["calls"] += 1
+        self._stats["latency"] += latency
+        if self.rng.random() < self.failure_rate:
+            self._stats["failures"] += 1
+            raise SyntheticError("Synthetic transient failure.")
+
+    def _attempt(self):
+        latency = self._sample_latency()
+        time.sleep(latency)
+        self._check_failure(latency)
+
+    # tenacity only retries coroutine functions defined with `async def`
+    async def _aattempt(self):
+        latency = self._sample_latency()
+        await asyncio.sleep(latency)
+        self._check_failure(latency)
+
+    def __call__(self, prompt):
+        self.attempt_func()
+
+        reply = self._reply(prompt)
+        self.history.append((prompt, reply))
+
+        return reply
+
+    async def acall(self, prompt):
+        await self.aattempt_func()
+
+        reply = self._reply(prompt)
+        self.history.append((prompt, reply))
+
+        return reply
+
+    def add_history(self, qa_lists):
+        for qa_list in qa_lists:
+            self.history += qa_list
+
+    def revoke(self, n=1):
+        assert 0 <= n and n <= len(self.history)
+        if n == 0:
+            return
+        self.history = self.history[:-n]
+
+    def force(self, new_reply):
+        self.history[-1] = (self.history[-1][0], new_reply, *self.history[-1][1:])
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats["mean_latency"] = stats["latency"] / max(stats["calls"], 1)
+        return {"synthetic": stats}
+
+    def snapshot(self):
+        return self.instruction, list(self.history)
+
+    def restore(self, snapshot):
+        self.instruction, history = snapshot
+        self.history = list(history)
+
+    async def arevoke(self, n=1):
+        self.revoke(n)
+
+    async def aforce(self, new_reply):
+        self.force(new_reply)
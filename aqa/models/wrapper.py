@@ -0,0 +1,86 @@
+from copy import copy
+
+from aqa.configs import Config
+
+from .build import build_model
+
+
+def check_send_history(model):
+    # the wrappers replay turns with `add_history`, e.g. cached replies, which should be
+    # sent along with the next prompts
+    assert getattr(model, "send_history", True), \
+        f"{type(model).__name__} should be built with `SEND_HISTORY=True`."
+
+
+class ModelWrapper():
+    '''
+    Base of the models wrapping another model built from its config, e.g. to cache its
+    replies. Everything is forwarded to the wrapped model unless overridden.
+    '''
+    def __init__(self, model):
+        # `model`: config of the wrapped model, e.g. `MISTRAL_7B_INSTRUCT_v02_CONFIG`
+        self.model = build_model(Config(MODEL=model))
+        check_send_history(self.model)
+        self.reset()
+
+    @property
+    def history(self):
+        return self.model.history
+
+    @property
+    def send_history(self):
+        return getattr(self.model, "send_history", True)
+
+    def reset(self, instruction=None):
+        self.instruction = instruction
+        # the wrapped model has its own default instruction
+        if instruction is None:
+            self.model.reset()
+        else:
+            self.model.reset(instruction)
+
+    def __call__(self, prompt):
+        return self.model(prompt)
+
+    async def acall(self, prompt):
+        return await self.model.acall(prompt)
+
+    def __copy__(self):
+        # copies share everything but the conversation, i.e. the wrapped model is copied
+        forked = self.__class__.__new__(self.__class__)
+        forked.__dict__.update(self.__dict__)
+        forked.model = copy(self.model)
+
+        return forked
+
+    def set_answer_space(self, answers=None):
+        if hasattr(self.model, "set_answer_space"):
+            self.model.set_answer_space(answers)
+
+    def add_history(self, qa_lists):
+        self.model.add_history(qa_lists)
+
+    def revoke(self, n=1):
+        self.model.revoke(n)
+
+    def force(self, new_reply):
+        self.model.force(new_reply)
+
+    def score(self, qa_list):
+        return self.model.score(qa_list)
+
+    def get_stats(self):
+        return self.model.get_stats() if hasattr(self.model, "get_stats") else {}
+
+    def snapshot(self):
+        return self.instruction, self.model.snapshot()
+
+    def restore(self, snapshot):
+        self.instruction, snapshot = snapshot
+        self.model.restore(snapshot)
+
+    async def arevoke(self, n=1):
+        await self.model.arevoke(n)
+
+    async def aforce(self, new_reply):
+        await self.model.aforce(new_reply)
@@ -1,8 +1,11 @@
-from .dict_boardcast import dict_mean, dict_sum, dict_max, dict_min
+from .dict_boardcast import dict_mean, dict_sum, dict_max, dict_min, DictAggregator
 from .dialog_logger import DialogLogger
 from .dynamic_import import dynamic_import
+from .episode_log import EpisodeLog
 from .eval import eval
 from .file import ensure_dir
-from .invalid import Invalid, InvalidEncoder, FormatInvalid, ValueInvalid
+from .graph import CSRGraph
+from .invalid import Invalid, InvalidEncoder, FormatInvalid, ValueInvalid, parse_invalid
 from .logger import setup_logger
 from .registry import Registry
+from .rescore import rescore
@@ -2,7 +2,8 @@ def _get_keys(dicts):
     keys = [set(dict_.keys()) for dict_ in dicts]
     assert all([i == j for i, j in zip(keys[1:], keys[:-1])]), keys
 
-    return keys[0]
+    # keep the order of the first dict so that the results are reproducible
+    return list(dicts[0].keys())
 
 
 def dict_mean(dicts):
@@ -35,3 +36,77 @@ def dict_min(dicts):
     for k in keys:
         result[k] = min([dict_[k] for dict_ in dicts])
     return result
+
+
+class DictAggregator():
+    '''
+    Online version of `dict_mean`, `dict_min` and `dict_max` that also keeps the variance,
+    without keeping the dicts.
+
+    The mean is the running sum divided by the count, so it is exactly what `dict_mean`
+    returns. The variance uses Welford's algorithm.
+    '''
+    def __init__(self):
+        self.count = 0
+        self._keys = None
+
+    def update(self, dict_):
+        if self._keys is None:
+            # keep the order of the first dict as `_get_keys`
+            self._keys = list(dict_.keys())
+            self._sum = {k: 0 for k in self._keys}
+            self._mean = {k: 0.0 for k in self._keys}
+            self._m2 = {k: 0.0 for k in self._keys}
+            self._min = {k: dict_[k] for k in self._keys}
+            self._max = {k: dict_[k] for k in self._keys}
+        assert set(dict_.keys()) == set(self._keys), (dict_.keys(), self._keys)
+
+        self.count += 1
+        for k in self._keys:
+            value = dict_[k]
+            self._sum[k] += value
+
+            delta = value - self._mean[k]
+            self._mean[k] += delta / self.count
+            self._m2[k] += delta * (value - self._mean[k])
+
+            self._min[k] = min(self._min[k], value)
+            self._max[k] = max(self._max[k], value)
+
+    def snapshot(self):
+        # json serializable
+        if self._keys is None:
+            return {"count": self.count}
+        return {
+            "count": self.count, "keys": self._keys, "sum": self._sum, "mean": self._mean,
+            "m2": self._m2, "min": self._min, "max": self._max
+        }
+
+    def restore(self, snapshot):
+        self.count = snapshot["count"]
+        self._keys = snapshot.get("keys")
+        if self._keys is not None:
+            self._sum = dict(snapshot["sum"])
+            self._mean = dict(snapshot["mean"])
+            self._m2 = dict(snapshot["m2"])
+            self._min = dict(snapshot["min"])
+            self._max = dict(snapshot["max"])
+
+    def mean(self):
+        if not self.count:
+            return {}
+        return {k: self._sum[k] / self.count for k in self._keys}
+
+    def stats(self):
+        # population variance
+        if not self.count:
+            return {}
+        return {
+            k: dict(
+                mean=self._sum[k] / self.count,
+                var=self._m2[k] / self.count,
+                min=self._min[k],
+                max=self._max[k],
+            )
+            for k in self._keys
+        }
@@ -0,0 +1,152 @@
+import json
+import os
+import os.path as osp
+
+from .invalid import InvalidEncoder
+
+
+class EpisodeLog():
+    '''
+    Append-only JSONL log with one record per finished test case, i.e.
+    `{"index": i, "result": single_result}` where `i` counts from 1.
+
+    Records are written as they are appended and fsync'd with each checkpoint. A record
+    torn by a crash is dropped when the log is opened again, so the log always ends with
+    the last complete record.
+
+    A checkpoint of any state to resume with, e.g. the aggregated metrics, can be saved
+    along with the records, so that resuming only reads the records after it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint_path = path + ".ckpt"
+        if osp.exists(self.path):
+            self._drop_torn_record()
+
+    def exists(self):
+        return osp.exists(self.path) and osp.getsize(self.path) > 0
+
+    def clear(self):
+        open(self.path, mode="w").close()
+        if osp.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def append(self, records, state=None):
+        # `records`: list of `(index, single_result)`
+        # `state`: json serializable state after the records, if any, see `load_checkpoint`,
+        #          the log is only fsync'd along with it
+        lines = [
+            json.dumps({"index": index, "result": result}, cls=InvalidEncoder) + "\n"
+            for index, result in records
+        ]
+        with open(self.path, mode="a") as f:
+            f.write("".join(lines))
+            if state is None:
+                return
+
+            f.flush()
+            os.fsync(f.fileno())
+            offset = f.tell()
+
+        self._save_checkpoint(offset, state)
+
+    def _save_checkpoint(self, offset, state):
+        # the checkpoint is replaced atomically after the records are fsync'd, so it never
+        # points past the log, a crash in between only leaves an older checkpoint
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, mode="w") as f:
+            json.dump({"offset": offset, "state": state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self):
+        '''
+        Return the byte offset of the log where the last saved state was taken and the state,
+        or `(0, None)` if there is none.
+        '''
+        if not osp.exists(self.checkpoint_path):
+            return 0, None
+
+        with open(self.checkpoint_path, mode="r") as f:
+            checkpoint = json.load(f)
+        # e.g. a log replaced without its checkpoint
+        if checkpoint["offset"] > osp.getsize(self.path):
+            return 0, None
+
+        return checkpoint["offset"], checkpoint["state"]
+
+    def _read_last_line(self, f, end):
+        # read backwards from `end` until a newline or the beginning of the file
+        chunk_size = 1 << 16
+        buffer = b""
+        pos = end
+        while pos > 0:
+            size = min(chunk_size, pos)
+            pos -= size
+            f.seek(pos)
+            buffer = f.read(size) + buffer
+            newline = buffer.rfind(b"\n", 0, len(buffer) - 1)
+            if newline != -1:
+                return pos + newline + 1, buffer[newline + 1:]
+
+        return 0, buffer
+
+    def _drop_torn_record(self):
+        with open(self.path, mode="rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+
+            f.seek(end - 1)
+            if f.read(1) == b"\n":
+                return
+
+            start, _ = self._read_last_line(f, end)
+            f.truncate(start)
+
+    def last_index(self):
+        # only the tail of the log is read
+        if not self.exists():
+            return 0
+
+        with open(self.path, mode="rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            _, line = self._read_last_line(f, end)
+
+        return json.loads(line)["index"]
+
+    def __iter__(self):
+        return self.read()
+
+    def read(self, offset=0):
+        # decoded single results from the byte `offset`, `Invalid` answers are strings as in
+        # `results_final.json`
+        with open(self.path, mode="rb") as f:
+            f.seek(offset)
+            for line in f:
+                yield json.loads(line)["result"]
+
+    def dump_results(self, full_result, f):
+        '''
+        Write `full_result` as `json.dump(full_result, f, cls=InvalidEncoder)` does, except
+        that the single results are streamed from the log instead of
+        `full_result["single_results"]`.
+        '''
+        f.write("{")
+        for i, (key, value) in enumerate(full_result.items()):
+            if i > 0:
+                f.write(", ")
+            f.write(json.dumps(key) + ": ")
+
+            if key != "single_results":
+                f.write(json.dumps(value, cls=InvalidEncoder))
+                continue
+
+            f.write("[")
+            for j, result in enumerate(self):
+                if j > 0:
+                    f.write(", ")
+                f.write(json.dumps(result))
+            f.write("]")
+        f.write("}")
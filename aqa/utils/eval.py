@@ -7,11 +7,16 @@ def eval(config):
     from aqa.models import build_model
 
     benchmark = build_benchmark(config)
-    model = build_model(config)
 
     eval_config = deepcopy(config.EVAL)
     eval_config = dict({k.lower(): v for k, v in eval_config.items()})
 
+    if eval_config.get("num_workers", 0) > 0:
+        # each worker process builds its own model from `config`
+        model = config
+    else:
+        model = build_model(config)
+
     metric, full_result = benchmark.test_with_examples(
         model, **eval_config
     )
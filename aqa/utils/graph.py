@@ -0,0 +1,79 @@
+from array import array
+
+
+class CSRGraph():
+    '''
+    Undirected graph stored in the compressed sparse row format, i.e. the neighbors of
+    `nodes[i]` are `neighbors[offsets[i]: offsets[i + 1]]`.
+
+    Neighbors and edges are in the same order as in a `networkx.Graph` built from the same
+    nodes and edges, so that prompts and results do not change.
+    '''
+    def __init__(self, nodes, adj_lists):
+        # `adj_lists[i]`: neighbors of `nodes[i]` in order
+        self.nodes = list(nodes)
+        self._index = {node: i for i, node in enumerate(self.nodes)}
+        assert len(self._index) == len(self.nodes), self.nodes
+
+        self._offsets = array("q", [0])
+        self._neighbors = array("q")
+        for adj_list in adj_lists:
+            self._neighbors.extend(adj_list)
+            self._offsets.append(len(self._neighbors))
+
+        self._edges = None
+
+    @classmethod
+    def from_edges(cls, nodes, edges):
+        index = {node: i for i, node in enumerate(nodes)}
+        adj_lists = [[] for _ in nodes]
+        seen = set()
+        for u, v in edges:
+            # a duplicated edge is only added once as in `networkx.Graph`
+            if (u, v) in seen:
+                continue
+            seen.add((u, v))
+            seen.add((v, u))
+
+            adj_lists[index[u]].append(v)
+            if u != v:
+                adj_lists[index[v]].append(u)
+
+        return cls(nodes, adj_lists)
+
+    @classmethod
+    def random_tree(cls, node_num, seed=None):
+        # networkx is only needed to generate random graphs
+        import networkx
+
+        if hasattr(networkx, "random_labeled_tree"):
+            # `random_tree` is removed since networkx 3.4
+            graph = networkx.random_labeled_tree(node_num, seed=seed)
+        else:
+            graph = networkx.random_tree(node_num, seed=seed).to_undirected()
+
+        return cls(graph.nodes, [list(graph.adj[node]) for node in graph.nodes])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def neighbors(self, node):
+        i = self._index[node]
+        return self._neighbors[self._offsets[i]: self._offsets[i + 1]].tolist()
+
+    @property
+    def edges(self):
+        # each edge once, from the node that comes first in `self.nodes`
+        if self._edges is None:
+            self._edges = []
+            seen = set()
+            for node in self.nodes:
+                for neighbor in self.neighbors(node):
+                    if neighbor not in seen:
+                        self._edges.append((node, neighbor))
+                seen.add(node)
+
+        return self._edges
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(nodes={self.nodes}, edges={self.edges})"
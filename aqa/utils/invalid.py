@@ -1,4 +1,6 @@
+import ast
 from json import JSONEncoder
+import re
 
 
 class Invalid():
@@ -23,6 +25,29 @@ class ValueInvalid(Invalid):
         super().__init__(output)
 
 
+def parse_invalid(answer):
+    '''
+    Inverse of `InvalidEncoder`, i.e. turn strings like "ValueInvalid(output=24)" in saved
+    results back into `Invalid` objects. Other answers are returned unchanged.
+    '''
+    if not isinstance(answer, str):
+        return answer
+
+    match = re.fullmatch(r"(\w*Invalid)\(output=(.*)\)", answer, flags=re.DOTALL)
+    if match is None:
+        return answer
+
+    invalid_cls = {
+        cls.__name__: cls for cls in [Invalid, FormatInvalid, ValueInvalid]
+    }.get(match.group(1), Invalid)
+    try:
+        output = ast.literal_eval(match.group(2))
+    except (ValueError, SyntaxError):
+        output = match.group(2)
+
+    return invalid_cls(output)
+
+
 class InvalidEncoder(JSONEncoder):
     def default(self, o):
         if isinstance(o, Invalid):
@@ -0,0 +1,99 @@
+import json
+from loguru import logger
+import multiprocessing as mp
+import os
+import os.path as osp
+
+from .dict_boardcast import DictAggregator
+
+
+def find_results(paths, filename="results_final.json"):
+    # results files in `paths`, each of which is a results file or a directory to search
+    results_files = []
+    for path in paths:
+        if osp.isfile(path):
+            results_files.append(path)
+            continue
+
+        for root, _, files in sorted(os.walk(path)):
+            if filename in files:
+                results_files.append(osp.join(root, filename))
+
+    return results_files
+
+
+def rescore_file(path, benchmark_name=None, output_name="results_rescored.json"):
+    '''
+    Recompute the metrics of a results file with the current `calc_metric_*` and save them
+    to `output_name` in the same directory. The benchmark is read from the saved env,
+    `benchmark_name` is only used for results saved before it was recorded.
+
+    Return: (path of the rescored results, metric)
+    '''
+    # to avoid circular imports
+    from aqa.benchmarks.build import BENCHMARKS
+
+    with open(path) as f:
+        full_result = json.load(f)
+
+    env = full_result["env"]
+    benchmark_name = env.get("benchmark", benchmark_name)
+    assert benchmark_name is not None, f"Benchmark of {path} is unknown, please specify it."
+    benchmark = BENCHMARKS[benchmark_name].from_env(env)
+
+    aggregator = DictAggregator()
+    single_results = []
+    for result in full_result["single_results"]:
+        result = dict(result, metric=benchmark.rescore(result))
+        aggregator.update(result["metric"])
+        single_results.append(result)
+
+    metric = {"mean_" + k: v for k, v in aggregator.mean().items()}
+    full_result.update(
+        metric=metric,
+        metric_stats=aggregator.stats(),
+        single_results=single_results
+    )
+    env["benchmark"] = benchmark_name
+
+    output_path = osp.join(osp.dirname(path), output_name)
+    with open(output_path, mode="w") as f:
+        # `json.dump` encodes chunk by chunk in python, which is several times slower
+        f.write(json.dumps(full_result))
+
+    return output_path, metric
+
+
+def _try_rescore_file(path, benchmark_name):
+    # a broken results file should not stop the others from being rescored
+    try:
+        output_path, metric = rescore_file(path, benchmark_name)
+    except Exception as e:
+        logger.warning(f"Failed to rescore {path}: {e!r}")
+        return path, None, None, repr(e)
+
+    return path, output_path, metric, None
+
+
+def rescore(paths, benchmark_name=None, num_workers=0):
+    '''
+    Rescore all the results files in `paths` without calling any model,
+    with `num_workers` processes if `num_workers > 0`. The files may be of different
+    benchmarks, see `rescore_file`.
+
+    Return: list of (path of the results, path of the rescored results, metric, error),
+            where the error is None if the file is rescored, otherwise the paths and
+            the metric are None
+    '''
+    # to avoid circular imports, and imported before forking so that workers don't
+    # import the models again
+    import aqa.benchmarks  # noqa: F401
+
+    results_files = find_results(paths)
+    args = [(path, benchmark_name) for path in results_files]
+
+    if num_workers > 0:
+        with mp.Pool(num_workers) as pool:
+            return pool.starmap(_try_rescore_file, args)
+
+    return [_try_rescore_file(*arg) for arg in args]
@@ -0,0 +1,31 @@
+import argparse
+from loguru import logger
+import sys
+
+from aqa.utils import rescore
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute the metrics of saved results without calling any model."
+    )
+    parser.add_argument("paths", type=str, nargs="+", help="results files or directories")
+    parser.add_argument("--benchmark", "-b", type=str, default=None,
+                        help="benchmark name of the results that do not save it")
+    parser.add_argument("--num-workers", "-j", type=int, default=0)
+
+    args = parser.parse_args()
+    logger.info(args)
+
+    # benchmarks log every reset test case
+    logger.disable("aqa")
+    failed = 0
+    for path, output_path, metric, error in rescore(args.paths, args.benchmark, args.num_workers):
+        if error is None:
+            logger.info(f"{output_path}: {metric}")
+        else:
+            logger.error(f"{path}: {error}")
+            failed += 1
+
+    if failed:
+        logger.error(f"Failed to rescore {failed} results files.")
+        sys.exit(1)
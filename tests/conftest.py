@@ -0,0 +1,94 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+
+
+class _Stub(BaseHTTPRequestHandler):
+    '''
+    `/chat/completions` replying with the number of messages sent, e.g. "2 is my guess and
+    more words", streamed in three chunks if asked. Azure deployments are served alike.
+    '''
+    protocol_version = "HTTP/1.1"
+
+    # states of the server, set by the tests
+    failures = []  # statuses of the next responses, before the successful ones
+    delay = 0.0  # seconds before a response, and before the last chunk of a stream
+    requests = []  # bodies of the requests
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, data, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        assert self.path.split("?")[0].endswith("/chat/completions"), self.path
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = self.__class__
+        with cls.lock:
+            cls.requests.append(body)
+            status = cls.failures.pop(0) if cls.failures else 200
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            if status != 200:
+                self._send(status, b'{"error": {"message": "try again"}}')
+                return
+
+            time.sleep(cls.delay)
+            pieces = [str(len(body["messages"])), " is my guess", " and more words"]
+            if not body.get("stream"):
+                self._send(200, json.dumps({
+                    "choices": [{"message": {"role": "assistant", "content": "".join(pieces)}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 3},
+                }).encode())
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, piece in enumerate(pieces):
+                if i == len(pieces) - 1:
+                    time.sleep(cls.delay)
+                chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client closed the stream
+            pass
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+
+
+@pytest.fixture
+def stub():
+    _Stub.failures = []
+    _Stub.delay = 0.0
+    _Stub.requests = []
+    _Stub.max_active = 0
+    return _Stub
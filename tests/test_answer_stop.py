@@ -0,0 +1,69 @@
+import re
+
+import pytest
+import torch
+
+from aqa.models.answer_stop import StopAtAnswer, cut_at_answer, find_answer_end
+
+# characters of a tokenizer which splits integers into digits
+TOKENS = ["</s>", " ", ",", "b", "_"] + [str(i) for i in range(10)]
+
+
+def _decode(ids):
+    return "".join(TOKENS[i] for i in ids if i != 0)
+
+
+def _encode(text):
+    return [TOKENS.index(c) for c in text]
+
+
+@pytest.mark.parametrize("text, end", [
+    ("", None), ("12", None), ("b 12", None), ("12,", 3), ("12 because", 3), ("b 12 b", 5),
+])
+def test_tolerant(text, end):
+    # the first integer is complete
+    assert find_answer_end(text, "tolerant") == end
+
+
+@pytest.mark.parametrize("text, end", [
+    ("", None), ("12", None), (" -1_000 ", None), ("12,", 3), ("12 b", 4), ("1__0", 3),
+    ("b 12", 1),
+])
+def test_strict(text, end):
+    # the reply can't be an integer any more
+    assert find_answer_end(text, "strict") == end
+
+
+def _extract(reply, mode):
+    # the integer the benchmarks extract from a reply, or None if invalid
+    if mode == "tolerant":
+        nums = re.findall(r"\d+", reply)
+        return int(nums[0]) if nums else None
+    try:
+        return int(reply)
+    except ValueError:
+        return None
+
+
+@pytest.mark.parametrize("mode", ["tolerant", "strict"])
+@pytest.mark.parametrize("reply", [
+    "12", "12, or 13", "  1_024 ", "1024 because", "b 12 b", "99999 b", "b", "1__0 and 1_0"
+])
+def test_cut_keeps_answer(mode, reply):
+    assert _extract(cut_at_answer(reply, mode), mode) == _extract(reply, mode)
+    assert cut_at_answer(reply, None) == reply
+
+
+def test_stop_at_answer():
+    # the digits of an integer are generated one at a time, after a prompt of 2 tokens
+    prompt = _encode("b ")
+    stop = StopAtAnswer(_decode, "tolerant", len(prompt))
+    rows = [_encode("12") + [0], _encode("12,"), _encode("b 1"), _encode(" 1 ")]
+    dones = stop(torch.tensor([prompt + row for row in rows]), None)
+    assert dones.tolist() == [False, True, False, True]
+
+    assert not stop.is_done(_encode("1") + _encode("2"))
+    assert stop.is_done(_encode("12 "))
+    strict = StopAtAnswer(_decode, "strict")
+    assert [strict.is_done(_encode(text)) for text in ["1", "1_2 ", "1 2"]] \
+        == [False, False, True]
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os.path as osp
+
+from loguru import logger
+import pytest
+
+from aqa.benchmarks import BinarySearch
+from aqa.models import SyntheticModel
+from aqa.utils.episode_log import EpisodeLog
+
+DATASETS = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), "datasets")
+
+
+@pytest.fixture(autouse=True, scope="module")
+def quiet():
+    logger.disable("aqa")
+    yield
+    logger.enable("aqa")
+
+
+def _benchmark(tmp_path, save_period):
+    bench = BinarySearch(
+        32, 32800, verbose=False, output_dir=str(tmp_path), save_period=save_period
+    )
+    bench.load_testcases_from_file(osp.join(DATASETS, "binary_search_0.json"))
+    return bench
+
+
+def test_async_window(tmp_path, monkeypatch):
+    bench = _benchmark(tmp_path, -1)
+    started = []
+    arun_single_test = BinarySearch._arun_single_test
+
+    async def arun(self, model, seed, *args, **kwargs):
+        started.append(seed)
+        if seed == 1:
+            await asyncio.sleep(0.5)
+        return await arun_single_test(self, model, seed, *args, **kwargs)
+    monkeypatch.setattr(BinarySearch, "_arun_single_test", arun)
+
+    times = 12
+    outputs = bench._run_tests_async(
+        SyntheticModel(), 0, times, iter([[]] * times), False, 0, False, 2
+    )
+    # the first test holds back the others, which are not run past the window
+    next(outputs)
+    assert sorted(started) == list(range(1, 5))
+    assert len(list(outputs)) == times - 1
+    assert sorted(started) == list(range(1, times + 1))
+
+
+def test_records_appended_before_checkpoint(tmp_path, monkeypatch):
+    bench = _benchmark(tmp_path, 5)
+    log_path = osp.join(str(tmp_path), "episodes.jsonl")
+    saved = []
+    run_single_test = BinarySearch._run_single_test
+
+    def run(self, model, seed, *args, **kwargs):
+        # the records before are in the log, the checkpoint is only saved every 5 tests
+        saved.append((EpisodeLog(log_path).last_index(), EpisodeLog(log_path).load_checkpoint()))
+        return run_single_test(self, model, seed, *args, **kwargs)
+    monkeypatch.setattr(BinarySearch, "_run_single_test", run)
+
+    bench.test_with_examples(SyntheticModel(), 7, keep_results=False)
+    assert [index for index, _ in saved] == list(range(7))
+    assert [checkpoint[1]["count"] if checkpoint[1] else 0 for _, checkpoint in saved] \
+        == [0] * 5 + [5, 5]
+
+    offset, state = EpisodeLog(log_path).load_checkpoint()
+    assert offset == osp.getsize(log_path) and state["count"] == 7
+    with open(osp.join(str(tmp_path), "results_final.json")) as f:
+        assert len(json.load(f)["single_results"]) == 7
+
+
+class _ScoringModel(SyntheticModel):
+    # scores the teacher replies as if they were greedy
+    in_loop = []
+
+    def score(self, qa_list):
+        try:
+            asyncio.get_running_loop()
+            self.in_loop.append(True)
+        except RuntimeError:
+            self.in_loop.append(False)
+        return [dict(logprob=-0.5, tokens=2, greedy=True, reply=a) for _, a in qa_list]
+
+
+def test_scored_metrics(tmp_path):
+    bench = _benchmark(tmp_path, -1)
+    metric, _ = bench.test_with_examples(
+        _ScoringModel(), 4, teacher_forcing=True, parallel_tf="score", concurrency=2
+    )
+
+    assert metric["mean_scored_acc"] == 1.0
+    assert metric["mean_scored_teacher_logprob"] == -0.5
+    assert metric["mean_scored_teacher_greedy_acc"] == 1.0
+    assert all(key.startswith("mean_scored_") for key in metric)
+    # the forward passes are kept off the event loop
+    assert _ScoringModel.in_loop == [False] * 4
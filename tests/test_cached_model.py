@@ -0,0 +1,91 @@
+import asyncio
+from copy import deepcopy
+
+from aqa.configs.models import SYNTHETIC_MODEL_CONFIG
+from aqa.models import CachedModel, SyntheticModel
+from aqa.models.cached_model import ResponseCache
+
+
+def _config(**kwargs):
+    # random replies, which are decided by the whole conversation
+    config = deepcopy(SYNTHETIC_MODEL_CONFIG)
+    config.update(POLICY="random", **kwargs)
+    return config
+
+
+def _stats(model):
+    stats = model.get_stats()["response_cache"]
+    return stats["hits"], stats["misses"]
+
+
+def test_hits_and_misses(tmp_path, monkeypatch):
+    path = str(tmp_path / "responses.sqlite")
+    model = CachedModel(_config(), path)
+    model.reset("Guess")
+    replies = [model("START"), asyncio.run(model.acall("Bigger"))]
+    assert _stats(model) == (0, 2)
+
+    # the same conversation, with a config that only differs in ignored keys, which the
+    # synthetic model doesn't take
+    init = SyntheticModel.__init__
+    monkeypatch.setattr(
+        SyntheticModel, "__init__",
+        lambda self, max_batch_size, sleep_sec, **kwargs: init(self, **kwargs)
+    )
+    model = CachedModel(_config(MAX_BATCH_SIZE=8, SLEEP_SEC=1.0), path)
+    model.reset("Guess")
+    assert [model("START"), model("Bigger")] == replies
+    assert _stats(model) == (2, 0)
+    assert model.history == [("START", replies[0]), ("Bigger", replies[1])]
+
+    # another instruction, prompt or config
+    monkeypatch.undo()
+    model.reset("Guess again")
+    model("START")
+    model.reset("Guess")
+    model("START")
+    model("Smaller")
+    assert _stats(model) == (3, 2)
+    model = CachedModel(_config(SEED=1), path)
+    model.reset("Guess")
+    model("START")
+    assert _stats(model) == (0, 1)
+
+
+def test_forced_history(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    model = CachedModel(_config(), path)
+    model.reset("Guess")
+    model("START")
+    model.force("16416")
+    reply = model("Bigger")
+
+    # the forced reply is asked for, not the one it replaced
+    model = CachedModel(_config(), path)
+    model.reset("Guess")
+    model.add_history([[("START", "16416", "100")]])
+    assert model("Bigger") == reply
+    assert _stats(model) == (1, 0)
+
+
+def test_lru_eviction(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    entry_bytes = len("key0") + len("response0")
+    cache = ResponseCache(path, 3 * entry_bytes)
+    for i in range(3):
+        cache.put(f"key{i}", f"response{i}")
+    cache.get("key0")
+
+    # the size kept by the triggers is shared by the connections to the database
+    other = ResponseCache(path, 3 * entry_bytes)
+    other.put("key3", "response3")
+    assert cache.get("key1") is None
+    assert [cache.get(f"key{i}") for i in [0, 2, 3]] == ["response0", "response2", "response3"]
+
+    stats = cache.get_stats()
+    assert stats["entries"] == 3 and stats["nbytes"] == 3 * entry_bytes
+    assert other.get_stats()["evictions"] == 1
+
+    # a response too large for the cache is not inserted
+    cache.put("key4", "x" * 3 * entry_bytes)
+    assert cache.get("key4") is None and cache.get_stats()["nbytes"] == 3 * entry_bytes
@@ -0,0 +1,218 @@
+import glob
+import json
+import os.path as osp
+import random
+from copy import deepcopy
+
+import pytest
+from loguru import logger
+
+from aqa.benchmarks import BFS, DFS, BinarySearch
+from aqa.benchmarks.traverse import TraverseState
+from aqa.utils import FormatInvalid, Invalid, ValueInvalid
+
+networkx = pytest.importorskip("networkx")
+
+DATASETS = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), "datasets")
+INVALIDS = [FormatInvalid("no number"), ValueInvalid(-1)]
+
+
+@pytest.fixture(autouse=True, scope="module")
+def quiet():
+    logger.disable("aqa")
+    yield
+    logger.enable("aqa")
+
+
+def _load(name):
+    return json.load(open(osp.join(DATASETS, name)))
+
+
+def _datasets(kind):
+    return [
+        osp.basename(path) for path in sorted(glob.glob(osp.join(DATASETS, f"*{kind}_0.json")))
+    ]
+
+
+# the checkers before they were made incremental, which rebuilt their states from the node
+# history on every step
+
+
+class _OldGraph():
+    def __init__(self, test_case):
+        self._graph = networkx.Graph()
+        self._graph.add_nodes_from(test_case["nodes"])
+        self._graph.add_edges_from(test_case["edges"])
+
+    def adj(self, node):
+        return [n for _, n in self._graph.edges(node)]
+
+    def bfs_valid_nodes(self, next_node, visited_nodes):
+        return set(
+            sum([(self.adj(node) + [node]) for node in visited_nodes + [next_node]], start=[])
+        )
+
+    def init_queues(self, start_node):
+        return self.adj(start_node), []
+
+    def update_queues(self, next_node, old_new_queues, visited_nodes):
+        old_queue, new_queue = deepcopy(old_new_queues)
+        assert next_node in old_queue
+        old_queue.pop(old_queue.index(next_node))
+
+        new_queue += [
+            node for node in self.adj(next_node) if node not in (visited_nodes + new_queue)
+        ]
+
+        if not old_queue:
+            old_queue = new_queue
+            new_queue = []
+
+        return old_queue, new_queue
+
+    def check_bfs(self, next_node, old_new_queues, visited_nodes):
+        if isinstance(next_node, Invalid):
+            return False
+
+        old_queue, _ = old_new_queues
+        return next_node in old_queue
+
+    def update_stack(self, next_node, stack, visited_nodes):
+        stack = deepcopy(stack)
+        if len(stack) > 1 and next_node == stack[-2]:
+            return stack[:-1]
+
+        stack.append(next_node)
+        return stack
+
+    def check_dfs(self, next_node, stack, visited_nodes):
+        if isinstance(next_node, Invalid):
+            return False
+
+        unvisited_adj_nodes = set(self.adj(stack[-1])).difference(set(visited_nodes))
+        if len(unvisited_adj_nodes):
+            return next_node in unvisited_adj_nodes
+
+        return next_node == stack[-2]
+
+
+def _old_check_bs(bench, answer, answer_list):
+    left = max(
+        [bench.min] + [pre_answer for pre_answer in answer_list if pre_answer < bench._target]
+    )
+    right = min(
+        [bench.max + 1] + [pre_answer for pre_answer in answer_list if pre_answer > bench._target]
+    )
+
+    return answer == (left + right) // 2
+
+
+def _replay_traverse(bench, old, rng, teacher):
+    '''
+    Walk the graph from the start node as an episode does, comparing the verdicts of the
+    old and the incremental checkers on every node and invalid reply at each step. The walk
+    follows `teacher` if given, otherwise random replies following the algorithm, e.g.
+    backtracking in DFS, since the checkers are not called after a reply breaks it.
+    '''
+    is_bfs = isinstance(bench, BFS)
+    start = bench._start_node
+
+    state = TraverseState(bench._graph)
+    state.expand(start)
+    state.visit(start)
+    stack_or_queue = bench._init_stack_or_queue()
+    visited_nodes = [start]
+    old_stack_or_queue = old.init_queues(start) if is_bfs else [start]
+
+    candidates = list(bench._graph.nodes) + INVALIDS
+    step = 0
+    while not state.done:
+        verdicts = {}
+        for node in candidates:
+            if is_bfs:
+                expected = old.check_bfs(node, old_stack_or_queue, visited_nodes)
+            else:
+                expected = old.check_dfs(node, old_stack_or_queue, visited_nodes)
+            verdict = bench._check_algo(node, stack_or_queue, state.visited)
+            assert verdict == expected, (node, visited_nodes)
+            verdicts[str(node)] = verdict
+
+        if teacher is None:
+            following = [node for node in bench._graph.nodes if verdicts[str(node)]]
+            next_node = rng.choice(following)
+        else:
+            next_node = teacher[step]
+            assert verdicts[str(next_node)]
+
+        stack_or_queue = bench._update_stack_or_queue(next_node, stack_or_queue, state.visited)
+        if is_bfs:
+            old_stack_or_queue = old.update_queues(next_node, old_stack_or_queue, visited_nodes)
+        else:
+            old_stack_or_queue = old.update_stack(next_node, old_stack_or_queue, visited_nodes)
+
+        state.expand(next_node)
+        valid_nodes = bench._get_valid_nodes(next_node, state)
+        if is_bfs:
+            # the valid nodes are listed in prompts in the same order
+            assert list(valid_nodes) == list(old.bfs_valid_nodes(next_node, visited_nodes))
+        else:
+            assert valid_nodes == set(old.adj(next_node))
+
+        state.visit(next_node)
+        visited_nodes.append(next_node)
+        step += 1
+
+    return step
+
+
+@pytest.mark.parametrize("name", _datasets("bfs") + _datasets("dfs"))
+def test_traverse_checkers(name):
+    test_cases = _load(name)
+    benchmark = BFS if "bfs" in name else DFS
+    bench = benchmark(node_num=len(test_cases[0]["nodes"]), verbose=False)
+
+    for i, test_case in enumerate(test_cases):
+        rng = random.Random(i)
+        bench.reset(test_case)
+        old = _OldGraph(test_case)
+        for node in test_case["nodes"]:
+            assert bench._get_adj_nodes(node) == old.adj(node)
+
+        # episodes with teacher forcing follow the teacher
+        bench._refresh_teacher_qa()
+        teacher = [node for _, node in bench._teacher_qa_list[:-1]]
+        assert _replay_traverse(bench, old, rng, teacher) == len(teacher)
+
+        _replay_traverse(bench, old, rng, None)
+
+
+@pytest.mark.parametrize("name", _datasets("binary_search"))
+def test_binary_search_checker(name):
+    test_cases = _load(name)
+    if name.startswith("hard"):
+        bench = BinarySearch(32, 32 + 2 ** 25, verbose=False)
+    else:
+        bench = BinarySearch(32, 32800, verbose=False)
+
+    for i, test_case in enumerate(test_cases):
+        rng = random.Random(i)
+        bench.reset(test_case)
+        bench._refresh_teacher_qa()
+        teacher = [answer for _, answer in bench._teacher_qa_list[:-1]]
+
+        # the teacher's answers, random answers, and random answers after the teacher's,
+        # the checker is only called after answers following the algorithm, but both keep
+        # the bounds of any answers
+        randoms = [rng.randint(bench.min, bench.max) for _ in range(len(teacher))]
+        cut = rng.randrange(len(teacher))
+        for answer_list in [teacher, randoms, teacher[:cut] + randoms[cut:]]:
+            interval = bench._init_interval()
+            for idx, answer in enumerate(answer_list):
+                left, right = interval
+                for candidate in {
+                    answer, bench.min, bench.max, bench._target, left, right - 1,
+                    (left + right) // 2 - 1, (left + right) // 2, (left + right) // 2 + 1
+                }:
+                    assert bench._check_algo(candidate, interval) \
+                        == _old_check_bs(bench, candidate, answer_list[:idx])
+                interval = bench._update_interval(answer, interval)
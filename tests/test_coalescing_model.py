@@ -0,0 +1,77 @@
+import asyncio
+from copy import copy, deepcopy
+
+import pytest
+
+from aqa.configs.models import SYNTHETIC_MODEL_CONFIG
+from aqa.models import CoalescingModel
+from aqa.models.coalescing_model import DialogTrie
+
+
+def test_trie_bound():
+    trie = DialogTrie(max_nodes=5)
+    histories = [[("START", "1"), (f"Q{i}", str(i))] for i in range(4)]
+    for history in histories:
+        _, future, owner = trie.claim("", history, "Q")
+        assert owner
+        future.set_result("A")
+
+    # the root and the first turn are shared, the least recently used last turns are evicted
+    stats = trie.get_stats()
+    assert stats["nodes"] == 5 and stats["evictions"] == 1
+    assert not trie.claim("", histories[-1], "Q")[2]
+    assert trie.claim("", histories[0], "Q")[2]
+    assert trie.get_stats()["nodes"] <= 5
+
+    # a waiter still gets an evicted reply
+    _, future, _ = trie.claim("other", [], "Q")
+    for history in histories:
+        trie.claim("", history, "Q")
+    assert trie.claim("other", [], "Q")[2]
+    future.set_result("A")
+
+
+def test_waiters_retry_failed_owner():
+    config = deepcopy(SYNTHETIC_MODEL_CONFIG)
+    config.update(LATENCY=0.05)
+    model = CoalescingModel(config)
+    models = [copy(model) for _ in range(3)]
+    for m in models:
+        m.reset()
+
+    async def fail(prompt):
+        await asyncio.sleep(0.05)
+        raise RuntimeError("owner failed")
+    models[0].model.acall = fail
+
+    async def run():
+        return await asyncio.gather(*[m.acall("START") for m in models], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] == results[2] == str((32 + 32801) // 2)
+    # the failed owner and the waiter that asked again
+    assert model.get_stats()["coalescing"]["misses"] == 2
+    assert models[1].history == models[2].history == [("START", results[1])]
+
+
+def test_cancelled_waiter():
+    config = deepcopy(SYNTHETIC_MODEL_CONFIG)
+    config.update(LATENCY=0.05)
+    model = CoalescingModel(config)
+    owner, waiter = copy(model), copy(model)
+    owner.reset()
+    waiter.reset()
+
+    async def run():
+        task = asyncio.ensure_future(owner.acall("START"))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(waiter.acall("START"))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return await task
+
+    # the reply is shared, so cancelling a waiter does not fail the owner
+    assert asyncio.run(run()) == str((32 + 32801) // 2)
@@ -0,0 +1,86 @@
+import pytest
+import torch
+
+from aqa.models.constrained import AnswerSpace, IntegerConstraint, IntegerLogitsProcessor
+
+EOS_TOKEN_ID = 0
+
+
+class _Tokenizer():
+    # tokens of digits split and merged as by the tokenizers of most models
+    tokens = ["</s>", "b", " ", " 3", "12", "1b"] + [str(i) for i in range(10)]
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def decode(self, ids):
+        return "".join(self.tokens[i] for i in ids)
+
+    def encode(self, *tokens):
+        return [self.tokens.index(token) for token in tokens]
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    return _Tokenizer()
+
+
+@pytest.fixture(scope="module")
+def constraint(tokenizer):
+    return IntegerConstraint(tokenizer)
+
+
+def test_answer_space():
+    space = AnswerSpace(range(32, 32801))
+    assert [space.is_prefix(d) for d in ["", "3", "328", "32800", "32801", "0", "05"]] \
+        == [True, True, True, True, False, False, False]
+    assert [space.is_answer(d) for d in ["", "3", "31", "32", "32800"]] \
+        == [False, False, False, True, True]
+
+    space = AnswerSpace([3, 12, -1])
+    assert [space.is_prefix(d) for d in ["1", "12", "2", "-"]] == [True, True, False, False]
+    assert [space.is_answer(d) for d in ["1", "12", "3"]] == [False, True, True]
+
+    space = AnswerSpace(max_digits=2)
+    assert space.is_answer("0") and space.is_answer("99") and not space.is_prefix("100")
+
+
+def _allowed(constraint, tokenizer, answers, *tokens):
+    ids = constraint.allowed_tokens(
+        tokenizer.encode(*tokens), AnswerSpace(answers), [EOS_TOKEN_ID]
+    )
+    return sorted(tokenizer.decode([i]) for i in ids)
+
+
+def test_allowed_tokens(constraint, tokenizer):
+    # a token with leading spaces only starts a reply
+    assert _allowed(constraint, tokenizer, None) == sorted([" 3", "12"] + list("0123456789"))
+    assert " 3" not in _allowed(constraint, tokenizer, None, "1")
+
+    # the digits of a multi-digit integer are split across tokens
+    answers = range(10, 20)
+    assert _allowed(constraint, tokenizer, answers) == ["1", "12"]
+    assert _allowed(constraint, tokenizer, answers, "1") == list("0123456789")
+    # eos once the answer is complete, and only eos past the last digit of the answers
+    assert _allowed(constraint, tokenizer, answers, "1", "2") == ["</s>"]
+    assert _allowed(constraint, tokenizer, answers, "12") == ["</s>"]
+    assert _allowed(constraint, tokenizer, [1, 12], "1") == ["2", "</s>"]
+    assert _allowed(constraint, tokenizer, None, "12", "3") \
+        == sorted(["12", "</s>"] + list("0123456789"))
+
+    # a reply outside the constraint or the answers can only end
+    assert _allowed(constraint, tokenizer, answers, "b") == ["</s>"]
+    assert _allowed(constraint, tokenizer, []) == ["</s>"]
+
+
+def test_logits_processor(constraint, tokenizer):
+    # rows of 2 prompt tokens, the logits of the disallowed tokens are masked
+    processor = IntegerLogitsProcessor(constraint, AnswerSpace(range(10, 20)), [EOS_TOKEN_ID], 2)
+    prompt = tokenizer.encode("b", " ")
+    input_ids = torch.tensor([prompt + tokenizer.encode("1"), prompt + tokenizer.encode("12")])
+    scores = processor(input_ids, torch.zeros(2, len(tokenizer)))
+
+    allowed = [[tokenizer.decode([i]) for i in row.isfinite().nonzero()[:, 0].tolist()]
+               for row in scores]
+    assert sorted(allowed[0]) == list("0123456789") and allowed[1] == ["</s>"]
+    assert processor.allowed_tokens(tokenizer.encode("1", "2")) == [EOS_TOKEN_ID]
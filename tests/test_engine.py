@@ -0,0 +1,67 @@
+import random
+import time
+
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from aqa.models.engine import GenerationEngine
+
+VOCAB_SIZE = 64
+EOS_TOKEN_ID = 2
+
+
+@pytest.fixture(scope="module")
+def model():
+    # tiny random llama on CPU, in float64 so that padding and batching don't change the
+    # greedy tokens
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=VOCAB_SIZE, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, eos_token_id=EOS_TOKEN_ID, pad_token_id=0
+    )
+    return LlamaForCausalLM(config).double().eval()
+
+
+def _generate(model, input_ids, max_new_tokens):
+    with torch.no_grad():
+        output = model.generate(
+            torch.tensor([input_ids]), max_new_tokens=max_new_tokens, do_sample=False,
+            eos_token_id=EOS_TOKEN_ID, pad_token_id=0
+        )
+    return output[0, len(input_ids):].tolist()
+
+
+def test_batched_matches_generate(model):
+    rng = random.Random(0)
+    requests = [
+        ([rng.randrange(3, VOCAB_SIZE) for _ in range(rng.randint(1, 30))], rng.randint(1, 12))
+        for _ in range(24)
+    ]
+
+    engine = GenerationEngine(model, max_batch_size=5)
+    futures = []
+    for input_ids, max_new_tokens in requests:
+        futures.append(engine.submit(input_ids, max_new_tokens, [EOS_TOKEN_ID]))
+        # requests join the running batch at different steps
+        time.sleep(rng.random() * 0.005)
+
+    for (input_ids, max_new_tokens), future in zip(requests, futures):
+        assert future.result(timeout=60) == _generate(model, input_ids, max_new_tokens)
+
+
+def test_prefill_failure(model):
+    engine = GenerationEngine(model, max_batch_size=4)
+    running = engine.submit([5, 6, 7], 30)
+    # a token id out of the vocabulary fails the prefill
+    failed = engine.submit([VOCAB_SIZE + 1], 4)
+    other = engine.submit([3, 4], 4)
+
+    with pytest.raises(IndexError):
+        failed.result(timeout=60)
+    # the others fail with it or finish, but never hang
+    running.exception(timeout=60)
+    other.exception(timeout=60)
+
+    # the engine keeps serving new requests
+    assert engine.generate([5, 6, 7], 4, [EOS_TOKEN_ID]) == _generate(model, [5, 6, 7], 4)
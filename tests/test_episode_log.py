@@ -0,0 +1,73 @@
+import json
+import random
+
+from aqa.utils.dict_boardcast import DictAggregator
+from aqa.utils.episode_log import EpisodeLog
+
+
+def _results(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        {"metric": {"acc": rng.random(), "steps": rng.randint(1, 9)}, "answers": [i]}
+        for i in range(n)
+    ]
+
+
+def _resume(log):
+    # as `Benchmark.test_with_examples` without keeping the results
+    aggregator = DictAggregator()
+    offset, snapshot = log.load_checkpoint()
+    if snapshot is not None:
+        aggregator.restore(snapshot)
+    tail = list(log.read(offset))
+    for result in tail:
+        aggregator.update(result["metric"])
+    return aggregator, tail
+
+
+def test_resume_reads_only_tail(tmp_path):
+    results = _results(10)
+    log = EpisodeLog(str(tmp_path / "episodes.jsonl"))
+    aggregator = DictAggregator()
+    for i, result in enumerate(results[:7]):
+        aggregator.update(result["metric"])
+        log.append([(i + 1, result)], aggregator.snapshot() if i < 4 else None)
+
+    resumed, tail = _resume(EpisodeLog(log.path))
+    assert tail == results[4:7]
+    assert resumed.count == log.last_index() == 7
+    assert json.dumps(resumed.stats()) == json.dumps(aggregator.stats())
+
+    # the checkpoint goes on from the restored aggregator
+    for result in results[7:]:
+        resumed.update(result["metric"])
+        aggregator.update(result["metric"])
+    assert json.dumps(resumed.stats()) == json.dumps(aggregator.stats())
+
+
+def test_resume_without_checkpoint(tmp_path):
+    results = _results(3)
+    log = EpisodeLog(str(tmp_path / "episodes.jsonl"))
+    log.append(list(enumerate(results, 1)), DictAggregator().snapshot())
+    log.clear()
+    log.append(list(enumerate(results, 1)))
+
+    resumed, tail = _resume(log)
+    assert tail == results
+    assert resumed.count == 3
+
+
+def test_torn_record_after_checkpoint(tmp_path):
+    results = _results(4)
+    log = EpisodeLog(str(tmp_path / "episodes.jsonl"))
+    aggregator = DictAggregator()
+    for result in results[:2]:
+        aggregator.update(result["metric"])
+    log.append(list(enumerate(results[:2], 1)), aggregator.snapshot())
+    log.append([(3, results[2])])
+    with open(log.path, mode="a") as f:
+        f.write('{"index": 4, "res')
+
+    resumed, tail = _resume(EpisodeLog(log.path))
+    assert tail == results[2:3]
+    assert resumed.count == 3
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+from google.generativeai import protos
+from tenacity import wait_none
+
+from aqa.models import Gemini
+from aqa.models import gemini
+
+
+def _response(request):
+    # reply with the number of contents sent
+    text = f"{len(request.contents)} is my guess"
+    return protos.GenerateContentResponse(
+        candidates=[protos.Candidate(content=gemini._to_content("model", text))],
+        usage_metadata={"total_token_count": 5}
+    )
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    requests = []
+
+    def generate(self, request):
+        requests.append(request)
+        return _response(request)
+
+    async def agenerate(self, request):
+        return generate(self, request)
+
+    monkeypatch.setattr(gemini._Client, "generate", generate)
+    monkeypatch.setattr(gemini._Client, "agenerate", agenerate)
+    return requests
+
+
+def _texts(contents):
+    return [(content.role, content.parts[0].text) for content in contents]
+
+
+def test_chat(requests):
+    model = Gemini(["key0", "key1"], sleep_sec=0)
+    model.reset("Guess")
+
+    assert model("START") == "3 is my guess"
+    model.force("16416")
+    assert asyncio.run(model.acall("Bigger")) == "5 is my guess"
+    assert _texts(requests[-1].contents) == [
+        ("user", "Guess"), ("model", ""), ("user", "START"), ("model", "16416"),
+        ("user", "Bigger"),
+    ]
+    assert model.history == [("START", "16416", "3 is my guess"), ("Bigger", "5 is my guess")]
+
+    snapshot = model.snapshot()
+    model.revoke(2)
+    assert model("START") == "3 is my guess"
+    model.restore(snapshot)
+    assert model("Smaller") == "7 is my guess"
+
+    # the keys are used in turn
+    assert [stats["requests"] for stats in model.get_stats()["key_pool"]] == [2, 2]
+
+
+def test_empty_reply_is_retried(requests, monkeypatch):
+    model = Gemini("key", sleep_sec=0)
+    model._retry = lambda func: Gemini._retry(model, func).retry_with(wait=wait_none())
+    model.reset()
+
+    # e.g. a blocked reply
+    replies = iter([protos.GenerateContentResponse()])
+    monkeypatch.setattr(
+        gemini._Client, "generate",
+        lambda self, request: next(replies, None) or _response(request)
+    )
+
+    assert model("START") == "1 is my guess"
+    assert model.history == [("START", "1 is my guess")]
+    assert _texts(model.contents) == [("user", "START"), ("model", "1 is my guess")]
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from aqa.models.hedger import Hedger
+
+
+class _SlowFunc():
+    # sleeps and returns or raises what is given for each call, in the order of the calls
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            self.calls += 1
+            return self.outcomes.pop(0)
+
+    def __call__(self):
+        sleep_sec, result = self._next()
+        time.sleep(sleep_sec)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def acall(self):
+        sleep_sec, result = self._next()
+        await asyncio.sleep(sleep_sec)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _warm_up(hedger, sleep_secs):
+    for sleep_sec in sleep_secs:
+        assert hedger.call(_SlowFunc((sleep_sec, "reply"))) == "reply"
+
+
+def test_percentile_delay():
+    hedger = Hedger(percentile=50, min_samples=4)
+    _warm_up(hedger, [0.04, 0.01, 0.03])
+    assert hedger.get_delay() is None
+
+    # the median of the latencies, not below `min_delay_sec`
+    _warm_up(hedger, [0.02])
+    assert hedger.get_delay() == pytest.approx(0.02, abs=0.009)
+    hedger.min_delay_sec = 0.1
+    assert hedger.get_delay() == 0.1
+    assert hedger.get_stats()["hedged"] == 0
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_hedge_wins(use_async):
+    hedger = Hedger(percentile=50, min_samples=4, min_delay_sec=0.05)
+    _warm_up(hedger, [0.0] * 4)
+
+    # the first request is stuck, the hedge sent after the delay wins
+    func = _SlowFunc((0.5, "primary"), (0.0, "hedge"))
+    start = time.monotonic()
+    if use_async:
+        assert asyncio.run(hedger.acall(func.acall)) == "hedge"
+    else:
+        assert hedger.call(func) == "hedge"
+    assert func.calls == 2 and time.monotonic() - start < 0.3
+
+    stats = hedger.get_stats()
+    assert stats["calls"] == 5 and stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+    # the sync loser still runs, the async one is dropped with its event loop
+    time.sleep(0.6)
+    if not use_async:
+        assert hedger.get_stats()["saved_sec"] == pytest.approx(0.45, abs=0.1)
+    # only the winner's latency is in the window
+    assert len(hedger._latencies) == 5 and max(hedger._latencies) < 0.2
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_failures(use_async):
+    hedger = Hedger(percentile=50, min_samples=4, min_delay_sec=0.05)
+    _warm_up(hedger, [0.0] * 4)
+
+    def call(func):
+        if use_async:
+            return asyncio.run(hedger.acall(func.acall))
+        return hedger.call(func)
+
+    # a failed hedge doesn't win over a slower success
+    assert call(_SlowFunc((0.2, "primary"), (0.0, ValueError("hedge")))) == "primary"
+    assert hedger.get_stats()["hedge_wins"] == 0
+
+    # the error of the first request is raised once all of them failed
+    with pytest.raises(ValueError, match="primary"):
+        call(_SlowFunc((0.2, ValueError("primary")), (0.0, ValueError("hedge"))))
+    assert hedger.get_stats()["hedged"] == 2 and len(hedger._latencies) == 5
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from aqa.models.kv_cache import PrefixCache, TurnCache
+
+VOCAB_SIZE = 64
+EOS_TOKEN_ID = 2
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=VOCAB_SIZE, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, eos_token_id=EOS_TOKEN_ID, pad_token_id=0
+    )
+    return LlamaForCausalLM(config).double().eval()
+
+
+def _generate(model, input_ids, max_new_tokens):
+    with torch.no_grad():
+        output = model.generate(
+            torch.tensor([input_ids]), max_new_tokens=max_new_tokens, do_sample=False,
+            eos_token_id=EOS_TOKEN_ID, pad_token_id=0
+        )
+    return output[0, len(input_ids):].tolist()
+
+
+def _turn_cache(model, ids):
+    turn_cache = TurnCache()
+    turn_cache.generate(model, ids + [3], max_new_tokens=1, pad_token_id=0)
+    turn_cache.crop(len(ids))
+    turn_cache.compact()
+    return turn_cache
+
+
+def test_lookup_longest_prefix(model):
+    prefix_cache = PrefixCache(1 << 30)
+    for ids in [[5, 6, 7, 8], [5, 6, 9], [10, 11]]:
+        prefix_cache.insert(_turn_cache(model, ids))
+
+    assert prefix_cache.lookup([5, 6, 7, 12, 13]).ids == [5, 6, 7, 8]
+    assert prefix_cache.lookup([5, 6, 9, 14]).ids == [5, 6, 9]
+    assert prefix_cache.lookup([5, 6]).ids in ([5, 6, 7, 8], [5, 6, 9])
+    assert prefix_cache.lookup([12, 5, 6]) is None
+    # at least one token is left to prefill
+    assert prefix_cache.lookup([10]) is None
+
+    stats = prefix_cache.get_stats()
+    assert stats["lookups"] == 5 and stats["hits"] == 3
+    assert stats["hit_tokens"] == 3 + 3 + 1
+
+
+def test_eviction_prunes_trie(model):
+    entries = [_turn_cache(model, [5, 6, i]) for i in range(7, 10)]
+    prefix_cache = PrefixCache(2 * entries[0].nbytes)
+    for entry in entries:
+        prefix_cache.insert(entry)
+
+    # the least recently used entry is evicted along with its own path
+    stats = prefix_cache.get_stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    assert prefix_cache.lookup([5, 6, 7, 12]).ids in ([5, 6, 8], [5, 6, 9])
+    assert 7 not in prefix_cache._root.children[5].children[6].children
+    assert prefix_cache.lookup([5, 6, 9, 12]).ids == [5, 6, 9]
+
+
+def test_shared_prefix_saved(model):
+    rng = random.Random(0)
+    prefix_cache = PrefixCache(1 << 30)
+    shared = [rng.randrange(3, VOCAB_SIZE) for _ in range(20)]
+
+    for i in range(3):
+        turn = [rng.randrange(3, VOCAB_SIZE) for _ in range(rng.randint(1, 10))]
+        turn_cache = TurnCache()
+        output = turn_cache.generate(
+            model, shared + turn, prefix_cache, shared,
+            max_new_tokens=8, eos_token_id=EOS_TOKEN_ID, pad_token_id=0
+        )
+        assert output == _generate(model, shared + turn, 8)
+
+    # only the shared prefix is kept, and the later turns start from it
+    stats = prefix_cache.get_stats()
+    assert stats["entries"] == 1 and stats["hits"] == 2
+    assert list(prefix_cache._entries) == [tuple(shared)]
@@ -0,0 +1,62 @@
+import pytest
+from tenacity import RetryError, stop_after_attempt, wait_none
+
+from aqa.models import OpenAI
+
+EXAMPLES = [[("START", "16416"), ("Bigger", "24608")]]
+
+
+def _model(base_url, **kwargs):
+    # the stub serves the deployments under the same host
+    model = OpenAI("stub", "key", "2024-02-01", base_url[:-len("/v1")], sleep_sec=0, **kwargs)
+    model.client = model.client.with_options(max_retries=0)
+    model.completion_func = model.completion_func.retry_with(
+        wait=wait_none(), stop=stop_after_attempt(2)
+    )
+    return model
+
+
+def _texts(request):
+    return [(m["role"], m["content"][0]["text"]) for m in request["messages"]]
+
+
+def test_examples_not_sent_by_default(base_url, stub):
+    model = _model(base_url)
+    model.reset("Guess")
+    model.add_history(EXAMPLES)
+
+    assert model("START") == "2 is my guess and more words"
+    assert _texts(stub.requests[-1]) == [("system", "Guess"), ("user", "START")]
+    assert model.history == EXAMPLES[0] + [("START", "2 is my guess and more words")]
+
+
+def test_send_history(base_url, stub):
+    model = _model(base_url, send_history=True)
+    model.reset("Guess")
+    model.add_history(EXAMPLES)
+
+    assert model("START") == "6 is my guess and more words"
+    assert _texts(stub.requests[-1]) == [
+        ("system", "Guess"), ("user", "START"), ("assistant", "16416"),
+        ("user", "Bigger"), ("assistant", "24608"), ("user", "START"),
+    ]
+
+    model.revoke(2)
+    assert _texts({"messages": model.messages}) == [
+        ("system", "Guess"), ("user", "START"), ("assistant", "16416")
+    ]
+
+
+def test_failed_call_keeps_messages(base_url, stub):
+    model = _model(base_url)
+    model.reset("Guess")
+
+    stub.failures = [500, 500]
+    with pytest.raises(RetryError):
+        model("START")
+    assert len(model.messages) == 1 and model.history == []
+
+    assert model("START") == "2 is my guess and more words"
+    assert _texts({"messages": model.messages})[1:] == [
+        ("user", "START"), ("assistant", "2 is my guess and more words")
+    ]
@@ -0,0 +1,119 @@
+import asyncio
+from copy import copy
+import time
+
+import httpx
+import pytest
+from tenacity import stop_after_attempt, wait_none
+
+from aqa.models import OpenAICompatible
+from aqa.models import openai_compatible
+from aqa.models.answer_stop import cut_at_answer
+
+
+def _model(base_url, **kwargs):
+    model = OpenAICompatible("stub", base_url, **kwargs)
+    # retry at once
+    model.completion_func = model.completion_func.retry_with(wait=wait_none())
+    model.acompletion_func = model.acompletion_func.retry_with(wait=wait_none())
+    return model
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_chat(base_url, stub, stream):
+    model = _model(base_url, stream=stream, seed=42)
+    model.reset("Guess")
+
+    assert model("START") == "2 is my guess and more words"
+    assert asyncio.run(model.acall("Bigger")) == "4 is my guess and more words"
+
+    assert [body["stream"] for body in stub.requests] == [stream, stream]
+    assert stub.requests[-1]["seed"] == 42
+    assert stub.requests[-1]["messages"] == [
+        {"role": "system", "content": "Guess"},
+        {"role": "user", "content": "START"},
+        {"role": "assistant", "content": "2 is my guess and more words"},
+        {"role": "user", "content": "Bigger"},
+    ]
+    assert model.history == [
+        ("START", "2 is my guess and more words"), ("Bigger", "4 is my guess and more words")
+    ]
+    if not stream:
+        assert model.get_stats()["requests"]["completion_tokens"] == 6
+
+
+def test_concurrency(base_url, stub):
+    stub.delay = 0.5
+    model = _model(base_url, stream=False)
+    models = [copy(model) for _ in range(4)]
+    for m in models:
+        m.reset()
+
+    async def run():
+        replies = await asyncio.gather(*[m.acall("START") for m in models])
+        # one pooled client for the loop
+        return replies, len(openai_compatible._aclients[asyncio.get_running_loop()])
+
+    start = time.time()
+    replies, num_clients = asyncio.run(run())
+    assert time.time() - start < 4 * stub.delay
+    assert replies == ["2 is my guess and more words"] * 4
+    assert num_clients == 1
+    assert stub.max_active == 4
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retry(base_url, stub, status):
+    model = _model(base_url, stream=False)
+    model.reset()
+
+    stub.failures = [status, status]
+    assert model("START") == "2 is my guess and more words"
+    assert len(stub.requests) == 3
+
+    stub.failures = [status]
+    assert asyncio.run(model.acall("Bigger")) == "4 is my guess and more words"
+    assert len(stub.requests) == 5
+
+
+def test_no_retry_of_client_errors(base_url, stub):
+    model = _model(base_url, stream=False)
+    model.reset()
+
+    stub.failures = [400]
+    with pytest.raises(httpx.HTTPStatusError):
+        model("START")
+    assert len(stub.requests) == 1
+
+
+def test_failed_call_keeps_conversation(base_url, stub):
+    model = _model(base_url, stream=False)
+    model.reset()
+    model.completion_func = model.completion_func.retry_with(stop=stop_after_attempt(2))
+
+    stub.failures = [503, 503]
+    with pytest.raises(httpx.HTTPStatusError):
+        model("START")
+    assert model.history == []
+
+    # no user message is left without its reply
+    assert model("START") == "2 is my guess and more words"
+    assert len(stub.requests[-1]["messages"]) == 2
+
+
+def test_stop_at_answer(base_url, stub):
+    stub.delay = 1.0
+    model = _model(base_url, stream=True, stop_at_answer="tolerant")
+    model.reset()
+
+    # the stream is closed before the last chunk, with the same reply as if it was not
+    start = time.time()
+    assert model("START") == cut_at_answer("2 is my guess and more words", "tolerant")
+    assert time.time() - start < 2 * stub.delay
+    assert model.get_stats()["requests"]["stopped"] == 1
+
+    start = time.time()
+    reply = cut_at_answer("4 is my guess and more words", "tolerant")
+    assert asyncio.run(model.acall("Bigger")) == reply
+    assert time.time() - start < 2 * stub.delay
+    assert model.messages[-1] == {"role": "assistant", "content": reply}
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from aqa.models.rate_limiter import RateLimiter
+
+
+def _throttled():
+    request = httpx.Request("POST", "http://localhost")
+    response = httpx.Response(429, request=request)
+    return httpx.HTTPStatusError("throttled", request=request, response=response)
+
+
+def test_additive_increase():
+    limiter = RateLimiter(max_concurrency=8, init_concurrency=2, cooldown=0.0)
+    # about 1 more after `limit` successful requests
+    for _ in range(2):
+        limiter.call(lambda: None)
+    assert limiter.get_stats()["concurrency_limit"] == 2
+    limiter.call(lambda: None)
+    assert limiter.get_stats()["concurrency_limit"] == 3
+
+    with pytest.raises(httpx.HTTPStatusError):
+        limiter.call(lambda: (_ for _ in ()).throw(_throttled()))
+    limit = 2.0
+    for _ in range(3):
+        limit += 1 / limit
+    assert limiter.limit == pytest.approx(limit / 2)
+
+
+def test_fifo_sync_and_async():
+    limiter = RateLimiter(max_concurrency=1)
+    limiter.acquire()
+    order = []
+
+    def sync_waiter(i):
+        limiter.acquire()
+        order.append(i)
+        limiter.release()
+
+    async def async_waiter(i):
+        await limiter.aacquire()
+        order.append(i)
+        limiter.release()
+
+    # waiters get in line in the order of `i`, alternating threads and an event loop
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    futures, threads = [], []
+    for i in range(6):
+        if i % 2:
+            futures.append(asyncio.run_coroutine_threadsafe(async_waiter(i), loop))
+        else:
+            threads.append(threading.Thread(target=sync_waiter, args=(i,)))
+            threads[-1].start()
+        while limiter.get_stats()["queue_depth"] <= i:
+            time.sleep(0.001)
+
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    for future in futures:
+        future.result()
+    loop.call_soon_threadsafe(loop.stop)
+
+    assert order == list(range(6))
+    assert limiter.get_stats()["in_flight"] == 0
+
+
+def test_cancelled_waiter_passes_turn():
+    limiter = RateLimiter(max_concurrency=1)
+
+    async def run():
+        await limiter.aacquire()
+        first = asyncio.ensure_future(limiter.aacquire())
+        second = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0.01)
+        first.cancel()
+        limiter.release()
+        await asyncio.wait_for(second, 1.0)
+
+    asyncio.run(run())
+    stats = limiter.get_stats()
+    assert stats["in_flight"] == 1 and stats["queue_depth"] == 0
+
+
+def test_requests_per_min():
+    limiter = RateLimiter(requests_per_min=600)
+    limiter.requests.level = 0
+
+    # the bucket refills a request every 0.1 second
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.call(lambda: None)
+    assert 0.25 < time.monotonic() - start < 0.6
@@ -0,0 +1,60 @@
+import json
+import os.path as osp
+
+from loguru import logger
+import pytest
+
+from aqa.benchmarks import BinarySearch, Coin
+from aqa.models import SyntheticModel
+from aqa.utils import rescore
+
+DATASETS = osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), "datasets")
+
+
+@pytest.fixture(autouse=True, scope="module")
+def quiet():
+    logger.disable("aqa")
+    yield
+    logger.enable("aqa")
+
+
+def _run(benchmark, output_dir):
+    bench = benchmark(32, 32800, verbose=False, output_dir=str(output_dir), save_period=0)
+    bench.load_testcases_from_file(osp.join(DATASETS, "binary_search_0.json"))
+    metric, _ = bench.test_with_examples(SyntheticModel(), 3)
+    return osp.join(str(output_dir), "results_final.json"), metric
+
+
+def test_rescore_mixed_benchmarks(tmp_path):
+    bs_path, bs_metric = _run(BinarySearch, tmp_path / "bs")
+    coin_path, coin_metric = _run(Coin, tmp_path / "coin")
+
+    # results saved before the benchmark was recorded
+    old_path, _ = _run(BinarySearch, tmp_path / "old")
+    with open(old_path) as f:
+        full_result = json.load(f)
+    del full_result["env"]["benchmark"]
+    with open(old_path, mode="w") as f:
+        json.dump(full_result, f)
+
+    broken_dir = tmp_path / "broken"
+    broken_dir.mkdir()
+    (broken_dir / "results_final.json").write_text("{")
+
+    # `-b` only applies to the old results, the others keep their own benchmark
+    statuses = {
+        osp.basename(osp.dirname(path)): (output_path, metric, error)
+        for path, output_path, metric, error in rescore([str(tmp_path)], "BinarySearch", 2)
+    }
+    assert sorted(statuses) == ["broken", "bs", "coin", "old"]
+    assert statuses["bs"][1] == bs_metric and statuses["old"][1] == bs_metric
+    assert statuses["coin"][1] == coin_metric
+    assert statuses["broken"][:2] == (None, None) and "JSONDecodeError" in statuses["broken"][2]
+    for name, benchmark_name in [("bs", "BinarySearch"), ("coin", "Coin"), ("old", "BinarySearch")]:
+        assert statuses[name][2] is None
+        with open(statuses[name][0]) as f:
+            assert json.load(f)["env"]["benchmark"] == benchmark_name
+
+    # without `-b`, only the old results fail
+    errors = [error for _, _, _, error in rescore([str(tmp_path)])]
+    assert sum(error is not None for error in errors) == 2
@@ -0,0 +1,67 @@
+from copy import deepcopy
+
+from tenacity import stop_after_attempt
+
+from aqa.configs import Config
+from aqa.configs.models import SYNTHETIC_MODEL_CONFIG
+from aqa.models import OpenAI, RouterModel
+
+
+def _router(base_url, **kwargs):
+    backend = Config(NAME="OpenAICompatible", MODEL_NAME="stub", BASE_URL=base_url, STREAM=False)
+    router = RouterModel([deepcopy(SYNTHETIC_MODEL_CONFIG), backend], **kwargs)
+    assert router.endpoint.index == 0
+    return router
+
+
+def test_failover_with_forced_history(base_url, stub):
+    router = _router(base_url, error_budget=0.0)
+    router.endpoints[1].latency = 1.0
+    router.reset("Guess")
+    assert router.endpoint.index == 0
+
+    reply = router("START")
+    router.force("1234")
+
+    # the synthetic endpoint fails from now on, without retrying
+    router.endpoints[0].model.failure_rate = 1.0
+    router.model.attempt_func = router.model.attempt_func.retry_with(stop=stop_after_attempt(1))
+
+    assert router("Bigger") == "4 is my guess and more words"
+    assert router.endpoint.index == 1
+    # the history keeps the forced turn, the new endpoint only gets its forced reply
+    assert router.history == [
+        ("START", "1234", reply), ("Bigger", "4 is my guess and more words")
+    ]
+    assert stub.requests[-1]["messages"] == [
+        {"role": "system", "content": "Guess"},
+        {"role": "user", "content": "START"},
+        {"role": "assistant", "content": "1234"},
+        {"role": "user", "content": "Bigger"},
+    ]
+
+    stats = router.get_stats()["router"]
+    assert stats[0]["trips"] == 1 and stats[0]["failovers"] == 1 and stats[0]["tripped"]
+
+
+def test_routes_to_faster_endpoint(base_url, stub):
+    router = _router(base_url)
+    router("START")
+    router.endpoints[0].latency = 10.0
+
+    # new episodes go to the endpoint with the lower latency and stay there
+    router.reset()
+    assert router.endpoint.index == 1
+    router("START")
+    router.endpoints[1].latency = 20.0
+    router("Bigger")
+    assert router.endpoint.index == 1
+
+
+def test_openai_add_forced_history():
+    model = OpenAI("model", "key", "2024-02-01", "http://localhost", send_history=True)
+    model.add_history([[("START", "16416", "100"), ("Bigger", "24608")]])
+
+    assert [m["content"][0]["text"] for m in model.messages[1:]] == [
+        "START", "16416", "Bigger", "24608"
+    ]
@@ -0,0 +1,113 @@
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from aqa.models.scoring import find_reply_spans, score_replies
+
+SPECIAL_TOKENS = ["<pad>", "<s>", "</s>", "<unk>"]
+VOCAB = SPECIAL_TOKENS + ["[INST]", "[/INST]", "guess", "bigger", "smaller"] \
+    + [str(i) for i in range(10)]
+EOS_TOKEN_ID = 2
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    # word level, with a token per digit as the tokenizers of most models
+    vocab = {token: i for i, token in enumerate(VOCAB)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.add_special_tokens(SPECIAL_TOKENS)
+    tokenizer.pre_tokenizer = pre_tokenizers.Sequence([
+        pre_tokenizers.WhitespaceSplit(), pre_tokenizers.Digits(individual_digits=True)
+    ])
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, eos_token="</s>", pad_token="<pad>", unk_token="<unk>"
+    )
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=len(VOCAB), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, eos_token_id=EOS_TOKEN_ID, pad_token_id=0
+    )
+    return LlamaForCausalLM(config).double().eval()
+
+
+def _render(qa_list, prompt=None):
+    # a template like Mistral's, which strips the replies
+    text = "<s>"
+    for q, a in qa_list:
+        text += f"[INST] {q} [/INST] {a.strip()}</s>"
+    if prompt is not None:
+        text += f"[INST] {prompt} [/INST]"
+    return text
+
+
+def _spans(qa_list):
+    prompts = [_render(qa_list[:i], q) for i, (q, _) in enumerate(qa_list)]
+    turns = [_render(qa_list[:i + 1]) for i in range(len(qa_list))]
+    text = turns[-1]
+    return text, find_reply_spans(text, prompts, turns, [a for _, a in qa_list])
+
+
+def test_find_reply_spans():
+    # the first reply is a prefix of the next prompt, and the second is stripped
+    qa_list = [("guess", "1"), ("1 bigger", " 12 "), ("smaller", "5")]
+    text, spans = _spans(qa_list)
+
+    assert [text[start: end] for start, end in spans] == ["1", "12", "5"]
+    assert spans[0][0] == len("<s>[INST] guess [/INST] ")
+
+    with pytest.raises(AssertionError):
+        find_reply_spans(text, [_render([], "guess")], [_render([("guess", "1")])], ["2"])
+
+
+def test_score_replies(model, tokenizer):
+    qa_list = [("guess", "16"), ("bigger", "24")]
+    text, spans = _spans(qa_list)
+    scores = score_replies(model, tokenizer, text, spans, [EOS_TOKEN_ID])
+
+    input_ids = tokenizer(text, add_special_tokens=False).input_ids
+    with torch.no_grad():
+        logprobs = torch.log_softmax(model(torch.tensor([input_ids])).logits[0], dim=-1)
+
+    # the digits of each reply and the end of its turn
+    for (q, a), score in zip(qa_list, scores):
+        prompt_ids = tokenizer(
+            _render(qa_list[:qa_list.index((q, a))], q), add_special_tokens=False
+        ).input_ids
+        start = len(prompt_ids)
+        positions = list(range(start, start + len(a) + 1))
+        assert [input_ids[i] for i in positions] \
+            == tokenizer(a, add_special_tokens=False).input_ids + [EOS_TOKEN_ID]
+
+        assert score["tokens"] == len(a) + 1
+        assert score["logprob"] == pytest.approx(
+            sum(float(logprobs[i - 1, input_ids[i]]) for i in positions)
+        )
+        greedy = [int(logprobs[i - 1].argmax()) for i in positions]
+        assert score["greedy"] == (greedy == [input_ids[i] for i in positions])
+        assert score["reply"] == tokenizer.decode(greedy, skip_special_tokens=True).strip()
+
+
+def test_score_greedy_reply(model, tokenizer):
+    # the greedy reply of the tiny model scores as greedy, "7 8 4" after this prompt
+    prompt = _render([], "2")
+    input_ids = tokenizer(prompt, add_special_tokens=False).input_ids
+    with torch.no_grad():
+        output = model.generate(
+            torch.tensor([input_ids]), max_new_tokens=3, do_sample=False,
+            eos_token_id=EOS_TOKEN_ID, pad_token_id=0
+        )
+    greedy_ids = output[0, len(input_ids):].tolist()
+    reply = tokenizer.decode(greedy_ids, skip_special_tokens=True)
+    # the generated tokens round trip through the template
+    assert tokenizer(reply, add_special_tokens=False).input_ids == \
+        [i for i in greedy_ids if i != EOS_TOKEN_ID]
+
+    text = _render([("2", reply)])
+    spans = find_reply_spans(text, [prompt], [text], [reply])
+    score, = score_replies(model, tokenizer, text, spans)
+    assert score["greedy"] and score["reply"] == reply.strip()
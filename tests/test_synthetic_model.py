@@ -0,0 +1,36 @@
+import asyncio
+
+from tenacity import wait_none
+
+from aqa.models import SyntheticModel
+
+
+def _model(**kwargs):
+    model = SyntheticModel(**kwargs)
+    # retry at once
+    model.attempt_func = model.attempt_func.retry_with(wait=wait_none())
+    model.aattempt_func = model.aattempt_func.retry_with(wait=wait_none())
+    return model
+
+
+def _play(call, prompts):
+    return [call(prompt) for prompt in prompts]
+
+
+def test_failures_are_retried():
+    prompts = [
+        "START", "The true number is bigger than 16416.", "The true number is smaller than 24608."
+    ]
+    expected = _play(SyntheticModel(), prompts)
+
+    model = _model(failure_rate=0.5, seed=1)
+    assert _play(model, prompts) == expected
+
+    amodel = _model(failure_rate=0.5, seed=1)
+    assert [asyncio.run(amodel.acall(prompt)) for prompt in prompts] == expected
+
+    for m in [model, amodel]:
+        stats = m.get_stats()["synthetic"]
+        assert stats["failures"] > 0
+        assert stats["calls"] == len(prompts) + stats["failures"]
+        assert m.history == list(zip(prompts, expected))